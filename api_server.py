@@ -1,36 +1,150 @@
 import os
+import sys
 import json
+import argparse
+import hmac
 import threading
 import time
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from concurrent.futures import ThreadPoolExecutor
-from flask import Flask, request, jsonify, render_template_string, send_from_directory
+import uuid
+from flask import Blueprint, Flask, Response, request, jsonify, render_template_string, send_from_directory
 
 # 导入现有的视频处理模块
-from video_processor_v1 import process_single_video
+from video_processor_v1 import (
+    process_single_video, process_sidecar_subtitle, is_traditional_sidecar, set_subtitle_cache, set_line_cache,
+    configure_classification, estimate_remux_bytes, io_limits, prewarm_converter, simplified_sidecar_path,
+    throughput_kind, set_memory_limits, abort_on, AbortSignal,
+    OUTCOME_ERROR, OUTCOME_NOT_FOUND, OUTCOME_CONVERTED, OUTCOME_ALREADY_SIMPLIFIED, OUTCOME_NO_TRADITIONAL,
+    OUTCOME_NO_SUBTITLES, OUTPUT_MODES, REMUX_ENGINES, SAMPLING_STRATEGIES, SIMPLIFIED_SIDECAR_TAG
+)
+from subtitle_cache import SubtitleCache, LineConversionCache
+from config_manager import ConfigManager, freeze, thaw, overlay
+from throughput_history import ThroughputHistory
+from library_index import LibraryIndex, NamingRules, ConversionStateIndex, STATE_CONVERTED, is_glob
+from autoscaler import WorkerAutoscaler
+from memory_budget import MemoryBudget, ChildMemoryLimit, BoundedStatus, MB
+from job_scheduler import JobScheduler, BatchSchedule, PRIORITY_INTERACTIVE, PRIORITY_BATCH
+from io_throttle import IOLimits, IONICE_CLASSES
+from shared_queue import SQLiteJobQueue, QueueWorker
+from metrics import (REGISTRY, JOBS_TOTAL, QUEUE_DEPTH, WORKERS_TOTAL, WORKERS_BUSY,
+                     WORKER_UTILIZATION, JOBS_WAITING_FOR_DISK, DISK_HEADROOM_BYTES, MEMORY_RSS_BYTES,
+                     SUBTITLE_MEMORY_BYTES)
 
-app = Flask(__name__)
+# 路由注册在蓝图上，由 create_app() 创建应用并加载配置
+bp = Blueprint('video_converter', __name__)
+
+CONFIG_FILE = "data/config.json"
+
+# 修改后需要重启服务才能生效的配置
+RESTART_REQUIRED_KEYS = ('api_settings', 'cache_settings', 'cluster_settings', 'throughput_history_path')
+# 只能在配置文件中修改的字段：command_prefix 会加在每个 ffmpeg 命令前，其余字段决定读写的目录/文件或包含凭据，
+# PUT /config 请求中包含这些字段时拒绝整个请求
+FILE_ONLY_KEYS = (
+    ('api_settings',),
+    ('video_directory',),
+    ('smtp_settings',),
+    ('parallel_settings', 'command_prefix'),
+    ('cluster_settings',),
+    ('cache_settings', 'subtitle_cache_dir'),
+    ('cache_settings', 'line_cache_path'),
+    ('library_settings', 'conversion_state_path'),
+    ('throughput_history_path',),
+)
+# GET /config 中隐藏的字段
+MASKED_VALUE = '******'
+# 分析后跳过的处理结果：文件不变时再次处理结果相同，批量处理时直接排除
+# （ffprobe 或字幕分类失败时结果为 error，不会记录）
+SETTLED_OUTCOMES = (OUTCOME_ALREADY_SIMPLIFIED, OUTCOME_NO_TRADITIONAL, OUTCOME_NO_SUBTITLES)
 
 # 加载配置文件
-def load_config():
-    """加载配置文件"""
-    config_file = "data/config.json"
+def load_config(config_file=CONFIG_FILE, strict=False):
+    """加载配置文件
+    
+    strict 为 True（热加载）时，配置文件无法读取或解析会抛出 ValueError，而不是退回默认配置。
+    """
     default_config = {
         "replace_original": False,
         "output_suffix": "_simplified",
         "backup_original": True,
+        "output_mode": "remux",
+        "remux_engine": "ffmpeg",
         "max_file_size_mb": 500,
+        "throughput_history_path": "data/throughput.json",
         "allowed_extensions": [".mkv", ".mp4", ".avi", ".mov"],
         "video_directory": "download",
+        "library_settings": {
+            "index_ttl_seconds": 30,
+            "conversion_state_path": "data/conversion_state.json",
+            "files_page_size": 500,
+            "files_max_page_size": 5000
+        },
         "api_settings": {
             "host": "0.0.0.0",
             "port": 5000,
-            "debug": False
+            "debug": False,
+            "allow_config_update": False,
+            "config_token": ""
         },
         "parallel_settings": {
-            "max_workers": 3
+            "max_workers": 3,
+            "reserved_interactive_workers": 1,
+            "min_free_disk_mb": 1024,
+            "nice": 10,
+            "ionice_class": "best-effort",
+            "ionice_level": 7,
+            "command_prefix": [],
+            "read_limit_mb": 0,
+            "write_limit_mb": 0,
+            "job_read_limit_mb": 0,
+            "job_write_limit_mb": 0,
+            "io_limits_apply_to": "batch",
+            "batch_window": "",
+            "batch_idle_only": False,
+            "batch_idle_max_load": 1.0,
+            "autoscale": {
+                "enabled": True,
+                "min_workers": 1,
+                "max_workers": 0,
+                "interval_seconds": 15,
+                "cpu_high": 0.9,
+                "load_high": 1.5,
+                "pressure_high": 40,
+                "min_gain": 0.05,
+                "idle_intervals": 4
+            }
+        },
+        "cluster_settings": {
+            "mode": "standalone",
+            "queue_path": "data/jobs.db",
+            "lease_seconds": 120,
+            "heartbeat_interval": 30,
+            "poll_interval": 2,
+            "max_attempts": 3
+        },
+        "memory_settings": {
+            "subtitle_budget_mb": 256,
+            "admission_rss_mb": 1536,
+            "ffmpeg_memory_limit_mb": 0,
+            "status_max_entries": 2000
+        },
+        "classification_settings": {
+            "sampling_strategy": "head",
+            "sample_lines": 200,
+            "window_count": 5,
+            "window_seconds": 60,
+            "max_read_mb": 64,
+            "traditional_ratio_threshold": 0.1,
+            "min_cjk_chars": 10,
+            "metadata_first": True,
+            "metadata_min_score": 2,
+            "verify_fraction": 0.05
+        },
+        "cache_settings": {
+            "enable_subtitle_cache": True,
+            "subtitle_cache_dir": "data/subtitle_cache",
+            "subtitle_cache_max_mb": 256,
+            "line_cache_entries": 50000,
+            "line_cache_persist": False,
+            "line_cache_path": "data/line_cache.json"
         },
         "smtp_settings": {
             "enable_email_notification": True,
@@ -53,29 +167,358 @@ def load_config():
                     config[key] = value
             return config
         except Exception as e:
+            if strict:
+                raise ValueError(f"加载配置文件失败: {str(e)}")
             print(f"加载配置文件失败，使用默认配置: {str(e)}")
             return default_config
     else:
         print("配置文件不存在，使用默认配置")
         return default_config
 
-# 加载配置
-CONFIG = load_config()
+# 以下运行时状态由 init_runtime() 根据配置创建，导入模块时不加载配置、不启动线程
+CONFIG = None
+config_manager = None
+# 处理状态存储（只保留最近 memory_settings.status_max_entries 个已结束文件的状态）
+processing_status = BoundedStatus()
+parallel_settings = {}
+max_workers = 0
+reserved_interactive_workers = 0
+background_io_limits = None
+batch_schedule = None
+scheduler = None
+autoscaler = None
+memory_budget = None
+child_memory = None
+cache_settings = {}
+subtitle_cache = None
+line_cache = None
+throughput_history = None
+# 批量处理计划（/batch-plan），包含每个文件的判断结果，不放在 processing_status 中
+batch_plan_status = {}
+# 批量处理进度计数锁（批量文件会被多个工作线程并行处理）
+batch_lock = threading.Lock()
+# 检查文件是否已在排队和记录排队状态之间加锁，避免同一文件被并发请求重复提交
+submit_lock = threading.Lock()
+library_index = None
+conversion_index = None
+cluster_settings = {}
+cluster_mode = 'standalone'
+_shared_queue = None
 
-# 处理配置
-CONFIG["max_file_size"] = CONFIG["max_file_size_mb"] * 1024 * 1024
-CONFIG["allowed_extensions"] = set(CONFIG["allowed_extensions"])
-CONFIG.update(CONFIG["api_settings"])
+def prepare_config(raw_config):
+    """校验原始配置并计算派生字段，返回只读的配置快照（配置无效时抛出 ValueError）"""
+    config = dict(raw_config)
+    try:
+        config["max_file_size"] = config["max_file_size_mb"] * 1024 * 1024
+        config["allowed_extensions"] = set(config["allowed_extensions"])
+        config.update(config["api_settings"])
+        parallel = config.get('parallel_settings', {})
+        if int(parallel.get('max_workers', 3)) < 1:
+            raise ValueError("max_workers 必须大于 0")
+        memory = config.get('memory_settings', {})
+        if any(float(value) < 0 for value in memory.values()):
+            raise ValueError("memory_settings 不能为负数")
+        autoscale = parallel.get('autoscale', {})
+        if int(autoscale.get('min_workers', 1)) < 1:
+            raise ValueError("autoscale.min_workers 必须大于 0")
+        if 0 < int(autoscale.get('max_workers', 0)) < int(autoscale.get('min_workers', 1)):
+            raise ValueError("autoscale.max_workers 不能小于 min_workers")
+        if parallel.get('ionice_class', 'none') not in IONICE_CLASSES:
+            raise ValueError(f"不支持的 ionice 类别: {parallel.get('ionice_class')}")
+        BatchSchedule(window=parallel.get('batch_window') or None)
+    except (KeyError, TypeError) as e:
+        raise ValueError(f"配置无效: {str(e)}")
+    if config.get('output_mode', 'remux') not in OUTPUT_MODES:
+        raise ValueError(f"不支持的输出方式，支持: {', '.join(OUTPUT_MODES)}")
+    if config.get('remux_engine', 'ffmpeg') not in REMUX_ENGINES:
+        raise ValueError(f"不支持的封装方式，支持: {', '.join(REMUX_ENGINES)}")
+    sampling_strategy = config.get('classification_settings', {}).get('sampling_strategy', 'head')
+    if sampling_strategy not in SAMPLING_STRATEGIES:
+        raise ValueError(f"不支持的取样方式: {sampling_strategy}")
+    return freeze(config)
 
-# 处理状态存储
-processing_status = {}
+def build_parallel_runtime(config):
+    """根据 parallel_settings 设置线程数、后台任务 I/O 限制和批量时段（启动和热加载时调用）"""
+    global parallel_settings, max_workers, reserved_interactive_workers, background_io_limits, batch_schedule
+    
+    # 优先级调度器，用于并行处理（单文件请求优先于批量任务）
+    parallel_settings = config.get('parallel_settings', {})
+    max_workers = parallel_settings.get('max_workers', 3)
+    reserved_interactive_workers = parallel_settings.get('reserved_interactive_workers', 1)
+    
+    # 后台任务的 ffmpeg 优先级和读写限速，避免批量处理占满磁盘带宽影响播放
+    try:
+        background_io_limits = IOLimits.from_settings(parallel_settings)
+    except ValueError as e:
+        print(f"I/O 限制设置无效，不限制: {str(e)}")
+        background_io_limits = None
+    # 批量任务只在指定时段或系统空闲时开始
+    try:
+        batch_schedule = BatchSchedule(window=parallel_settings.get('batch_window') or None,
+                                       idle_only=parallel_settings.get('batch_idle_only', False),
+                                       idle_max_load=parallel_settings.get('batch_idle_max_load', 1.0))
+    except ValueError as e:
+        print(f"批量时段设置无效，不限制: {str(e)}")
+        batch_schedule = BatchSchedule()
+    
+    build_memory_runtime(config)
+    
+    # 字幕分类的取样方式和繁体字占比阈值
+    try:
+        configure_classification(config.get('classification_settings', {}))
+    except ValueError as e:
+        print(f"字幕分类设置无效，使用默认设置: {str(e)}")
 
-# 线程池执行器，用于并行处理
-max_workers = CONFIG.get('parallel_settings', {}).get('max_workers', 3)
-executor = ThreadPoolExecutor(max_workers=max_workers)
+def build_memory_runtime(config):
+    """根据 memory_settings 设置字幕内存预算、ffmpeg 内存上限和处理状态记录数（启动和热加载时调用）"""
+    global memory_budget, child_memory
+    memory = config.get('memory_settings', {})
+    # ffmpeg/ffprobe 子进程的地址空间上限（默认不限制），异常文件不会让单个 ffmpeg 占满容器内存
+    ffmpeg_limit = int(memory.get('ffmpeg_memory_limit_mb', 0) * MB)
+    if child_memory is None:
+        child_memory = ChildMemoryLimit(ffmpeg_limit)
+    else:
+        child_memory.limit_bytes = ffmpeg_limit
+    # 所有工作线程同时处理的字幕数据上限；预算用完或内存占用过高时调度器暂停开始新任务
+    budget_bytes = int(memory.get('subtitle_budget_mb', 256) * MB)
+    admission_rss_bytes = int(memory.get('admission_rss_mb', 1536) * MB)
+    if memory_budget is None:
+        memory_budget = MemoryBudget(budget_bytes, admission_rss_bytes, children=child_memory)
+    else:
+        memory_budget.configure(budget_bytes, admission_rss_bytes)
+    set_memory_limits(memory_budget, child_memory)
+    processing_status.max_entries = int(memory.get('status_max_entries', 2000))
+    processing_status.prune()
+
+def init_runtime(config, worker=False):
+    """根据配置快照（prepare_config）创建调度器、缓存等运行时状态（服务和工作节点共用）
+    
+    本进程内的调度器和自动调整线程数只在 standalone 模式下创建：api 模式只接收任务和查询状态，
+    工作节点（worker 为 True）由 QueueWorker 的线程领取任务。
+    """
+    global CONFIG, scheduler, autoscaler, cache_settings, subtitle_cache, line_cache, throughput_history
+    global cluster_settings, cluster_mode, _shared_queue, library_index, conversion_index
+    
+    CONFIG = config
+    build_parallel_runtime(CONFIG)
+    
+    # 集群模式：standalone 在本进程内处理；api 只负责接收任务和查询状态，
+    # 任务写入共享队列，由工作节点（python api_server.py --worker）领取执行
+    cluster_settings = CONFIG.get('cluster_settings', {})
+    cluster_mode = cluster_settings.get('mode', 'standalone')
+    _shared_queue = None
+    
+    # 媒体库目录索引：按文件名查找视频时复用一次遍历的结果
+    library_index = LibraryIndex(**library_index_settings(CONFIG))
+    # 每个文件最近一次的处理结果，批量处理前排除不会再有变化的文件
+    conversion_index = ConversionStateIndex(
+        CONFIG.get('library_settings', {}).get('conversion_state_path', 'data/conversion_state.json'))
+    
+    # 重新封装前按预计写入量预留磁盘空间，放不下的任务延后执行
+    if scheduler is not None:
+        scheduler.shutdown(wait=False)
+    if autoscaler is not None:
+        autoscaler.stop()
+    scheduler = None
+    autoscaler = None
+    if cluster_mode == 'standalone' and not worker:
+        scheduler = JobScheduler(max_workers=max_workers, reserved_interactive_workers=reserved_interactive_workers,
+                                 min_free_bytes=parallel_settings.get('min_free_disk_mb', 1024) * 1024 * 1024,
+                                 disk_paths=[CONFIG['video_directory']],
+                                 batch_gate=batch_schedule if batch_schedule.enabled else None,
+                                 memory_gate=memory_budget)
+        # 按排队情况和 CPU/磁盘负载在线调整线程数（由 create_app 启动）
+        autoscaler = WorkerAutoscaler(scheduler, parallel_settings.get('autoscale', {}), baseline=max_workers)
+    
+    # 字幕内容缓存：相同的字幕流在整个媒体库中只分类、转换一次
+    cache_settings = CONFIG.get('cache_settings', {})
+    subtitle_cache = None
+    if cache_settings.get('enable_subtitle_cache', True):
+        try:
+            subtitle_cache = SubtitleCache(
+                cache_settings.get('subtitle_cache_dir', 'data/subtitle_cache'),
+                max_bytes=cache_settings.get('subtitle_cache_max_mb', 256) * 1024 * 1024
+            )
+        except Exception as e:
+            print(f"初始化字幕缓存失败，不使用缓存: {str(e)}")
+    set_subtitle_cache(subtitle_cache)
+    
+    # 逐行转换缓存：同一季各集反复出现的台词、歌词只转换一次，可选持久化到磁盘
+    line_cache = None
+    if cache_settings.get('line_cache_entries', 50000) > 0:
+        line_cache = LineConversionCache(
+            max_entries=cache_settings.get('line_cache_entries', 50000),
+            persist_path=cache_settings.get('line_cache_path', 'data/line_cache.json') if cache_settings.get('line_cache_persist', False) else None
+        )
+    set_line_cache(line_cache)
+    
+    # 实际转换的写入量和耗时，用于 /batch-plan 估算处理时间
+    throughput_history = ThroughputHistory(CONFIG.get('throughput_history_path', 'data/throughput.json'))
+
+def library_index_settings(config):
+    """LibraryIndex 的参数：视频目录、允许的文件和索引有效时间"""
+    return {
+        'root': config['video_directory'],
+        'include': is_allowed_file,
+        'extensions': config['allowed_extensions'],
+        'ttl': config.get('library_settings', {}).get('index_ttl_seconds', 30),
+    }
+
+def apply_config_change(previous, config):
+    """配置热加载后更新运行时状态：调整线程池、I/O 限制和批量时段，正在执行的任务继续使用原配置"""
+    global CONFIG
+    CONFIG = config
+    build_parallel_runtime(config)
+    if scheduler is not None:
+        scheduler.min_free_bytes = max(0, int(parallel_settings.get('min_free_disk_mb', 1024) * 1024 * 1024))
+        scheduler.batch_gate = batch_schedule if batch_schedule.enabled else None
+        autoscaler.configure(parallel_settings.get('autoscale', {}), baseline=max_workers)
+        # 自动调整线程数时，max_workers 没有修改就保留当前线程数（限制在新的上下限内）
+        workers = max_workers
+        if autoscaler.enabled and previous.get('parallel_settings', {}).get('max_workers', 3) == max_workers:
+            workers = min(max(scheduler.max_workers, autoscaler.min_workers), autoscaler.max_workers)
+        # resize 同时唤醒等待中的线程，按新的批量时段和磁盘余量重新选择任务
+        scheduler.resize(workers, reserved_interactive_workers)
+    update_queue_metrics()
+    if any(previous.get(key) != config.get(key) for key in ('video_directory', 'allowed_extensions', 'library_settings')):
+        library_index.configure(**library_index_settings(config))
+    
+    pending = restart_required_keys(previous, config)
+    if pending:
+        print(f"以下配置修改需要重启服务才能生效: {', '.join(pending)}")
+
+def restart_required_keys(previous, config):
+    """两次配置之间有变化、但需要重启服务才能生效的字段"""
+    return [key for key in RESTART_REQUIRED_KEYS if previous.get(key) != config.get(key)]
+
+def create_app(config_file=CONFIG_FILE, config=None, prewarm=True, watch_config=True):
+    """创建 Flask 应用：加载配置、初始化运行时状态并注册路由
+    
+    Args:
+        config_file: 配置文件路径
+        config: 直接使用的配置字典（如基准测试），指定时不读取也不写回 config_file
+        prewarm: 是否在后台线程预先加载繁简转换词典，避免第一个转换请求等待
+        watch_config: 是否监视配置文件，修改后自动重新加载
+    """
+    global config_manager
+    if config_manager is not None:
+        config_manager.stop_watching()
+    config_manager = ConfigManager(
+        config_file if config is None else None,
+        loader=lambda path: load_config(path, strict=True),
+        prepare=prepare_config,
+        initial=config if config is not None else load_config(config_file)
+    )
+    init_runtime(config_manager.snapshot())
+    config_manager.subscribe(apply_config_change)
+    if watch_config:
+        config_manager.start_watching()
+    if autoscaler is not None:
+        autoscaler.start()
+    app = Flask(__name__)
+    app.register_blueprint(bp)
+    if prewarm:
+        threading.Thread(target=prewarm_converter, name="prewarm", daemon=True).start()
+    return app
+
+def get_shared_queue():
+    """获取共享任务队列（首次调用时打开数据库）"""
+    global _shared_queue
+    if _shared_queue is None:
+        _shared_queue = SQLiteJobQueue(
+            cluster_settings.get('queue_path', 'data/jobs.db'),
+            lease_seconds=cluster_settings.get('lease_seconds', 120),
+            max_attempts=cluster_settings.get('max_attempts', 3)
+        )
+    return _shared_queue
+
+def result_status(result):
+    """把 process_single_video 的处理结果映射为 completed/skipped/error"""
+    if result:
+        return 'completed'
+    if result.outcome in (OUTCOME_ERROR, OUTCOME_NOT_FOUND):
+        return 'error'
+    return 'skipped'
+
+def merge_frontend_config(frontend_config=None):
+    """合并前端配置和当前配置快照，返回本次任务使用的只读配置
+    
+    没有前端配置时直接返回当前快照；smtp_settings 等嵌套配置按字段合并。
+    任务在提交时调用一次，之后配置热加载不影响已提交的任务。
+    """
+    return overlay(CONFIG, frontend_config)
+
+def wants_sidecar(current_config):
+    """当前配置是否输出外挂字幕（sidecar/both 模式）"""
+    return current_config.get('output_mode', 'remux') in ('sidecar', 'both')
+
+def naming_rules(current_config):
+    """当前配置下本工具生成文件的命名规则"""
+    return NamingRules(output_suffix=current_config.get('output_suffix', '_simplified'),
+                       output_mode=current_config.get('output_mode', 'remux'),
+                       replace_original=current_config.get('replace_original', False),
+                       sidecar_tag=SIMPLIFIED_SIDECAR_TAG,
+                       sidecar_output=simplified_sidecar_path)
+
+def analysis_signature(current_config):
+    """影响字幕分类结果的设置，设置变化后之前跳过的文件需要重新分析"""
+    return json.dumps(thaw(current_config.get('classification_settings', {})), sort_keys=True)
+
+def record_conversion_state(file_path, current_config, result):
+    """记录处理结果：分析后跳过的文件，以及已原地替换（之后只会被判断为已是简体）的文件"""
+    try:
+        relative_path = os.path.relpath(file_path, CONFIG['video_directory'])
+    except ValueError:
+        return
+    if result.outcome in SETTLED_OUTCOMES:
+        conversion_index.record(relative_path, file_path, result.outcome, analysis_signature(current_config))
+    elif (result.outcome == OUTCOME_CONVERTED and not result.dry_run and
+          current_config.get('replace_original', False) and current_config.get('output_mode', 'remux') != 'sidecar' and
+          not is_traditional_sidecar(file_path)):
+        conversion_index.record(relative_path, file_path, result.outcome)
+    elif not result.dry_run:
+        conversion_index.forget(relative_path)
+
+def run_processing(file_path, current_config, dry_run=False, background=False):
+    """按配置处理一个文件：繁体外挂字幕直接转换，视频文件按 output_mode 输出
+    
+    dry_run 为 True 时只判断处理结果并估算写入量，不修改任何文件。
+    background 为 True（批量任务）时按 parallel_settings 降低 ffmpeg 优先级并限速。
+    """
+    apply_limits = background or parallel_settings.get('io_limits_apply_to', 'batch') == 'all'
+    with io_limits(background_io_limits if apply_limits else None):
+        if is_traditional_sidecar(file_path):
+            result = process_sidecar_subtitle(file_path, dry_run=dry_run)
+        else:
+            result = process_single_video(file_path,
+                                          replace_original=current_config.get('replace_original', False),
+                                          output_suffix=current_config.get('output_suffix', '_simplified'),
+                                          backup_original=current_config.get('backup_original', True),
+                                          output_mode=current_config.get('output_mode', 'remux'),
+                                          dry_run=dry_run,
+                                          remux_engine=current_config.get('remux_engine', 'ffmpeg'))
+    throughput_history.record(result)
+    if autoscaler is not None:
+        autoscaler.observe(result)
+    record_conversion_state(file_path, current_config, result)
+    return result
+
+def disk_reservation(file_path, current_config):
+    """提交任务时的磁盘预留参数：输出写在视频所在目录，预留重新封装（和备份）的写入量"""
+    return {
+        'disk_path': os.path.dirname(os.path.abspath(file_path)),
+        'disk_bytes': estimate_remux_bytes(file_path,
+                                           replace_original=current_config.get('replace_original', False),
+                                           backup_original=current_config.get('backup_original', True),
+                                           output_mode=current_config.get('output_mode', 'remux')),
+    }
 
 def is_allowed_file(filename):
     """检查文件扩展名是否允许（支持模糊匹配）"""
+    # 繁体外挂字幕（如 Episode.cht.srt）也可以单独转换
+    if is_traditional_sidecar(filename):
+        return True
+    
     # 如果文件名包含扩展名，检查扩展名
     if '.' in filename:
         ext = filename.rsplit('.', 1)[1].lower()
@@ -106,6 +549,11 @@ def send_email_notification(filename, status, message, config=None):
             print(f"跳过邮件通知: {filename} - 状态: {status}, 消息: {message}")
             return
         
+        # 邮件模块只在发送时导入，不影响启动速度
+        import smtplib
+        from email.mime.text import MIMEText
+        from email.mime.multipart import MIMEMultipart
+        
         # 创建邮件内容
         msg = MIMEMultipart()
         msg['From'] = smtp_config['sender_email']
@@ -144,69 +592,39 @@ def send_email_notification(filename, status, message, config=None):
         print(f"发送邮件通知失败: {str(e)}")
 
 def find_video_file(filename):
-    """在download目录及其子目录中查找视频文件（支持模糊搜索）"""
-    download_dir = CONFIG['video_directory']
-    
-    # 首先检查根目录（精确匹配）
-    root_path = os.path.join(download_dir, filename)
-    if os.path.exists(root_path):
-        return root_path
-    
-    # 递归搜索子目录（精确匹配）
-    for root, dirs, files in os.walk(download_dir):
-        if filename in files:
-            return os.path.join(root, filename)
-    
-    # 如果精确匹配失败，进行模糊搜索
-    # 获取文件名（不含扩展名）用于模糊匹配
-    base_name = os.path.splitext(filename)[0]
-    
-    # 模糊搜索：文件名匹配（忽略扩展名）
-    for root, dirs, files in os.walk(download_dir):
-        for file in files:
-            file_base_name = os.path.splitext(file)[0]
-            if file_base_name == base_name:
-                # 检查文件扩展名是否在允许的格式中
-                file_ext = os.path.splitext(file)[1].lower()
-                if file_ext in [ext.lower() for ext in CONFIG['allowed_extensions']]:
-                    return os.path.join(root, file)
-    
-    return None
-
-def process_video_async(filename, frontend_config=None):
-    """异步处理视频文件"""
+    """在download目录及其子目录中查找视频文件（先精确匹配，再忽略扩展名模糊匹配）"""
+    entry = library_index.find(filename)
+    return entry.full_path if entry else None
+
+def process_video_async(filename, current_config=None, video_path=None):
+    """异步处理视频文件
+    
+    current_config 是提交任务时取得的配置快照，video_path 是提交时找到的文件路径
+    （文件已被移动时重新查找）。
+    """
     try:
-        # 合并前端配置和默认配置
-        if frontend_config is None:
-            frontend_config = {}
-        
-        # 使用前端配置覆盖默认配置
-        current_config = CONFIG.copy()
-        
-        # 处理邮件配置
-        if 'smtp_settings' in frontend_config:
-            # 合并SMTP设置
-            current_smtp = current_config.get('smtp_settings', {}).copy()
-            current_smtp.update(frontend_config['smtp_settings'])
-            current_config['smtp_settings'] = current_smtp
-        
-        # 更新其他配置
-        for key, value in frontend_config.items():
-            if key != 'smtp_settings':
-                current_config[key] = value
+        if current_config is None:
+            current_config = CONFIG
+        
         # 在download目录及其子目录中查找文件
-        video_path = find_video_file(filename)
+        if not video_path or not os.path.exists(video_path):
+            video_path = find_video_file(filename)
         if not video_path:
             processing_status[filename] = {
                 'status': 'error',
                 'message': f'文件不存在: {filename}',
                 'end_time': time.time()
             }
+            JOBS_TOTAL.inc(outcome='error', lane='interactive')
             return
         
-        # 更新状态为处理中
+        # 更新状态为处理中（保留排队信息，便于查看排队等待时间）
+        queued_info = processing_status.get(filename, {})
         processing_status[filename] = {
             'status': 'processing',
+            'lane': 'interactive',
+            'job_id': queued_info.get('job_id'),
+            'queued_time': queued_info.get('queued_time'),
             'start_time': time.time(),
             'message': f'开始处理视频文件: {video_path}'
         }
@@ -214,36 +632,32 @@ def process_video_async(filename, frontend_config=None):
         # 检查文件大小
         file_size = os.path.getsize(video_path)
         if file_size > current_config['max_file_size']:
-            processing_status[filename] = {
+            processing_status[filename].update({
                 'status': 'error',
-                'message': f'文件过大: {file_size / (1024*1024):.1f}MB > {CONFIG["max_file_size"] / (1024*1024):.1f}MB',
+                'message': f'文件过大: {file_size / (1024*1024):.1f}MB > {current_config["max_file_size"] / (1024*1024):.1f}MB',
                 'end_time': time.time()
-            }
+            })
+            JOBS_TOTAL.inc(outcome='error', lane='interactive')
             return
         
         # 执行视频处理，传递配置参数
-        result = process_single_video(video_path, 
-                                    replace_original=current_config.get('replace_original', False),
-                                    output_suffix=current_config.get('output_suffix', '_simplified'),
-                                    backup_original=current_config.get('backup_original', True))
+        result = run_processing(video_path, current_config)
         
-        # 更新处理结果
-        if result:
-            processing_status[filename] = {
-                'status': 'completed',
-                'message': '视频处理完成',
-                'end_time': time.time()
-            }
+        # 更新处理结果（包含处理原因和各阶段耗时，便于排查慢文件）
+        status = result_status(result)
+        processing_status[filename].update({
+            'status': status,
+            'message': result.message,
+            'result': result.to_dict(),
+            'end_time': time.time()
+        })
+        JOBS_TOTAL.inc(outcome=status, lane='interactive')
+        if status == 'completed':
             # 发送邮件通知（使用前端配置）
             send_email_notification(filename, 'completed', '视频处理完成', current_config)
         else:
-            processing_status[filename] = {
-                'status': 'skipped',
-                'message': '视频无需处理（可能已包含简体字幕或无需转换）',
-                'end_time': time.time()
-            }
-            # 跳过处理的文件不发送邮件通知（根据需求只对处理完成的文件发送邮件）
-            print(f"文件 {filename} 无需处理，不发送邮件通知")
+            # 跳过或失败的文件不发送邮件通知（根据需求只对处理完成的文件发送邮件）
+            print(f"文件 {filename} 未转换（{result.outcome}），不发送邮件通知")
             
     except Exception as e:
         processing_status[filename] = {
@@ -251,10 +665,133 @@ def process_video_async(filename, frontend_config=None):
             'message': f'处理过程中发生错误: {str(e)}',
             'end_time': time.time()
         }
+        JOBS_TOTAL.inc(outcome='error', lane='interactive')
         # 错误情况下不发送邮件通知（根据需求只对处理完成的文件发送邮件）
         print(f"文件 {filename} 处理失败，不发送邮件通知")
 
-@app.route('/process', methods=['POST'])
+def shared_job_status(job):
+    """把共享队列中的任务记录转换为 processing_status 格式"""
+    status_map = {'running': 'processing'}
+    status_info = {
+        'status': status_map.get(job['status'], job['status']),
+        'job_id': job['job_id'],
+        'lane': 'interactive' if job['priority'] == PRIORITY_INTERACTIVE else 'batch',
+        'queued_time': job['created_at'],
+        'worker_id': job['worker_id'],
+        'attempts': job['attempts'],
+        'message': job['message'] or '等待工作节点处理'
+    }
+    if job['started_at']:
+        status_info['start_time'] = job['started_at']
+    if job['finished_at']:
+        status_info['end_time'] = job['finished_at']
+    if job['result']:
+        status_info['result'] = job['result']
+    return status_info
+
+def refresh_shared_batch_status(batch_id):
+    """根据共享队列中的记录刷新批量处理进度"""
+    counts = get_shared_queue().batch_counts(batch_id)
+    batch_status = processing_status['batch_convert']
+    batch_status.update({
+        'processed_files': counts.get('completed', 0),
+        'skipped_files': counts.get('skipped', 0),
+        'error_files': counts.get('error', 0)
+    })
+    if not counts.get('queued') and not counts.get('running') and batch_status['status'] == 'processing':
+        batch_status.update({
+            'status': 'completed',
+            'end_time': time.time(),
+            'message': f"批量处理完成: 成功 {batch_status['processed_files']} 个，跳过 {batch_status['skipped_files']} 个，错误 {batch_status['error_files']} 个"
+        })
+
+def run_shared_job(job, abort=None):
+    """工作节点执行共享队列中的任务，返回 (status, message, result)
+    
+    abort: 任务租约丢失时被设置的 AbortSignal，处理在修改原文件前中止
+    """
+    filename = job['filename']
+    video_path = os.path.join(CONFIG['video_directory'], job['relative_path'])
+    if not os.path.isfile(video_path):
+        return 'error', f'文件不存在: {filename}'
+    
+    current_config = merge_frontend_config(job['config'])
+    file_size = os.path.getsize(video_path)
+    if file_size > current_config['max_file_size']:
+        return 'error', f'文件过大: {file_size / (1024*1024):.1f}MB > {current_config["max_file_size"] / (1024*1024):.1f}MB'
+    
+    with abort_on(abort):
+        result = run_processing(video_path, current_config, background=job['priority'] == PRIORITY_BATCH)
+    status = result_status(result)
+    if status == 'completed':
+        send_email_notification(filename, 'completed', '视频处理完成', current_config)
+    return status, result.message, result.to_dict()
+
+def shared_job_source_lock(job):
+    """工作节点处理任务时在源文件旁边创建的锁文件（.<文件名>.lock），同一文件同时只被一个节点处理"""
+    video_path = os.path.join(CONFIG['video_directory'], job['relative_path'])
+    directory, name = os.path.split(video_path)
+    return os.path.join(directory, f".{name}.lock")
+
+def shared_job_disk_reservation(job):
+    """工作节点领取任务后的磁盘预留参数（与 /process 提交时相同）"""
+    video_path = os.path.join(CONFIG['video_directory'], job['relative_path'])
+    if not os.path.isfile(video_path):
+        return {}
+    return disk_reservation(video_path, merge_frontend_config(job['config']))
+
+def run_worker(worker_id=None):
+    """以工作节点模式运行：从共享队列领取任务并处理"""
+    worker = QueueWorker(
+        get_shared_queue(),
+        run_shared_job,
+        threads=max_workers,
+        reserved_interactive_threads=reserved_interactive_workers,
+        interactive_priority=PRIORITY_INTERACTIVE,
+        heartbeat_interval=cluster_settings.get('heartbeat_interval', 30),
+        poll_interval=cluster_settings.get('poll_interval', 2),
+        worker_id=worker_id,
+        batch_gate=batch_schedule if batch_schedule.enabled else None,
+        # 与单机模式的调度器相同的准入条件：内存紧张时不领取新任务，按预计写入量预留磁盘空间
+        memory_gate=memory_budget,
+        disk_reservation=shared_job_disk_reservation,
+        min_free_bytes=parallel_settings.get('min_free_disk_mb', 1024) * 1024 * 1024,
+        # 租约丢失时结束 ffmpeg 并在替换原文件前中止，源文件加锁避免两个节点同时处理
+        abort_factory=AbortSignal,
+        source_lock=shared_job_source_lock
+    )
+    worker.run()
+
+def is_pending(filename):
+    """文件是否已在排队或处理中（本进程内的调度器）"""
+    status = processing_status.get(filename)
+    return bool(status) and status['status'] in ('queued', 'processing')
+
+def queued_status(job_id):
+    """单文件任务的排队状态"""
+    return {
+        'status': 'queued',
+        'lane': 'interactive',
+        'job_id': job_id,
+        'queued_time': time.time(),
+        'message': '等待处理'
+    }
+
+def rollback_queued(queued):
+    """提交失败时撤销排队状态，否则文件一直显示排队中，重新提交也会返回 409
+
+    queued: [(文件名, 任务ID, 之前的状态)]，只撤销仍是本次写入的排队状态
+    """
+    with submit_lock:
+        for filename, job_id, previous in queued:
+            if processing_status.get(filename, {}).get('job_id') != job_id:
+                continue
+            if previous is None:
+                processing_status.pop(filename, None)
+            else:
+                processing_status[filename] = previous
+
+@bp.route('/process', methods=['POST'])
 def process_video():
     """处理视频文件的API端点"""
     try:
@@ -284,6 +821,11 @@ def process_video():
                 'error': '文件名包含非法路径字符'
             }), 400
         
+        if frontend_config.get('output_mode', CONFIG.get('output_mode', 'remux')) not in OUTPUT_MODES:
+            return jsonify({
+                'error': f'不支持的输出方式，支持: {", ".join(OUTPUT_MODES)}'
+            }), 400
+        
         # 检查文件扩展名
         if not is_allowed_file(filename):
             return jsonify({
@@ -297,19 +839,52 @@ def process_video():
                 'error': f'文件不存在: {filename}'
             }), 404
         
-        # 检查是否已在处理中
-        if filename in processing_status and processing_status[filename]['status'] == 'processing':
+        # api 模式：写入共享队列，由工作节点处理
+        if cluster_mode == 'api':
+            # 检查和写入在同一个事务中，多个 API 节点同时提交同一文件时只写入一次
+            [(_, job_id, duplicate)] = get_shared_queue().enqueue_many(
+                [(filename, os.path.relpath(video_path, CONFIG['video_directory']))],
+                config=frontend_config,
+                priority=PRIORITY_INTERACTIVE
+            )
+            if duplicate:
+                return jsonify({
+                    'error': '文件正在处理中'
+                }), 409
             return jsonify({
-                'error': '文件正在处理中'
-            }), 409
+                'message': '视频处理请求已接受',
+                'filename': filename,
+                'job_id': job_id,
+                'status': 'accepted'
+            }), 200
+        
+        # 检查是否已在排队或处理中
+        with submit_lock:
+            if is_pending(filename):
+                return jsonify({
+                    'error': '文件正在处理中'
+                }), 409
+            
+            # 先记录排队状态再提交，避免覆盖已开始执行的任务状态
+            job_id = uuid.uuid4().hex
+            previous = processing_status.get(filename)
+            processing_status[filename] = queued_status(job_id)
         
-        # 启动异步处理（使用线程池），传递前端配置
-        future = executor.submit(process_video_async, filename, frontend_config)
+        # 提交到交互通道（优先于批量任务），任务使用提交时的配置快照
+        try:
+            job_config = merge_frontend_config(frontend_config)
+            scheduler.submit(process_video_async, filename, job_config, video_path,
+                             priority=PRIORITY_INTERACTIVE, key=filename, job_id=job_id,
+                             **disk_reservation(video_path, job_config))
+        except Exception:
+            rollback_queued([(filename, job_id, previous)])
+            raise
         
         # 立即返回200状态
         return jsonify({
             'message': '视频处理请求已接受',
             'filename': filename,
+            'job_id': job_id,
             'status': 'accepted'
         }), 200
         
@@ -318,15 +893,107 @@ def process_video():
             'error': f'服务器内部错误: {str(e)}'
         }), 500
 
-@app.route('/status/<filename>', methods=['GET'])
+@bp.route('/process/bulk', methods=['POST'])
+def process_video_bulk():
+    """一次提交多个文件：文件名或通配符（如 "Show S01E*.mkv"、"Show/Season 1/*"）在一次目录索引查找中解析，
+    所有任务一起放入交互通道；已在排队或处理中的文件不重复提交，返回已有任务的ID
+    """
+    try:
+        data = request.get_json(silent=True)
+        names = data.get('filenames') if isinstance(data, dict) else None
+        if not isinstance(names, list) or not names or not all(isinstance(name, str) and name for name in names):
+            return jsonify({
+                'error': 'filenames必须是非空的文件名或通配符列表'
+            }), 400
+        
+        frontend_config = data.get('config', {})
+        if frontend_config.get('output_mode', CONFIG.get('output_mode', 'remux')) not in OUTPUT_MODES:
+            return jsonify({
+                'error': f'不支持的输出方式，支持: {", ".join(OUTPUT_MODES)}'
+            }), 400
+        
+        # 通配符可以匹配相对路径（包含 /），但都不能包含路径遍历
+        rejected = []
+        lookup = []
+        for name in dict.fromkeys(names):
+            if '..' in name or (not is_glob(name) and ('/' in name or '\\' in name)):
+                rejected.append({'filename': name, 'error': '文件名包含非法路径字符'})
+            elif not is_glob(name) and not is_allowed_file(name):
+                rejected.append({'filename': name, 'error': '不支持的文件类型'})
+            else:
+                lookup.append(name)
+        
+        entries, not_found = library_index.resolve(lookup)
+        job_config = merge_frontend_config(frontend_config)
+        accepted = []
+        duplicates = []
+        
+        # api 模式：在一个事务中写入共享队列
+        if cluster_mode == 'api':
+            results = get_shared_queue().enqueue_many(
+                [(entry.filename, entry.relative_path) for entry in entries],
+                config=frontend_config, priority=PRIORITY_INTERACTIVE
+            )
+            for entry, (filename, job_id, duplicate) in zip(entries, results):
+                item = {'filename': filename, 'relative_path': entry.relative_path, 'job_id': job_id}
+                (duplicates if duplicate else accepted).append(item)
+        else:
+            calls = []
+            queued = []
+            try:
+                with submit_lock:
+                    for entry in entries:
+                        item = {'filename': entry.filename, 'relative_path': entry.relative_path}
+                        # 已在处理中的文件（包括本次请求中不同目录下的同名文件，状态按文件名记录）不重复提交
+                        if is_pending(entry.filename):
+                            item['job_id'] = processing_status[entry.filename].get('job_id')
+                            item['status'] = processing_status[entry.filename]['status']
+                            duplicates.append(item)
+                            continue
+                        item['job_id'] = uuid.uuid4().hex
+                        queued.append((entry.filename, item['job_id'], processing_status.get(entry.filename)))
+                        processing_status[entry.filename] = queued_status(item['job_id'])
+                        calls.append({
+                            'args': (entry.filename, job_config, entry.full_path),
+                            'key': entry.filename,
+                            'job_id': item['job_id'],
+                            **disk_reservation(entry.full_path, job_config)
+                        })
+                        accepted.append(item)
+                scheduler.submit_many(process_video_async, calls, priority=PRIORITY_INTERACTIVE)
+            except Exception:
+                rollback_queued(queued)
+                raise
+        
+        return jsonify({
+            'message': f'已接受 {len(accepted)} 个文件，{len(duplicates)} 个已在处理中',
+            'accepted': accepted,
+            'duplicates': duplicates,
+            'not_found': not_found,
+            'rejected': rejected
+        }), 200 if accepted or duplicates else 404
+        
+    except Exception as e:
+        return jsonify({
+            'error': f'服务器内部错误: {str(e)}'
+        }), 500
+
+@bp.route('/status/<filename>', methods=['GET'])
 def get_status(filename):
     """获取文件处理状态"""
-    if filename not in processing_status:
+    if cluster_mode == 'api':
+        job = get_shared_queue().latest_job_for(filename)
+        if job is not None:
+            processing_status[filename] = shared_job_status(job)
+    
+    # 已结束的状态可能随时被删除（memory_settings.status_max_entries），只读取一次
+    status_info = processing_status.get(filename)
+    if status_info is None:
         return jsonify({
             'error': '文件未找到或未开始处理'
         }), 404
     
-    status_info = processing_status[filename].copy()
+    status_info = status_info.copy()
     
     # 计算处理时间
     if 'start_time' in status_info:
@@ -337,127 +1004,427 @@ def get_status(filename):
     
     return jsonify(status_info), 200
 
-@app.route('/status', methods=['GET'])
+@bp.route('/status', methods=['GET'])
 def get_all_status():
     """获取所有文件处理状态和系统信息"""
-    # 统计各状态的文件数量
+    # 统计各状态的文件数量（工作线程同时在写入，使用加锁复制的快照）
+    all_status = processing_status.snapshot()
     status_counts = {}
-    for status_info in processing_status.values():
+    for status_info in all_status.values():
         status = status_info.get('status', 'unknown')
         status_counts[status] = status_counts.get(status, 0) + 1
     
-    return jsonify({
-        'total_files': len(processing_status),
+    response = {
+        'total_files': len(all_status),
         'status_counts': status_counts,
-        'max_parallel_workers': max_workers,
-        'files': processing_status
-    }), 200
+        'max_parallel_workers': scheduler.max_workers if scheduler is not None else max_workers,
+        'cluster_mode': cluster_mode,
+        'files': all_status
+    }
+    if cluster_mode == 'api':
+        response['shared_queue'] = get_shared_queue().stats()
+    if subtitle_cache is not None:
+        response['subtitle_cache'] = subtitle_cache.stats()
+    if line_cache is not None:
+        response['line_cache'] = line_cache.stats()
+    response['library_index'] = library_index.stats()
+    response['conversion_state'] = conversion_index.stats()
+    response['evicted_status_entries'] = processing_status.evicted
+    
+    return jsonify(response), 200
 
-@app.route('/queue', methods=['GET'])
+@bp.route('/queue', methods=['GET'])
 def get_queue_info():
     """获取处理队列信息"""
-    processing_count = sum(1 for status in processing_status.values() if status.get('status') == 'processing')
-    pending_count = len(processing_status) - processing_count
+    if cluster_mode == 'api':
+        shared_stats = get_shared_queue().stats()
+        counts = shared_stats['counts']
+        lanes = {}
+        for lane, priority in (('interactive', PRIORITY_INTERACTIVE), ('batch', PRIORITY_BATCH)):
+            lanes[lane] = {
+                'queued': counts.get('queued', {}).get(priority, 0),
+                'running': counts.get('running', {}).get(priority, 0)
+            }
+        return jsonify({
+            'cluster_mode': cluster_mode,
+            'active_workers': shared_stats['active_workers'],
+            'currently_processing': sum(counts.get('running', {}).values()),
+            'pending': sum(counts.get('queued', {}).values()),
+            'lanes': lanes
+        }), 200
+    
+    stats = scheduler.stats()
+    
+    return jsonify({
+        'max_workers': stats['max_workers'],
+        'reserved_interactive_workers': stats['reserved_interactive_workers'],
+        'batch_capacity': stats['batch_capacity'],
+        'currently_processing': stats['busy_workers'],
+        'pending': sum(stats['queued'].values()),
+        'available_slots': stats['idle_workers'],
+        'waiting_for_disk': stats['waiting_for_disk'],
+        'batch_paused': stats['batch_paused'],
+        'batch_window': batch_schedule.window_text,
+        'batch_idle_only': batch_schedule.idle_only,
+        'io_limits': background_io_limits.stats() if background_io_limits else None,
+        'disk': stats['disk'],
+        'memory_paused': stats['memory_paused'],
+        'memory': memory_budget.stats(),
+        'autoscale': autoscaler.stats(),
+        'lanes': {
+            lane: {
+                'queued': stats['queued'].get(lane, 0),
+                'running': stats['running'].get(lane, 0)
+            }
+            for lane in stats['queued']
+        }
+    }), 200
+
+def update_queue_metrics():
+    """根据调度器或共享队列的当前状态刷新队列深度和线程利用率指标"""
+    if cluster_mode == 'api':
+        counts = get_shared_queue().stats()['counts']
+        for lane, priority in (('interactive', PRIORITY_INTERACTIVE), ('batch', PRIORITY_BATCH)):
+            QUEUE_DEPTH.set(counts.get('queued', {}).get(priority, 0), lane=lane)
+        WORKERS_BUSY.set(sum(counts.get('running', {}).values()))
+        return
     
+    stats = scheduler.stats()
+    for lane, count in stats['queued'].items():
+        QUEUE_DEPTH.set(count, lane=lane)
+    WORKERS_TOTAL.set(stats['max_workers'])
+    WORKERS_BUSY.set(stats['busy_workers'])
+    WORKER_UTILIZATION.set(round(stats['busy_workers'] / stats['max_workers'], 3))
+    JOBS_WAITING_FOR_DISK.set(stats['waiting_for_disk'])
+    rss = memory_budget.rss_bytes()
+    if rss is not None:
+        MEMORY_RSS_BYTES.set(rss)
+    SUBTITLE_MEMORY_BYTES.set(memory_budget.in_use)
+    for disk in stats['disk']:
+        if disk['headroom_bytes'] is not None:
+            DISK_HEADROOM_BYTES.set(disk['headroom_bytes'], path=disk['path'])
+
+def masked_config(raw_config):
+    """隐藏邮箱密码和配置修改令牌后的配置，用于 GET/PUT /config 的响应"""
+    config = thaw(raw_config)
+    smtp = config.get('smtp_settings')
+    if isinstance(smtp, dict) and smtp.get('sender_password'):
+        smtp['sender_password'] = MASKED_VALUE
+    api = config.get('api_settings')
+    if isinstance(api, dict) and api.get('config_token'):
+        api['config_token'] = MASKED_VALUE
+    return config
+
+def file_only_keys(patch):
+    """PUT /config 请求中只能在配置文件中修改的字段"""
+    found = []
+    for path in FILE_ONLY_KEYS:
+        node = patch
+        for key in path:
+            if not isinstance(node, dict) or key not in node:
+                break
+            node = node[key]
+        else:
+            found.append('.'.join(path))
+    return found
+
+@bp.route('/config', methods=['GET'])
+def get_config():
+    """获取当前配置（邮箱密码已隐藏）"""
     return jsonify({
-        'max_workers': max_workers,
-        'currently_processing': processing_count,
-        'pending': pending_count,
-        'available_slots': max_workers - processing_count
+        'version': config_manager.version,
+        'config_file': config_manager.config_file,
+        'config': masked_config(config_manager.raw())
     }), 200
 
-@app.route('/files', methods=['GET'])
+@bp.route('/config', methods=['PUT'])
+def update_config():
+    """修改配置并写回配置文件，线程数、文件大小上限、邮件等设置立即生效
+    
+    请求体只需包含要修改的字段，嵌套配置按字段合并，如 {"parallel_settings": {"max_workers": 4}}。
+    需要在配置文件中设置 api_settings.allow_config_update；设置了 api_settings.config_token 时
+    请求头 X-Config-Token 必须与之相同。FILE_ONLY_KEYS 中的字段只能在配置文件中修改。
+    """
+    if not CONFIG.get('allow_config_update', False):
+        return jsonify({
+            'error': '已禁止通过 API 修改配置'
+        }), 403
+    
+    token = CONFIG.get('config_token')
+    if token and not hmac.compare_digest(request.headers.get('X-Config-Token', ''), token):
+        return jsonify({
+            'error': '配置修改令牌无效'
+        }), 401
+    
+    patch = request.get_json(silent=True)
+    if not isinstance(patch, dict) or not patch:
+        return jsonify({
+            'error': '请求体必须是非空的JSON对象'
+        }), 400
+    
+    rejected = file_only_keys(patch)
+    if rejected:
+        return jsonify({
+            'error': f'以下字段只能在配置文件中修改: {", ".join(rejected)}'
+        }), 400
+    
+    try:
+        previous, current = config_manager.update(patch)
+    except ValueError as e:
+        return jsonify({
+            'error': str(e)
+        }), 400
+    except OSError as e:
+        return jsonify({
+            'error': f'写入配置文件失败: {str(e)}'
+        }), 500
+    
+    return jsonify({
+        'message': '配置已更新',
+        'version': config_manager.version,
+        'restart_required': restart_required_keys(previous, current),
+        'config': masked_config(config_manager.raw())
+    }), 200
+
+@bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    """以 Prometheus 文本格式导出指标"""
+    update_queue_metrics()
+    return Response(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+# /files 的文件状态：本次运行中处理过的文件与 processing_status 中的状态相同；其余按转换状态索引：
+# derived（本工具生成的输出/备份文件）、converted（已有输出文件或已原地替换）、skipped（之前分析后跳过）、new
+FILE_STATES = ('new', 'queued', 'processing', 'completed', 'skipped', 'error', 'derived', 'converted')
+
+def file_state(entry, catalog, rules, signature):
+    """文件的转换状态"""
+    status = processing_status.get(entry.filename)
+    if status:
+        return status.get('status', 'new')
+    state = catalog.conversion_state(entry, rules)
+    if state is not None:
+        return state
+    outcome = conversion_index.settled(entry, signature)
+    if outcome is None:
+        return 'new'
+    return STATE_CONVERTED if outcome == OUTCOME_CONVERTED else 'skipped'
+
+def parse_file_filters(args):
+    """解析 /files 的查询参数，返回筛选函数列表；参数无效时抛出 ValueError"""
+    filters = []
+    directory = args.get('directory', '').strip('/')
+    if directory and directory != '.':
+        prefix = directory + '/'
+        filters.append(lambda entry, state: entry_directory(entry) == directory or
+                       entry_directory(entry).startswith(prefix))
+    if args.get('ext'):
+        extensions = {'.' + ext.strip().lower().lstrip('.') for ext in args['ext'].split(',') if ext.strip()}
+        filters.append(lambda entry, state: os.path.splitext(entry.filename)[1].lower() in extensions)
+    if args.get('min_size_mb'):
+        min_size = float(args['min_size_mb']) * 1024 * 1024
+        filters.append(lambda entry, state: entry.size >= min_size)
+    if args.get('max_size_mb'):
+        max_size = float(args['max_size_mb']) * 1024 * 1024
+        filters.append(lambda entry, state: entry.size <= max_size)
+    if args.get('q'):
+        keyword = args['q'].lower()
+        filters.append(lambda entry, state: keyword in entry.relative_path.lower())
+    if args.get('state'):
+        states = {state.strip() for state in args['state'].split(',') if state.strip()}
+        unknown = states - set(FILE_STATES)
+        if unknown:
+            raise ValueError(f"不支持的状态: {', '.join(sorted(unknown))}，支持: {', '.join(FILE_STATES)}")
+        filters.append(lambda entry, state: state in states)
+    return filters
+
+def entry_directory(entry):
+    """文件所在的相对目录（/ 分隔，根目录为 .）"""
+    directory = os.path.dirname(entry.relative_path)
+    return directory.replace(os.sep, '/') if directory else '.'
+
+@bp.route('/files', methods=['GET'])
 def list_video_files():
-    """列出download目录下所有视频文件"""
+    """分页列出download目录下的视频文件
+    
+    查询参数: offset、limit（默认 library_settings.files_page_size）、directory（相对目录，包含子目录）、
+    ext（逗号分隔的扩展名）、min_size_mb、max_size_mb、q（路径关键字）、state（逗号分隔的转换状态）、
+    full_path=1（返回完整路径）、refresh=1（重新遍历目录）。
+    
+    文件列表来自缓存的目录索引，响应带 ETag，列表未变化时返回 304。
+    """
     try:
-        download_dir = CONFIG['video_directory']
-        video_files = []
+        library_settings = CONFIG.get('library_settings', {})
+        try:
+            offset = max(0, int(request.args.get('offset', 0)))
+            limit = int(request.args.get('limit', library_settings.get('files_page_size', 500)))
+            limit = max(1, min(limit, library_settings.get('files_max_page_size', 5000)))
+            filters = parse_file_filters(request.args)
+        except ValueError as e:
+            return jsonify({
+                'error': f'查询参数无效: {str(e)}'
+            }), 400
+        include_full_path = request.args.get('full_path') in ('1', 'true')
         
-        # 递归搜索所有视频文件
-        for root, dirs, files in os.walk(download_dir):
-            for file in files:
-                if is_allowed_file(file):
-                    # 计算相对路径
-                    rel_path = os.path.relpath(os.path.join(root, file), download_dir)
-                    full_path = os.path.join(root, file)
-                    
-                    # 获取文件信息
-                    try:
-                        file_size = os.path.getsize(full_path)
-                        file_info = {
-                            'filename': file,
-                            'relative_path': rel_path,
-                            'full_path': full_path,
-                            'size_mb': round(file_size / (1024 * 1024), 2),
-                            'directory': os.path.dirname(rel_path) if os.path.dirname(rel_path) else '.'
-                        }
-                        video_files.append(file_info)
-                    except Exception as e:
-                        print(f"获取文件信息失败 {file}: {str(e)}")
-                        continue
+        catalog = library_index.catalog(max_age=0 if request.args.get('refresh') in ('1', 'true') else None)
+        rules = naming_rules(CONFIG)
+        signature = analysis_signature(CONFIG)
+        matched = []
+        for entry in catalog.entries:
+            state = file_state(entry, catalog, rules, signature)
+            if all(check(entry, state) for check in filters):
+                matched.append((entry, state))
         
-        return jsonify({
-            'total_files': len(video_files),
+        video_files = []
+        for entry, state in matched[offset:offset + limit]:
+            file_info = {
+                'filename': entry.filename,
+                'relative_path': entry.relative_path,
+                'size_mb': round(entry.size / (1024 * 1024), 2),
+                'mtime': entry.mtime,
+                'directory': entry_directory(entry),
+                'state': state
+            }
+            if include_full_path:
+                file_info['full_path'] = entry.full_path
+            video_files.append(file_info)
+        
+        next_offset = offset + limit if offset + limit < len(matched) else None
+        response = jsonify({
+            'total_files': len(matched),
+            'offset': offset,
+            'limit': limit,
+            'next_offset': next_offset,
             'files': video_files
-        }), 200
+        })
+        # 浏览器每次都用 If-None-Match 重新验证，列表未变化时只返回 304
+        response.headers['Cache-Control'] = 'no-cache'
+        response.add_etag()
+        return response.make_conditional(request)
         
     except Exception as e:
         return jsonify({
             'error': f'获取文件列表失败: {str(e)}'
         }), 500
 
-def get_eligible_video_files():
-    """获取所有符合条件的视频文件列表"""
-    download_dir = CONFIG['video_directory']
+def get_eligible_video_files(current_config, rescan=False):
+    """获取需要处理的文件列表，返回 (文件列表, 各排除原因的文件数)
+    
+    按命名规则排除本工具生成的派生文件（*_simplified、*_backup）和旁边已有输出文件的源文件，
+    再按转换状态索引排除之前分析后跳过、文件未变化的文件（rescan 为 True 时不排除这一类）。
+    sidecar/both 模式同时返回已有的繁体外挂字幕（如 Episode.cht.srt）。
+    """
+    include_sidecars = wants_sidecar(current_config)
+    rules = naming_rules(current_config)
+    signature = analysis_signature(current_config)
+    # 每次批量处理重新遍历目录，不使用过期的索引
+    catalog = library_index.catalog(max_age=0)
     eligible_files = []
+    excluded = {}
     
-    # 递归搜索所有视频文件
-    for root, dirs, files in os.walk(download_dir):
-        for file in files:
-            if is_allowed_file(file):
-                full_path = os.path.join(root, file)
-                
-                # 检查文件大小
-                try:
-                    file_size = os.path.getsize(full_path)
-                    if file_size <= CONFIG['max_file_size']:
-                        # 计算相对路径
-                        rel_path = os.path.relpath(full_path, download_dir)
-                        eligible_files.append({
-                            'filename': file,
-                            'relative_path': rel_path,
-                            'full_path': full_path,
-                            'size_mb': round(file_size / (1024 * 1024), 2)
-                        })
-                except Exception as e:
-                    print(f"检查文件大小失败 {file}: {str(e)}")
-                    continue
+    for entry in catalog.entries:
+        if is_traditional_sidecar(entry.filename) and not include_sidecars:
+            continue
+        if entry.size > current_config['max_file_size']:
+            continue
+        reason = catalog.conversion_state(entry, rules)
+        if reason is None and not rescan and conversion_index.settled(entry, signature):
+            reason = 'settled'
+        if reason is not None:
+            excluded[reason] = excluded.get(reason, 0) + 1
+            continue
+        eligible_files.append({
+            'filename': entry.filename,
+            'relative_path': entry.relative_path,
+            'full_path': entry.full_path,
+            'size_mb': round(entry.size / (1024 * 1024), 2)
+        })
     
-    return eligible_files
+    return eligible_files, excluded
 
-def process_batch_convert_async(frontend_config=None):
-    """异步批量处理所有符合条件的视频文件"""
+def _record_batch_outcome(outcome, filename=None, result=None):
+    """更新批量处理进度计数（outcome: processed/skipped/error），并汇总处理原因和各阶段耗时"""
+    JOBS_TOTAL.inc(outcome={'processed': 'completed'}.get(outcome, outcome), lane='batch')
+    with batch_lock:
+        batch_status = processing_status['batch_convert']
+        batch_status[f'{outcome}_files'] += 1
+        if filename:
+            batch_status['current_file'] = filename
+        if result is not None:
+            summary = result.to_dict()
+            reasons = batch_status.setdefault('outcome_counts', {})
+            reasons[result.outcome] = reasons.get(result.outcome, 0) + 1
+            stage_totals = batch_status.setdefault('stage_totals', {})
+            for stage, info in summary['stages'].items():
+                stage_totals[stage] = round(stage_totals.get(stage, 0) + info['wall'], 3)
+            batch_status['subtitle_bytes'] = batch_status.get('subtitle_bytes', 0) + summary['subtitle_bytes']
+            # 只保留最慢的几个文件，便于定位瓶颈
+            slowest = batch_status.setdefault('slowest_files', [])
+            slowest.append({'filename': filename, 'wall_time': summary['wall_time'],
+                            'outcome': result.outcome, 'stages': summary['stages']})
+            slowest.sort(key=lambda item: item['wall_time'], reverse=True)
+            del slowest[5:]
+        done = batch_status['processed_files'] + batch_status['skipped_files'] + batch_status['error_files']
+        batch_status['message'] = f"已处理 {done}/{batch_status['total_files']}: {filename or ''}"
+
+def process_batch_item(file_info, current_config):
+    """处理批量转换中的单个文件（在批量通道的工作线程中执行）"""
+    filename = file_info['filename']
+    full_path = file_info['full_path']
+    
+    queued_info = processing_status.get(filename, {})
+    processing_status[filename] = {
+        'status': 'processing',
+        'lane': 'batch',
+        'job_id': queued_info.get('job_id'),
+        'queued_time': queued_info.get('queued_time'),
+        'start_time': time.time(),
+        'message': f'开始处理视频文件: {full_path}'
+    }
+    with batch_lock:
+        processing_status['batch_convert']['current_file'] = filename
+    
     try:
-        # 合并前端配置和默认配置
-        if frontend_config is None:
-            frontend_config = {}
+        # 执行视频处理
+        result = run_processing(full_path, current_config, background=True)
         
-        # 使用前端配置覆盖默认配置
-        current_config = CONFIG.copy()
+        # 更新单个文件状态
+        status = result_status(result)
+        processing_status[filename].update({
+            'status': status,
+            'message': result.message,
+            'result': result.to_dict(),
+            'end_time': time.time()
+        })
+        _record_batch_outcome({'completed': 'processed'}.get(status, status), filename, result)
         
-        # 处理邮件配置
-        if 'smtp_settings' in frontend_config:
-            current_smtp = current_config.get('smtp_settings', {}).copy()
-            current_smtp.update(frontend_config['smtp_settings'])
-            current_config['smtp_settings'] = current_smtp
+        # 发送邮件通知（只对处理完成的文件）
+        if current_config.get('smtp_settings', {}).get('enable_email_notification', False):
+            if result:  # 只有处理成功时才发送邮件
+                send_email_notification(filename, 'completed', '视频处理完成', current_config)
         
-        # 更新其他配置
-        for key, value in frontend_config.items():
-            if key != 'smtp_settings':
-                current_config[key] = value
+    except Exception as e:
+        print(f"处理文件 {filename} 时出错: {str(e)}")
+        # 更新单个文件状态
+        processing_status[filename].update({
+            'status': 'error',
+            'message': f'处理过程中发生错误: {str(e)}',
+            'end_time': time.time()
+        })
+        _record_batch_outcome('error', filename)
+        # 错误情况下不发送邮件通知（根据需求只对处理完成的文件发送邮件）
+        print(f"文件 {filename} 处理失败，不发送邮件通知")
+
+def process_batch_convert_async(frontend_config=None, rescan=False, discovered=None):
+    """异步批量处理所有符合条件的视频文件
+    
+    discovered: 请求处理时已经得到的 get_eligible_video_files 结果，避免再遍历一次目录
+    """
+    try:
+        # 合并前端配置和默认配置
+        current_config = merge_frontend_config(frontend_config)
         
-        # 获取所有符合条件的文件
-        eligible_files = get_eligible_video_files()
+        # 获取所有符合条件的文件（已转换、之前分析后跳过的文件不再处理）
+        eligible_files, excluded = discovered or get_eligible_video_files(current_config, rescan=rescan)
         
         if not eligible_files:
             processing_status['batch_convert'] = {
@@ -467,6 +1434,7 @@ def process_batch_convert_async(frontend_config=None):
                 'processed_files': 0,
                 'skipped_files': 0,
                 'error_files': 0,
+                'excluded_files': excluded,
                 'end_time': time.time()
             }
             return
@@ -479,71 +1447,48 @@ def process_batch_convert_async(frontend_config=None):
             'processed_files': 0,
             'skipped_files': 0,
             'error_files': 0,
+            'excluded_files': excluded,
             'current_file': '',
             'message': f'开始批量处理 {len(eligible_files)} 个文件'
         }
         
-        processed_count = 0
-        skipped_count = 0
-        error_count = 0
-        
-        # 逐个处理文件
-        for i, file_info in enumerate(eligible_files):
+        # 将每个文件作为批量通道任务提交给调度器，由多个工作线程并行处理；
+        # 单文件请求走交互通道，始终优先于这些任务
+        jobs = []
+        for file_info in eligible_files:
             filename = file_info['filename']
-            full_path = file_info['full_path']
-            
-            # 更新当前处理文件状态
-            processing_status['batch_convert']['current_file'] = filename
-            processing_status['batch_convert']['message'] = f'正在处理 {i+1}/{len(eligible_files)}: {filename}'
             
-            try:
-                # 检查文件是否已在处理中
-                if filename in processing_status and processing_status[filename]['status'] == 'processing':
+            # 检查文件是否已在排队或处理中，与 /process 使用同一个锁，同一文件不会被重复提交
+            with submit_lock:
+                if is_pending(filename):
                     print(f"跳过正在处理中的文件: {filename}")
-                    skipped_count += 1
+                    _record_batch_outcome('skipped')
                     continue
-                
-                # 执行视频处理
-                result = process_single_video(
-                    full_path,
-                    replace_original=current_config.get('replace_original', False),
-                    output_suffix=current_config.get('output_suffix', '_simplified'),
-                    backup_original=current_config.get('backup_original', True)
-                )
-                
-                if result:
-                    processed_count += 1
-                    # 更新单个文件状态
-                    processing_status[filename] = {
-                        'status': 'completed',
-                        'message': '视频处理完成',
-                        'end_time': time.time()
-                    }
-                else:
-                    skipped_count += 1
-                    # 更新单个文件状态
-                    processing_status[filename] = {
-                        'status': 'skipped',
-                        'message': '视频无需处理（可能已包含简体字幕或无需转换）',
-                        'end_time': time.time()
-                    }
-                
-                # 发送邮件通知（只对处理完成的文件）
-                if current_config.get('smtp_settings', {}).get('enable_email_notification', False):
-                    if result:  # 只有处理成功时才发送邮件
-                        send_email_notification(filename, 'completed', '视频处理完成', current_config)
-                
-            except Exception as e:
-                error_count += 1
-                print(f"处理文件 {filename} 时出错: {str(e)}")
-                # 更新单个文件状态
+                job_id = uuid.uuid4().hex
+                previous = processing_status.get(filename)
                 processing_status[filename] = {
-                    'status': 'error',
-                    'message': f'处理过程中发生错误: {str(e)}',
-                    'end_time': time.time()
+                    'status': 'queued',
+                    'lane': 'batch',
+                    'job_id': job_id,
+                    'queued_time': time.time(),
+                    'message': '等待批量处理'
                 }
-                # 错误情况下不发送邮件通知（根据需求只对处理完成的文件发送邮件）
-                print(f"文件 {filename} 处理失败，不发送邮件通知")
+            try:
+                jobs.append(scheduler.submit(process_batch_item, file_info, current_config,
+                                             priority=PRIORITY_BATCH, key=filename, job_id=job_id,
+                                             **disk_reservation(file_info['full_path'], current_config)))
+            except Exception:
+                rollback_queued([(filename, job_id, previous)])
+                raise
+        
+        # 等待所有批量任务完成
+        for job in jobs:
+            job.wait()
+        
+        batch_status = processing_status['batch_convert']
+        processed_count = batch_status['processed_files']
+        skipped_count = batch_status['skipped_files']
+        error_count = batch_status['error_files']
         
         # 更新最终批量处理状态
         processing_status['batch_convert'].update({
@@ -565,7 +1510,7 @@ def process_batch_convert_async(frontend_config=None):
         }
         print(f"批量处理过程中发生错误: {str(e)}")
 
-@app.route('/batch-convert', methods=['POST'])
+@bp.route('/batch-convert', methods=['POST'])
 def batch_convert():
     """批量转换所有符合条件的视频文件"""
     try:
@@ -576,26 +1521,78 @@ def batch_convert():
         frontend_config = data.get('config', {})
         
         # 检查是否已有批量处理在进行中
+        if cluster_mode == 'api' and processing_status.get('batch_convert', {}).get('batch_id'):
+            refresh_shared_batch_status(processing_status['batch_convert']['batch_id'])
         if 'batch_convert' in processing_status and processing_status['batch_convert']['status'] == 'processing':
             return jsonify({
                 'error': '批量转换正在进行中，请等待完成后再试'
             }), 409
         
-        # 获取符合条件的文件数量
-        eligible_files = get_eligible_video_files()
+        if frontend_config.get('output_mode', CONFIG.get('output_mode', 'remux')) not in OUTPUT_MODES:
+            return jsonify({
+                'error': f'不支持的输出方式，支持: {", ".join(OUTPUT_MODES)}'
+            }), 400
+        
+        # 获取符合条件的文件数量（rescan 为 true 时重新分析之前跳过的文件）
+        rescan = bool(data.get('rescan'))
+        eligible_files, excluded = get_eligible_video_files(merge_frontend_config(frontend_config), rescan=rescan)
         
         if not eligible_files:
             return jsonify({
                 'message': '没有找到符合条件的文件',
-                'total_files': 0
+                'total_files': 0,
+                'excluded_files': excluded
             }), 200
         
-        # 启动异步批量处理
-        future = executor.submit(process_batch_convert_async, frontend_config)
+        # api 模式：所有文件写入共享队列的批量通道
+        if cluster_mode == 'api':
+            batch_id = uuid.uuid4().hex
+            results = get_shared_queue().enqueue_many(
+                [(file_info['filename'], file_info['relative_path']) for file_info in eligible_files],
+                config=frontend_config, priority=PRIORITY_BATCH, batch_id=batch_id
+            )
+            queued_count = sum(1 for _, _, duplicate in results if not duplicate)
+            processing_status['batch_convert'] = {
+                'status': 'processing',
+                'batch_id': batch_id,
+                'start_time': time.time(),
+                'total_files': queued_count,
+                'processed_files': 0,
+                'skipped_files': 0,
+                'error_files': 0,
+                'excluded_files': excluded,
+                'current_file': '',
+                'message': f'已写入共享队列 {queued_count} 个文件'
+            }
+            return jsonify({
+                'message': '批量转换请求已接受',
+                'total_files': queued_count,
+                'excluded_files': excluded,
+                'batch_id': batch_id,
+                'status': 'accepted'
+            }), 200
+        
+        # 先标记批量任务已开始，避免重复提交
+        processing_status['batch_convert'] = {
+            'status': 'processing',
+            'start_time': time.time(),
+            'total_files': len(eligible_files),
+            'processed_files': 0,
+            'skipped_files': 0,
+            'error_files': 0,
+            'excluded_files': excluded,
+            'current_file': '',
+            'message': '正在准备批量处理'
+        }
+        
+        # 批量协调线程只负责拆分和等待，不占用调度器的工作线程
+        threading.Thread(target=process_batch_convert_async, args=(frontend_config, rescan, (eligible_files, excluded)),
+                         name='batch-convert', daemon=True).start()
         
         return jsonify({
             'message': '批量转换请求已接受',
             'total_files': len(eligible_files),
+            'excluded_files': excluded,
             'status': 'accepted'
         }), 200
         
@@ -604,7 +1601,161 @@ def batch_convert():
             'error': f'服务器内部错误: {str(e)}'
         }), 500
 
-@app.route('/batch-status', methods=['GET'])
+def plan_batch_item(file_info, current_config):
+    """试运行批量转换中的单个文件（在批量通道的工作线程中执行）"""
+    try:
+        result = run_processing(file_info['full_path'], current_config, dry_run=True, background=True)
+        entry = {
+            'filename': file_info['filename'],
+            'relative_path': file_info['relative_path'],
+            'size_mb': file_info['size_mb'],
+            'status': result_status(result),
+            'outcome': result.outcome,
+            'message': result.message,
+            'selected_indices': result.selected_indices,
+            'estimated_rewrite_bytes': result.estimated_rewrite_bytes,
+            'analysis_seconds': result.to_dict()['wall_time'],
+        }
+    except Exception as e:
+        entry = {
+            'filename': file_info['filename'],
+            'relative_path': file_info['relative_path'],
+            'size_mb': file_info['size_mb'],
+            'status': 'error',
+            'outcome': OUTCOME_ERROR,
+            'message': f'分析过程中发生错误: {str(e)}',
+            'selected_indices': [],
+            'estimated_rewrite_bytes': 0,
+        }
+    
+    with batch_lock:
+        batch_plan_status['files'].append(entry)
+        batch_plan_status['planned_files'] += 1
+        counts = batch_plan_status['status_counts']
+        counts[entry['status']] = counts.get(entry['status'], 0) + 1
+        reasons = batch_plan_status['outcome_counts']
+        reasons[entry['outcome']] = reasons.get(entry['outcome'], 0) + 1
+        batch_plan_status['estimated_rewrite_bytes'] += entry['estimated_rewrite_bytes']
+        batch_plan_status['message'] = f"已分析 {batch_plan_status['planned_files']}/{batch_plan_status['total_files']}"
+
+def process_batch_plan_async(frontend_config=None, rescan=False):
+    """并行分析所有符合条件的文件，估算批量转换的写入量和耗时"""
+    try:
+        current_config = merge_frontend_config(frontend_config)
+        eligible_files, excluded = get_eligible_video_files(current_config, rescan=rescan)
+        with batch_lock:
+            batch_plan_status['total_files'] = len(eligible_files)
+            batch_plan_status['excluded_files'] = excluded
+            batch_plan_status['message'] = f'开始分析 {len(eligible_files)} 个文件'
+        
+        # 和批量转换使用同一个调度器的批量通道并行分析；分析不修改文件，不受批量时段限制。
+        # api 模式没有常驻的调度器，分析期间临时创建一个
+        plan_scheduler = scheduler or JobScheduler(max_workers=max_workers, reserved_interactive_workers=0,
+                                                   memory_gate=memory_budget)
+        try:
+            jobs = [plan_scheduler.submit(plan_batch_item, file_info, current_config,
+                                          priority=PRIORITY_BATCH, key=f"plan:{file_info['filename']}", gated=False)
+                    for file_info in eligible_files]
+            for job in jobs:
+                job.wait()
+        finally:
+            if plan_scheduler is not scheduler:
+                plan_scheduler.shutdown(wait=False)
+        
+        with batch_lock:
+            convert_count = batch_plan_status['status_counts'].get('completed', 0)
+            rewrite_bytes = batch_plan_status['estimated_rewrite_bytes']
+            kind = throughput_kind(current_config.get('output_mode', 'remux'),
+                                   current_config.get('remux_engine', 'ffmpeg'))
+            serial_seconds = throughput_history.estimate_seconds(kind, rewrite_bytes, convert_count)
+            batch_plan_status['files'].sort(key=lambda entry: entry['relative_path'])
+            batch_plan_status.update({
+                'status': 'completed',
+                'end_time': time.time(),
+                'throughput_history': throughput_history.stats().get(kind),
+                'estimated_seconds': round(serial_seconds, 1) if serial_seconds is not None else None,
+                # 批量转换时文件在批量通道的多个线程上并行处理
+                'estimated_parallel_seconds': round(serial_seconds / plan_scheduler.batch_capacity, 1) if serial_seconds is not None else None,
+                'parallel_workers': plan_scheduler.batch_capacity,
+                'message': (f"分析完成: 将转换 {convert_count} 个，跳过 {batch_plan_status['status_counts'].get('skipped', 0)} 个，"
+                            f"错误 {batch_plan_status['status_counts'].get('error', 0)} 个，"
+                            f"预计写入 {rewrite_bytes / (1024 * 1024 * 1024):.2f}GB")
+            })
+            if serial_seconds is None:
+                batch_plan_status['message'] += '（没有历史吞吐量数据，无法估算耗时）'
+        print(batch_plan_status['message'])
+    except Exception as e:
+        with batch_lock:
+            batch_plan_status.update({
+                'status': 'error',
+                'end_time': time.time(),
+                'message': f'批量分析过程中发生错误: {str(e)}'
+            })
+        print(f"批量分析过程中发生错误: {str(e)}")
+
+@bp.route('/batch-plan', methods=['POST'])
+def batch_plan():
+    """试运行批量转换：分析所有符合条件的文件，返回将转换/跳过/出错的文件和预计写入量、耗时，不修改任何文件"""
+    try:
+        data = request.get_json(silent=True) or {}
+        frontend_config = data.get('config', {})
+        
+        if frontend_config.get('output_mode', CONFIG.get('output_mode', 'remux')) not in OUTPUT_MODES:
+            return jsonify({
+                'error': f'不支持的输出方式，支持: {", ".join(OUTPUT_MODES)}'
+            }), 400
+        
+        with batch_lock:
+            if batch_plan_status.get('status') == 'processing':
+                return jsonify({
+                    'error': '批量分析正在进行中，请等待完成后再试'
+                }), 409
+            batch_plan_status.clear()
+            batch_plan_status.update({
+                'status': 'processing',
+                'start_time': time.time(),
+                'total_files': 0,
+                'planned_files': 0,
+                'status_counts': {},
+                'outcome_counts': {},
+                'estimated_rewrite_bytes': 0,
+                'files': [],
+                'message': '正在准备批量分析'
+            })
+        
+        thread = threading.Thread(target=process_batch_plan_async, args=(frontend_config, bool(data.get('rescan'))),
+                                  name='batch-plan', daemon=True)
+        thread.start()
+        
+        # wait 为 true 时等待分析完成后直接返回计划
+        if data.get('wait'):
+            thread.join()
+            return get_batch_plan()
+        
+        return jsonify({
+            'message': '批量分析请求已接受',
+            'status': 'accepted'
+        }), 200
+        
+    except Exception as e:
+        return jsonify({
+            'error': f'服务器内部错误: {str(e)}'
+        }), 500
+
+@bp.route('/batch-plan', methods=['GET'])
+def get_batch_plan():
+    """获取批量分析的结果"""
+    with batch_lock:
+        if not batch_plan_status:
+            return jsonify({
+                'error': '没有批量分析任务'
+            }), 404
+        plan = dict(batch_plan_status)
+        plan['files'] = list(batch_plan_status['files'])
+    plan['duration'] = round(plan.get('end_time', time.time()) - plan['start_time'], 2)
+    return jsonify(plan), 200
+
+@bp.route('/batch-status', methods=['GET'])
 def get_batch_status():
     """获取批量转换状态"""
     if 'batch_convert' not in processing_status:
@@ -612,6 +1763,10 @@ def get_batch_status():
             'error': '没有批量转换任务'
         }), 404
     
+    batch_id = processing_status['batch_convert'].get('batch_id')
+    if cluster_mode == 'api' and batch_id:
+        refresh_shared_batch_status(batch_id)
+    
     status_info = processing_status['batch_convert'].copy()
     
     # 计算处理时间
@@ -630,7 +1785,7 @@ def get_batch_status():
     
     return jsonify(status_info), 200
 
-@app.route('/')
+@bp.route('/')
 def index():
     """提供前端界面"""
     try:
@@ -683,6 +1838,21 @@ def index():
         """, 500
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='视频字幕简体化处理服务')
+    parser.add_argument('--worker', action='store_true', help='以工作节点模式运行，从共享队列领取任务')
+    parser.add_argument('--worker-id', help='工作节点标识（默认: 主机名-进程号）')
+    parser.add_argument('--config', default=CONFIG_FILE, help=f'配置文件路径（默认: {CONFIG_FILE}）')
+    args = parser.parse_args()
+    
+    if args.worker:
+        init_runtime(prepare_config(load_config(args.config)), worker=True)
+        print(f"启动工作节点，共享队列: {cluster_settings.get('queue_path', 'data/jobs.db')}")
+        print(f"视频目录: {os.path.abspath(CONFIG['video_directory'])}")
+        run_worker(args.worker_id)
+        sys.exit(0)
+    
+    app = create_app(args.config)
+    
     # 确保data目录和download目录存在
     if not os.path.exists('data'):
         os.makedirs('data')
@@ -695,6 +1865,7 @@ if __name__ == '__main__':
     print(f"支持的视频格式: {', '.join(CONFIG['allowed_extensions'])}")
     print(f"最大文件大小: {CONFIG['max_file_size'] / (1024*1024):.0f}MB")
     print(f"最大并行处理数: {max_workers}")
+    print(f"集群模式: {cluster_mode}")
     
     app.run(
         host=CONFIG['host'],
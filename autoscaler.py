@@ -0,0 +1,331 @@
+"""按观测到的资源占用自动调整工作线程数
+
+max_workers 的合适值取决于瓶颈在哪里：8 核工作站上 zhconv 转换（CPU）可以同时跑很多个；
+2 核 NAS 容器（docker-compose.yml 中的 cpus: '2.0'）上多开线程只会互相抢 CPU；重新封装受磁盘带宽
+限制，线程多了反而互相干扰；大量小文件时 ffprobe/ffmpeg 的进程启动开销占主要部分。
+
+WorkerAutoscaler 每隔 interval_seconds 秒采样一次：
+- 调度器：可以开始的排队任务数、忙碌线程数、这段时间开始的任务的平均排队等待时间
+- 完成的任务：平均耗时、每分钟完成数、每秒读写量，以及各阶段耗时的占比
+  （cpu：分类、转换；disk：提取、封装、复制；startup：ffprobe）
+- 系统：本进程和 ffmpeg 子进程的 CPU 使用率（按 cgroup 配额计算可用 CPU 数）、
+  平均负载、Linux PSI 的 CPU/I/O 压力（容器内优先读取 cgroup 的 cpu.pressure/io.pressure）
+
+每次最多增减一个线程，线程数保持在 min_workers 和 max_workers 之间：
+- CPU 或 I/O 已饱和：减少一个线程
+- 有任务在排队且所有线程都在忙：增加一个线程；但如果最近在多一个线程时测得的吞吐量
+  没有比现在高出 min_gain，保持不变，现在的吞吐量没有比少一个线程时高出 min_gain 则减少一个线程
+  （吞吐量只在线程全忙时按线程数记录移动平均，THROUGHPUT_TTL 秒后过期，之后会再次尝试）
+- 连续 idle_intervals 次没有排队任务：逐步回到配置的 max_workers
+
+enabled 为 false 时只采样和给出建议，不调整线程数。最近的决策（包括保持不变的原因）
+通过 /queue 的 autoscale 字段查看。
+"""
+import collections
+import math
+import os
+import threading
+import time
+
+MB = 1024 * 1024
+# 处理阶段 → 瓶颈类别
+STAGE_CATEGORIES = {
+    'classification': 'cpu',
+    'conversion': 'cpu',
+    'inplace_scan': 'cpu',
+    'extraction': 'disk',
+    'remux': 'disk',
+    'backup': 'disk',
+    'clone': 'disk',
+    'inplace': 'disk',
+    'ffprobe': 'startup',
+}
+DEFAULT_SETTINGS = {
+    'enabled': True,
+    'min_workers': 1,
+    # 0 表示可用 CPU 数的两倍（不少于配置的 max_workers）
+    'max_workers': 0,
+    'interval_seconds': 15,
+    # 本进程（含 ffmpeg 子进程）占用可用 CPU 的比例达到该值视为 CPU 饱和
+    'cpu_high': 0.9,
+    # 平均负载除以可用 CPU 数达到该值视为 CPU 饱和（同一台机器上的其他程序也在用 CPU）
+    'load_high': 1.5,
+    # PSI some avg10（有任务因 CPU/I/O 等待的时间百分比）达到该值视为饱和
+    'pressure_high': 40,
+    # 增加线程后吞吐量至少提高的比例
+    'min_gain': 0.05,
+    'idle_intervals': 4,
+}
+# 按线程数记录的吞吐量超过该时间（秒）后不再使用，允许重新尝试
+THROUGHPUT_TTL = 600
+DECISION_HISTORY = 20
+
+
+def _cgroup_cpu_quota():
+    """cgroup 的 CPU 配额（可用 CPU 数，如 docker 的 cpus: '2.0'），没有限制时返回 None"""
+    try:
+        with open('/sys/fs/cgroup/cpu.max', 'r') as f:
+            quota, period = f.read().split()[:2]
+        if quota != 'max' and int(period) > 0:
+            return int(quota) / int(period)
+        return None
+    except (OSError, ValueError):
+        pass
+    try:
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us', 'r') as f:
+            quota = int(f.read())
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us', 'r') as f:
+            period = int(f.read())
+        if quota > 0 and period > 0:
+            return quota / period
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def effective_cpu_count():
+    """本进程可以使用的 CPU 数：CPU 亲和性和 cgroup 配额中较小的一个"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        cpus = os.cpu_count() or 1
+    quota = _cgroup_cpu_quota()
+    if quota:
+        cpus = min(cpus, quota)
+    return max(cpus, 1)
+
+
+def read_pressure(resource):
+    """PSI 中的 some avg10（最近 10 秒内有任务在等待该资源的时间百分比），不支持时返回 None"""
+    for path in (f'/sys/fs/cgroup/{resource}.pressure', f'/proc/pressure/{resource}'):
+        try:
+            with open(path, 'r') as f:
+                for line in f:
+                    if line.startswith('some'):
+                        return float(dict(item.split('=') for item in line.split()[1:])['avg10'])
+        except (OSError, ValueError, KeyError):
+            continue
+    return None
+
+
+def _cpu_seconds():
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+class WorkerAutoscaler:
+    """根据排队情况、阶段耗时和系统负载调整 JobScheduler 的线程数
+
+    Args:
+        scheduler: JobScheduler
+        settings: parallel_settings.autoscale，缺少的字段使用 DEFAULT_SETTINGS
+        baseline: 配置的 max_workers，空闲时回到这个值
+    """
+
+    def __init__(self, scheduler, settings=None, baseline=None):
+        self.scheduler = scheduler
+        self._lock = threading.Lock()
+        self._stage_seconds = {}
+        self._jobs = 0
+        self._job_seconds = 0.0
+        self._bytes = 0
+        self._last_sample = None
+        self._idle_ticks = 0
+        self._throughput = {}
+        self.signals = None
+        self.decisions = collections.deque(maxlen=DECISION_HISTORY)
+        self._stop = threading.Event()
+        self._thread = None
+        self.configure(settings, baseline if baseline is not None else scheduler.max_workers)
+
+    def configure(self, settings, baseline):
+        """应用新设置（配置热加载时调用），之前按线程数记录的吞吐量作废"""
+        settings = dict(DEFAULT_SETTINGS, **(settings or {}))
+        with self._lock:
+            self.enabled = bool(settings['enabled'])
+            self.effective_cpus = effective_cpu_count()
+            self.min_workers = max(1, int(settings['min_workers']))
+            self.max_workers = max(self.min_workers, int(settings['max_workers']) or
+                                   max(int(baseline), math.ceil(self.effective_cpus * 2)))
+            self.baseline = min(max(int(baseline), self.min_workers), self.max_workers)
+            self.interval = max(1.0, float(settings['interval_seconds']))
+            self.cpu_high = float(settings['cpu_high'])
+            self.load_high = float(settings['load_high'])
+            self.pressure_high = float(settings['pressure_high'])
+            self.min_gain = float(settings['min_gain'])
+            self.idle_intervals = max(1, int(settings['idle_intervals']))
+            self._throughput = {}
+            self._idle_ticks = 0
+
+    def observe(self, result):
+        """记录一个已完成任务（ProcessResult）的阶段耗时和读写量"""
+        with self._lock:
+            self._jobs += 1
+            self._job_seconds += (result.end_time or time.time()) - result.start_time
+            for stage, info in result.stages.items():
+                category = STAGE_CATEGORIES.get(stage, 'other')
+                self._stage_seconds[category] = self._stage_seconds.get(category, 0.0) + info['wall']
+            self._bytes += sum(info['read'] + info['written'] for info in result.io.values())
+
+    def _sample(self):
+        """采样一次，返回这段时间的信号，第一次调用只记录起点并返回 None"""
+        now = time.monotonic()
+        cpu_seconds = _cpu_seconds()
+        stats = self.scheduler.stats()
+        with self._lock:
+            jobs, job_seconds, moved_bytes = self._jobs, self._job_seconds, self._bytes
+            stage_seconds = self._stage_seconds
+            self._jobs, self._job_seconds, self._bytes, self._stage_seconds = 0, 0.0, 0, {}
+        previous = self._last_sample
+        self._last_sample = (now, cpu_seconds, stats['started_jobs'], stats['queue_wait_seconds'])
+        if previous is None:
+            return None
+
+        elapsed = max(now - previous[0], 1e-6)
+        started = stats['started_jobs'] - previous[2]
+        # 批量通道暂停或等待磁盘空间的任务，增加线程也无法开始
+        runnable = sum(stats['queued'].values()) - stats['waiting_for_disk']
+        if stats['batch_paused']:
+            runnable -= stats['queued'].get('batch', 0)
+        if stats.get('memory_paused'):
+            # 内存紧张时增加线程也不会开始新任务
+            runnable = 0
+        stage_total = sum(stage_seconds.values())
+        load = os.getloadavg()[0] if hasattr(os, 'getloadavg') else None
+        return {
+            'interval_seconds': round(elapsed, 1),
+            'workers': stats['max_workers'],
+            'busy_workers': stats['busy_workers'],
+            'runnable_queued': max(0, runnable),
+            'queue_wait_avg': round((stats['queue_wait_seconds'] - previous[3]) / started, 3) if started else None,
+            'jobs_completed': jobs,
+            'job_seconds_avg': round(job_seconds / jobs, 3) if jobs else None,
+            'jobs_per_minute': round(jobs * 60 / elapsed, 2),
+            'mb_per_second': round(moved_bytes / elapsed / MB, 2),
+            'cpu_utilization': round((cpu_seconds - previous[1]) / elapsed / self.effective_cpus, 3),
+            'load_per_cpu': round(load / self.effective_cpus, 3) if load is not None else None,
+            'cpu_pressure': read_pressure('cpu'),
+            'io_pressure': read_pressure('io'),
+            'stage_share': {category: round(seconds / stage_total, 3) for category, seconds in stage_seconds.items()}
+            if stage_total else {},
+            'bottleneck': max(stage_seconds, key=stage_seconds.get) if stage_total else None,
+        }
+
+    def _saturation(self, signals):
+        """CPU 或 I/O 已饱和时返回原因，否则返回 None"""
+        if signals['cpu_utilization'] >= self.cpu_high:
+            return f"CPU 使用率 {signals['cpu_utilization']:.0%}（可用 {self.effective_cpus:g} 个 CPU）"
+        if signals['load_per_cpu'] is not None and signals['load_per_cpu'] >= self.load_high:
+            return f"每个 CPU 的平均负载 {signals['load_per_cpu']:.2f}"
+        if signals['cpu_pressure'] is not None and signals['cpu_pressure'] >= self.pressure_high:
+            return f"CPU 压力 {signals['cpu_pressure']:.0f}%"
+        if signals['io_pressure'] is not None and signals['io_pressure'] >= self.pressure_high:
+            return f"I/O 压力 {signals['io_pressure']:.0f}%"
+        return None
+
+    def _record_throughput(self, workers, signals):
+        """线程全忙时记录该线程数下的吞吐量（每秒读写量，没有读写时用每分钟完成数）"""
+        value = signals['mb_per_second'] or signals['jobs_per_minute']
+        if not signals['jobs_completed']:
+            return
+        now = time.time()
+        previous = self._throughput.get(workers)
+        if previous is not None and now - previous[1] < THROUGHPUT_TTL:
+            value = previous[0] * 0.5 + value * 0.5
+        self._throughput[workers] = (value, now)
+
+    def _recent_throughput(self, workers):
+        entry = self._throughput.get(workers)
+        if entry is None or time.time() - entry[1] > THROUGHPUT_TTL:
+            return None
+        return entry[0]
+
+    def decide(self, signals):
+        """根据一次采样的信号返回 (目标线程数, 原因)"""
+        workers = signals['workers']
+        saturated = self._saturation(signals)
+        all_busy = signals['busy_workers'] >= workers
+        backlog = signals['runnable_queued'] > 0
+        if backlog and all_busy:
+            self._record_throughput(workers, signals)
+        if backlog or all_busy:
+            self._idle_ticks = 0
+        else:
+            self._idle_ticks += 1
+
+        if saturated and workers > self.min_workers:
+            return workers - 1, f"{saturated}，减少线程"
+        if workers < self.min_workers:
+            return self.min_workers, "低于最小线程数"
+        if workers > self.max_workers:
+            return self.max_workers, "超过最大线程数"
+        if backlog and all_busy:
+            if saturated:
+                return workers, f"{saturated}，不再增加线程"
+            if workers >= self.max_workers:
+                return workers, f"已达到最大线程数 {self.max_workers}"
+            current = self._recent_throughput(workers)
+            lower, higher = self._recent_throughput(workers - 1), self._recent_throughput(workers + 1)
+            if current is not None and lower is not None and current < lower * (1 + self.min_gain) and \
+                    workers > self.min_workers:
+                return workers - 1, f"{workers} 个线程的吞吐量没有比 {workers - 1} 个线程明显提高，减少线程"
+            if current is not None and higher is not None and higher < current * (1 + self.min_gain):
+                return workers, f"{workers + 1} 个线程时吞吐量没有明显提高"
+            return workers + 1, f"{signals['runnable_queued']} 个任务在排队且线程全忙（瓶颈: {signals['bottleneck'] or '未知'}）"
+        if self._idle_ticks >= self.idle_intervals and workers > self.baseline:
+            self._idle_ticks = 0
+            return workers - 1, f"连续 {self.idle_intervals} 次没有排队任务，逐步回到配置的 {self.baseline} 个线程"
+        return workers, "无需调整"
+
+    def tick(self):
+        """采样一次并按需调整线程数，返回本次的决策（第一次采样返回 None）"""
+        signals = self._sample()
+        if signals is None:
+            return None
+        target, reason = self.decide(signals)
+        applied = self.enabled and target != signals['workers']
+        decision = {
+            'time': time.time(),
+            'from': signals['workers'],
+            'to': target,
+            'reason': reason,
+            'applied': applied,
+        }
+        self.signals = signals
+        if target != signals['workers']:
+            self.decisions.append(decision)
+        if applied:
+            self.scheduler.resize(target)
+            print(f"自动调整工作线程数: {signals['workers']} → {target}（{reason}）")
+        return decision
+
+    def _loop(self):
+        self._sample()
+        while not self._stop.wait(self.interval):
+            try:
+                self.tick()
+            except Exception as e:
+                print(f"自动调整线程数失败: {str(e)}")
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name="worker-autoscaler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'min_workers': self.min_workers,
+            'max_workers': self.max_workers,
+            'baseline_workers': self.baseline,
+            'effective_cpus': round(self.effective_cpus, 2),
+            'interval_seconds': self.interval,
+            'signals': self.signals,
+            'throughput_by_workers': {workers: round(value, 3) for workers, (value, _) in
+                                      sorted(self._throughput.items())},
+            'decisions': list(self.decisions),
+        }
@@ -0,0 +1,195 @@
+"""原地转换（remux_engine=inplace）与 ffmpeg 重新封装的对比和校验
+
+对每个含繁体文本字幕的 MKV 测试视频分别用两种方式处理，记录耗时和写入字节数，并校验原地转换的输出：
+
+- ffprobe 的流信息和格式信息与原文件相同（被转换字幕流的标题、语言标签除外）
+- 所有数据包的时间戳、时长与原文件相同，非字幕流的数据包大小也相同
+- ffmpeg 可以完整解码全部流，没有错误输出
+- 转换后的字幕内容与 ffmpeg 方式追加的简体字幕流相同
+
+任一文件校验失败时退出码为 1。
+
+使用方法:
+    python benchmarks/bench_inplace.py
+    python benchmarks/bench_inplace.py --output result.json
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from common import REPO_ROOT, environment_info, ffmpeg_available, save_results
+from fixtures import DEFAULT_FIXTURES, generate_fixtures
+
+import video_processor_v1
+
+# 只比较 MKV 测试视频（MP4 不支持原地转换）
+INPLACE_FIXTURES = [spec for spec in DEFAULT_FIXTURES if spec.get('container', 'mkv') == 'mkv']
+# 被转换的字幕流允许变化的标签
+CONVERTED_TAGS = ('title', 'language')
+
+
+def _ffprobe(args):
+    ffprobe_cmd = "ffprobe.exe" if sys.platform.startswith('win') else "ffprobe"
+    result = subprocess.run([ffprobe_cmd, "-v", "error"] + args, capture_output=True, timeout=600, text=True,
+                            encoding="utf-8")
+    if result.returncode != 0:
+        raise RuntimeError(f"ffprobe 失败: {result.stderr}")
+    return result.stdout
+
+
+def probe(path):
+    info = json.loads(_ffprobe(["-show_streams", "-show_format", "-of", "json", path]))
+    info['format'].pop('filename', None)
+    return info
+
+
+def packets(path):
+    output = _ffprobe(["-show_entries", "packet=stream_index,pts,dts,duration,size", "-of", "csv=p=0", path])
+    return [line.split(',') for line in output.splitlines() if line]
+
+
+def decode_errors(path):
+    """完整解码全部流，返回 ffmpeg 的错误输出（为空表示可以正常播放）"""
+    ffmpeg_cmd = "ffmpeg.exe" if sys.platform.startswith('win') else "ffmpeg"
+    result = subprocess.run([ffmpeg_cmd, "-v", "error", "-i", path, "-map", "0", "-f", "null", "-"],
+                            capture_output=True, timeout=600, text=True, encoding="utf-8")
+    return result.stderr.strip() if result.returncode == 0 else (result.stderr.strip() or "解码失败")
+
+
+def extract_text(path, subtitle_index, work_dir, name):
+    ext = video_processor_v1.subtitle_extension({'codec_name': _codec(path, subtitle_index)})
+    output = os.path.join(work_dir, f"{name}.{ext}")
+    video_processor_v1.extract_subtitle_tracks(path, [(subtitle_index, output)])
+    with open(output, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def _codec(path, subtitle_index):
+    streams = [stream for stream in probe(path)['streams'] if stream.get('codec_type') == 'subtitle']
+    return streams[subtitle_index].get('codec_name')
+
+
+def compare_probe(source, output, converted_streams):
+    """返回 ffprobe 信息中的差异列表"""
+    differences = []
+    before, after = probe(source), probe(output)
+    for key in set(before['format']) | set(after['format']):
+        if key not in ('size', 'bit_rate') and before['format'].get(key) != after['format'].get(key):
+            differences.append(f"format.{key}: {before['format'].get(key)} → {after['format'].get(key)}")
+    if len(before['streams']) != len(after['streams']):
+        return differences + [f"流数量 {len(before['streams'])} → {len(after['streams'])}"]
+    for old, new in zip(before['streams'], after['streams']):
+        old_tags, new_tags = old.pop('tags', {}), new.pop('tags', {})
+        if old['index'] in converted_streams:
+            old_tags = {key: value for key, value in old_tags.items() if key not in CONVERTED_TAGS}
+            new_tags = {key: value for key, value in new_tags.items() if key not in CONVERTED_TAGS}
+        if old != new or old_tags != new_tags:
+            differences.append(f"stream {old['index']}: {old} {old_tags} → {new} {new_tags}")
+    return differences
+
+
+def compare_packets(source, output, converted_streams):
+    """返回数据包时间戳、时长和大小的差异数"""
+    before, after = packets(source), packets(output)
+    if len(before) != len(after):
+        return abs(len(before) - len(after)) or 1
+    mismatches = 0
+    for old, new in zip(before, after):
+        keep = old if int(old[0]) not in converted_streams else old[:4]
+        if keep != new[:len(keep)]:
+            mismatches += 1
+    return mismatches
+
+
+def written_bytes(result):
+    return sum(info['written'] for info in result.to_dict()['io'].values())
+
+
+def bench_fixture(name, path, work_dir):
+    video = os.path.join(work_dir, os.path.basename(path))
+    shutil.copy2(path, video)
+    runs = {}
+    for engine in video_processor_v1.REMUX_ENGINES:
+        start = time.perf_counter()
+        result = video_processor_v1.process_single_video(video, output_suffix=f"_{engine}", remux_engine=engine)
+        runs[engine] = {
+            'seconds': round(time.perf_counter() - start, 4),
+            'outcome': result.outcome,
+            'written_bytes': written_bytes(result),
+            'inplace': 'inplace' in result.stages,
+            'output_file': result.output_file,
+            'selected_indices': result.selected_indices,
+            'subtitle_count': result.subtitle_stream_count,
+        }
+        print(f"{name} [{engine}]: {runs[engine]['seconds']}s，写入 {runs[engine]['written_bytes']} 字节 "
+              f"({result.outcome})")
+
+    info = {'file_bytes': os.path.getsize(path), 'runs': runs}
+    inplace_run, ffmpeg_run = runs['inplace'], runs['ffmpeg']
+    if not inplace_run['inplace']:
+        info['verified'] = None
+        return info
+
+    output = inplace_run['output_file']
+    source_streams = probe(video)['streams']
+    subtitle_streams = [stream['index'] for stream in source_streams if stream.get('codec_type') == 'subtitle']
+    converted_streams = {subtitle_streams[index] for index in inplace_run['selected_indices']}
+    checks = {
+        'probe_differences': compare_probe(video, output, converted_streams),
+        'packet_mismatches': compare_packets(video, output, converted_streams),
+        'decode_errors': decode_errors(output),
+        'subtitle_mismatches': [],
+    }
+    for offset, index in enumerate(inplace_run['selected_indices']):
+        inplace_text = extract_text(output, index, work_dir, f"{name}_inplace_{index}")
+        ffmpeg_text = extract_text(ffmpeg_run['output_file'], ffmpeg_run['subtitle_count'] + offset, work_dir,
+                                   f"{name}_ffmpeg_{index}")
+        if inplace_text != ffmpeg_text:
+            checks['subtitle_mismatches'].append(index)
+    info['checks'] = checks
+    info['verified'] = not (checks['probe_differences'] or checks['packet_mismatches'] or checks['decode_errors'] or
+                            checks['subtitle_mismatches'])
+    print(f"{name}: 校验{'通过' if info['verified'] else '失败'}")
+    return info
+
+
+def main():
+    parser = argparse.ArgumentParser(description='原地转换与 ffmpeg 重新封装的对比和校验')
+    parser.add_argument('--fixtures-dir', default=os.path.join(tempfile.gettempdir(), 'video_converter_fixtures'),
+                        help='测试视频缓存目录（重复运行时复用）')
+    parser.add_argument('--output', help='结果 JSON 路径（默认写入 benchmarks/results/）')
+    args = parser.parse_args()
+
+    if not ffmpeg_available():
+        print("未找到 ffmpeg/ffprobe，无法运行")
+        return 1
+
+    # 处理过程中的临时文件写在当前目录，在仓库根目录运行以使用 data/config.json
+    os.chdir(REPO_ROOT)
+    # 关闭字幕内容缓存和逐行缓存，两种方式都实际转换
+    video_processor_v1.set_subtitle_cache(None)
+    video_processor_v1.set_line_cache(None)
+    work_dir = tempfile.mkdtemp(prefix='video_converter_inplace_')
+    results = {'environment': environment_info(), 'benchmarks': {}}
+    try:
+        fixtures = generate_fixtures(args.fixtures_dir, INPLACE_FIXTURES)
+        for name, path in fixtures.items():
+            results['benchmarks'][name] = bench_fixture(name, path, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    save_results('inplace', results, args.output)
+    failed = [name for name, info in results['benchmarks'].items() if info.get('verified') is False]
+    if failed:
+        print(f"校验失败: {', '.join(failed)}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
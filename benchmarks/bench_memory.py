@@ -0,0 +1,190 @@
+"""内存占用基准测试：批量处理 100 个文件时的 RSS 峰值
+
+- convert：分块转换一个大字幕文件（默认 100 小时、每 2 秒一句），用 tracemalloc 记录 Python 分配的峰值，
+  峰值应与 CONVERT_CHUNK_CHARS 相当，而不是整个文件大小
+- batch：把测试视频复制成 --files 个文件，通过 Flask 测试客户端运行完整的 /batch-convert，
+  每 --sample-interval 秒采样本进程与 ffmpeg 子进程的 RSS 合计，记录峰值、字幕内存预算的使用情况、
+  准入暂停次数和处理状态记录数（memory_settings.status_max_entries 限制）
+
+使用方法:
+    python benchmarks/bench_memory.py
+    python benchmarks/bench_memory.py --files 100 --budget-mb 64 --output result.json
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from common import REPO_ROOT, environment_info, ffmpeg_available, save_results
+from fixtures import DEFAULT_FIXTURES, generate_fixtures, write_subtitle
+
+import memory_budget
+import video_processor_v1
+
+MB = 1024 * 1024
+# 批量测试使用的测试视频（按顺序循环复制）
+BATCH_FIXTURES = [spec for spec in DEFAULT_FIXTURES
+                  if spec['name'] in ('short_cht_srt', 'short_chs_srt', 'medium_cht_ass_multi')]
+
+
+def _mb(value):
+    return round(value / MB, 2) if value is not None else None
+
+
+def bench_convert(work_dir, hours):
+    """分块转换大字幕文件时 Python 分配的内存峰值"""
+    # 词典加载和逐行缓存的分配不计入峰值
+    video_processor_v1.prewarm_converter()
+    video_processor_v1.set_line_cache(None)
+    results = {}
+    for fmt in ('srt', 'ass'):
+        input_file = write_subtitle(os.path.join(work_dir, f"memory_{hours}h.{fmt}"), fmt, 'traditional', hours * 3600)
+        output_file = os.path.join(work_dir, f"memory_{hours}h_out.{fmt}")
+        tracemalloc.start()
+        start = time.perf_counter()
+        ok = video_processor_v1.convert_traditional_to_simplified(input_file, output_file)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[fmt] = {
+            'ok': bool(ok),
+            'seconds': round(elapsed, 3),
+            'file_mb': _mb(os.path.getsize(input_file)),
+            'python_peak_mb': _mb(peak),
+            'chunk_chars': video_processor_v1.CONVERT_CHUNK_CHARS,
+        }
+        print(f"convert {fmt} {results[fmt]['file_mb']}MB: Python 分配峰值 {results[fmt]['python_peak_mb']}MB")
+        os.remove(output_file)
+    return results
+
+
+class RSSSampler(threading.Thread):
+    """定期采样本进程与 ffmpeg 子进程的 RSS 合计"""
+
+    def __init__(self, budget, interval):
+        super().__init__(daemon=True)
+        self.budget = budget
+        self.interval = interval
+        self.peak = 0
+        self.peak_self = 0
+        self.samples = 0
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.is_set():
+            total = self.budget.rss_bytes() or 0
+            self.peak = max(self.peak, total)
+            self.peak_self = max(self.peak_self, memory_budget.rss_bytes() or 0)
+            self.samples += 1
+            self._done.wait(self.interval)
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+def bench_batch(fixtures, work_dir, files, budget_mb, status_max_entries, sample_interval, timeout=3600):
+    """通过 Flask 测试客户端对 files 个文件运行 /batch-convert，记录 RSS 峰值"""
+    import api_server
+
+    batch_dir = os.path.join(work_dir, 'batch')
+    os.makedirs(batch_dir, exist_ok=True)
+    sources = list(fixtures.values())
+    for i in range(files):
+        source = sources[i % len(sources)]
+        shutil.copy2(source, os.path.join(batch_dir, f"{i:03d}_{os.path.basename(source)}"))
+
+    config = api_server.load_config()
+    config['video_directory'] = batch_dir
+    config['max_file_size_mb'] = float('inf')
+    config['smtp_settings'] = {'enable_email_notification': False}
+    config['memory_settings'] = dict(config.get('memory_settings', {}), subtitle_budget_mb=budget_mb,
+                                     status_max_entries=status_max_entries)
+    client = api_server.create_app(config=config, prewarm=False, watch_config=False).test_client()
+
+    sampler = RSSSampler(api_server.memory_budget, sample_interval)
+    rss_before = memory_budget.rss_bytes()
+    sampler.start()
+    start = time.perf_counter()
+    response = client.post('/batch-convert', json={})
+    if response.status_code != 200:
+        sampler.stop()
+        raise RuntimeError(f"/batch-convert 启动失败: {response.get_json()}")
+    status = {}
+    memory_paused = 0
+    while time.perf_counter() - start < timeout:
+        status = client.get('/batch-status').get_json()
+        if client.get('/queue').get_json().get('memory_paused'):
+            memory_paused += 1
+        if status.get('status') in ('completed', 'error'):
+            break
+        time.sleep(0.2)
+    elapsed = time.perf_counter() - start
+    sampler.stop()
+
+    queue_info = client.get('/queue').get_json()
+    all_status = client.get('/status').get_json()
+    result = {
+        'files': files,
+        'seconds': round(elapsed, 3),
+        'max_workers': queue_info['max_workers'],
+        'subtitle_budget_mb': budget_mb,
+        'rss_before_mb': _mb(rss_before),
+        'peak_rss_mb': _mb(sampler.peak),
+        'peak_self_rss_mb': _mb(sampler.peak_self),
+        'peak_self_rss_lifetime_mb': _mb(memory_budget.peak_rss_bytes()),
+        'peak_ffmpeg_rss_mb': _mb(memory_budget.peak_rss_bytes(children=True)),
+        'rss_samples': sampler.samples,
+        'memory_paused_polls': memory_paused,
+        'memory': queue_info['memory'],
+        'status_entries': all_status['total_files'],
+        'evicted_status_entries': all_status['evicted_status_entries'],
+        'batch_status': {key: status.get(key) for key in ('status', 'total_files', 'processed_files', 'skipped_files',
+                                                          'error_files')},
+    }
+    api_server.autoscaler.stop()
+    api_server.scheduler.shutdown(wait=False)
+    print(f"batch-convert {files} 个文件: {elapsed:.2f}s，RSS 峰值 {result['peak_rss_mb']}MB"
+          f"（本进程 {result['peak_self_rss_mb']}MB，单个 ffmpeg 最大 {result['peak_ffmpeg_rss_mb']}MB）")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='内存占用基准测试')
+    parser.add_argument('--files', type=int, default=100, help='批量处理的文件数')
+    parser.add_argument('--budget-mb', type=float, default=256, help='字幕内存预算（memory_settings.subtitle_budget_mb）')
+    parser.add_argument('--status-max-entries', type=int, default=50,
+                        help='保留的已结束处理状态数（小于文件数时可以观察到删除）')
+    parser.add_argument('--convert-hours', type=int, default=100, help='大字幕转换测试的字幕时长（小时）')
+    parser.add_argument('--sample-interval', type=float, default=0.1, help='RSS 采样间隔（秒）')
+    parser.add_argument('--fixtures-dir', default=os.path.join(tempfile.gettempdir(), 'video_converter_fixtures'),
+                        help='测试视频缓存目录（重复运行时复用）')
+    parser.add_argument('--output', help='结果 JSON 路径（默认写入 benchmarks/results/）')
+    args = parser.parse_args()
+
+    # 处理过程中的临时文件写在当前目录，在仓库根目录运行以使用 data/config.json
+    os.chdir(REPO_ROOT)
+    work_dir = tempfile.mkdtemp(prefix='video_converter_memory_')
+    results = {'environment': environment_info(), 'benchmarks': {}}
+    try:
+        results['benchmarks']['convert'] = bench_convert(work_dir, args.convert_hours)
+        if not ffmpeg_available():
+            print("未找到 ffmpeg/ffprobe，跳过批量处理测试")
+            results['skipped'] = ['batch_convert']
+        else:
+            fixtures = generate_fixtures(args.fixtures_dir, BATCH_FIXTURES)
+            results['benchmarks']['batch_convert'] = bench_batch(fixtures, work_dir, args.files, args.budget_mb,
+                                                                 args.status_max_entries, args.sample_interval)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    save_results('memory', results, args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,163 @@
+"""处理流水线基准测试
+
+对合成测试视频分别计时 analyze_subtitle_streams、convert_traditional_to_simplified、
+process_single_video 和完整的 /batch-convert，结果保存为 JSON，用于比较不同提交之间的性能变化。
+
+使用方法:
+    python benchmarks/bench_pipeline.py
+    python benchmarks/bench_pipeline.py --repeat 5 --output result.json
+"""
+import argparse
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from common import REPO_ROOT, environment_info, ffmpeg_available, save_results, time_call
+from fixtures import DEFAULT_FIXTURES, generate_fixtures, write_subtitle
+
+import video_processor_v1
+
+# 字幕转换基准使用的字幕时长（秒），每2秒一句
+CONVERT_DURATIONS = [600, 3600, 36000]
+
+
+def bench_convert(work_dir, repeat):
+    """纯 Python 的繁简转换，不依赖 ffmpeg"""
+    results = {}
+    for fmt in ('srt', 'ass'):
+        for duration in CONVERT_DURATIONS:
+            input_file = write_subtitle(os.path.join(work_dir, f"convert_{duration}.{fmt}"), fmt, 'traditional', duration)
+            output_file = os.path.join(work_dir, f"convert_{duration}_out.{fmt}")
+            stats, ok = time_call(
+                lambda: video_processor_v1.convert_traditional_to_simplified(input_file, output_file), repeat)
+            stats['ok'] = bool(ok)
+            stats['bytes'] = os.path.getsize(input_file)
+            stats['throughput_mb_s'] = round(stats['bytes'] / stats['median'] / (1024 * 1024), 2) if stats['median'] else None
+            results[f"{fmt}_{duration}s"] = stats
+            print(f"convert {fmt} {duration}s: {stats['median']}s")
+    return results
+
+
+def bench_analyze(fixtures, repeat):
+    results = {}
+    for name, path in fixtures.items():
+        stats, analysis = time_call(lambda: video_processor_v1.analyze_subtitle_streams(path), repeat)
+        streams, has_simplified, traditional_indices = analysis
+        # 单独再分析一次，统计分类阶段读取的字节数
+        probe = video_processor_v1.ProcessResult(path)
+        video_processor_v1._current.result = probe
+        try:
+            video_processor_v1.analyze_subtitle_streams(path)
+        finally:
+            video_processor_v1._current.result = None
+        stats.update({
+            'file_bytes': os.path.getsize(path),
+            'classification_bytes_read': probe.io.get('classification', {}).get('read', 0),
+            'subtitle_streams': len(streams),
+            'has_simplified': has_simplified,
+            'traditional_indices': traditional_indices,
+        })
+        results[name] = stats
+        print(f"analyze {name}: {stats['median']}s")
+    return results
+
+
+def _remove_outputs(directory):
+    for pattern in ('*_simplified.*', '*_backup.*', '*.chs.*', '*.sc.*'):
+        for path in glob.glob(os.path.join(directory, pattern)):
+            os.remove(path)
+
+
+def bench_process(fixtures, work_dir, repeat):
+    results = {}
+    process_dir = os.path.join(work_dir, 'process')
+    os.makedirs(process_dir, exist_ok=True)
+    for name, path in fixtures.items():
+        video = os.path.join(process_dir, os.path.basename(path))
+        shutil.copy2(path, video)
+        stats, result = time_call(lambda: video_processor_v1.process_single_video(video), repeat,
+                                  setup=lambda: _remove_outputs(process_dir))
+        stats['file_bytes'] = os.path.getsize(path)
+        stats['result'] = result.to_dict()
+        results[name] = stats
+        print(f"process {name}: {stats['median']}s ({result.outcome})")
+    _remove_outputs(process_dir)
+    return results
+
+
+def bench_batch(fixtures, work_dir, timeout=3600):
+    """通过 Flask 测试客户端运行完整的 /batch-convert"""
+    import api_server
+
+    batch_dir = os.path.join(work_dir, 'batch')
+    os.makedirs(batch_dir, exist_ok=True)
+    for path in fixtures.values():
+        shutil.copy2(path, os.path.join(batch_dir, os.path.basename(path)))
+
+    config = api_server.load_config()
+    config['video_directory'] = batch_dir
+    config['max_file_size_mb'] = float('inf')
+    config['smtp_settings'] = {'enable_email_notification': False}
+    client = api_server.create_app(config=config, prewarm=False).test_client()
+
+    start = time.perf_counter()
+    response = client.post('/batch-convert', json={})
+    if response.status_code != 200:
+        raise RuntimeError(f"/batch-convert 启动失败: {response.get_json()}")
+    status = {}
+    while time.perf_counter() - start < timeout:
+        status = client.get('/batch-status').get_json()
+        if status.get('status') in ('completed', 'error'):
+            break
+        time.sleep(0.2)
+    elapsed = time.perf_counter() - start
+
+    total_bytes = sum(os.path.getsize(path) for path in fixtures.values())
+    print(f"batch-convert {len(fixtures)} 个文件: {elapsed:.2f}s")
+    return {
+        'seconds': round(elapsed, 4),
+        'files': len(fixtures),
+        'input_bytes': total_bytes,
+        'throughput_mb_s': round(total_bytes / elapsed / (1024 * 1024), 2) if elapsed else None,
+        'max_workers': api_server.max_workers,
+        'status': status,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='处理流水线基准测试')
+    parser.add_argument('--repeat', type=int, default=3, help='每项测试的重复次数')
+    parser.add_argument('--fixtures-dir', default=os.path.join(tempfile.gettempdir(), 'video_converter_fixtures'),
+                        help='测试视频缓存目录（重复运行时复用）')
+    parser.add_argument('--output', help='结果 JSON 路径（默认写入 benchmarks/results/）')
+    parser.add_argument('--skip-batch', action='store_true', help='跳过 /batch-convert 测试')
+    args = parser.parse_args()
+
+    # 处理过程中的临时文件写在当前目录，在仓库根目录运行以使用 data/config.json
+    os.chdir(REPO_ROOT)
+    work_dir = tempfile.mkdtemp(prefix='video_converter_bench_')
+    results = {'environment': environment_info(), 'benchmarks': {}}
+    try:
+        results['benchmarks']['convert_traditional_to_simplified'] = bench_convert(work_dir, args.repeat)
+
+        if not ffmpeg_available():
+            print("未找到 ffmpeg/ffprobe，跳过依赖视频文件的测试")
+            results['skipped'] = ['analyze_subtitle_streams', 'process_single_video', 'batch_convert']
+        else:
+            fixtures = generate_fixtures(args.fixtures_dir, DEFAULT_FIXTURES)
+            results['fixtures'] = {name: os.path.getsize(path) for name, path in fixtures.items()}
+            results['benchmarks']['analyze_subtitle_streams'] = bench_analyze(fixtures, args.repeat)
+            results['benchmarks']['process_single_video'] = bench_process(fixtures, work_dir, args.repeat)
+            if not args.skip_batch:
+                results['benchmarks']['batch_convert'] = bench_batch(fixtures, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    save_results('pipeline', results, args.output)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,111 @@
+"""启动耗时基准测试
+
+每次在新的 Python 进程中分别计时：导入 api_server、create_app()、第一个 /files 请求，
+以及导入 video_processor_v1 和第一次繁简转换（加载词典），用于跟踪冷启动（容器启动、
+命令行调用）的开销。
+
+使用方法:
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --repeat 10 --output result.json
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from common import REPO_ROOT, environment_info, save_results
+
+# 在子进程中执行的计时脚本，结果以 JSON 输出到最后一行
+SERVER_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, {repo!r})
+import api_server
+imported = time.perf_counter()
+config = api_server.load_config()
+config['video_directory'] = {video_dir!r}
+app = api_server.create_app(config=config, prewarm=False)
+created = time.perf_counter()
+response = app.test_client().get('/files')
+responded = time.perf_counter()
+print(json.dumps({{
+    'import_api_server': imported - start,
+    'create_app': created - imported,
+    'first_files_request': responded - created,
+    'time_to_first_response': responded - start,
+    'status_code': response.status_code,
+    'zhconv_loaded': 'zhconv' in sys.modules,
+}}))
+"""
+
+CONVERTER_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, {repo!r})
+import video_processor_v1
+imported = time.perf_counter()
+video_processor_v1.convert_subtitle_text("1\\n00:00:01,000 --> 00:00:02,000\\n這是一個測試字幕\\n")
+converted = time.perf_counter()
+print(json.dumps({{
+    'import_video_processor': imported - start,
+    'first_conversion': converted - imported,
+}}))
+"""
+
+
+def run_probe(script, work_dir):
+    """在新进程中运行计时脚本，返回结果字典和进程总耗时"""
+    result = subprocess.run([sys.executable, '-c', script], cwd=work_dir, capture_output=True,
+                            timeout=120, text=True, encoding="utf-8")
+    if result.returncode != 0:
+        raise RuntimeError(f"计时脚本执行失败: {result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def summarize(samples):
+    """把多次运行的结果按字段汇总为 min/median/max（秒）"""
+    summary = {}
+    for key, value in samples[0].items():
+        if not isinstance(value, float):
+            summary[key] = value
+            continue
+        values = [sample[key] for sample in samples]
+        summary[key] = {
+            'min': round(min(values), 4),
+            'median': round(statistics.median(values), 4),
+            'max': round(max(values), 4),
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='启动耗时基准测试')
+    parser.add_argument('--repeat', type=int, default=5, help='每项测试的重复次数')
+    parser.add_argument('--output', help='结果 JSON 路径（默认写入 benchmarks/results/）')
+    args = parser.parse_args()
+
+    # 在临时目录中运行，缓存目录等文件不写入仓库
+    work_dir = tempfile.mkdtemp(prefix='video_converter_startup_')
+    video_dir = os.path.join(work_dir, 'download')
+    os.makedirs(video_dir)
+    results = {'environment': environment_info(), 'benchmarks': {}}
+    try:
+        for name, script in (('api_server', SERVER_PROBE), ('video_processor', CONVERTER_PROBE)):
+            script = script.format(repo=REPO_ROOT, video_dir=video_dir)
+            samples = [run_probe(script, work_dir) for _ in range(args.repeat)]
+            results['benchmarks'][name] = summarize(samples)
+            for key, value in results['benchmarks'][name].items():
+                if isinstance(value, dict):
+                    print(f"{name} {key}: {value['median']}s")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    save_results('startup', results, args.output)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
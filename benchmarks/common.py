@@ -0,0 +1,85 @@
+"""基准测试公共工具：计时、环境信息和结果保存"""
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+
+# 让基准脚本可以直接导入仓库根目录下的模块
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+
+def ffmpeg_available():
+    """ffmpeg 和 ffprobe 是否可用"""
+    ffmpeg_cmd = "ffmpeg.exe" if sys.platform.startswith('win') else "ffmpeg"
+    ffprobe_cmd = "ffprobe.exe" if sys.platform.startswith('win') else "ffprobe"
+    return shutil.which(ffmpeg_cmd) is not None and shutil.which(ffprobe_cmd) is not None
+
+
+def _command_output(cmd):
+    try:
+        result = subprocess.run(cmd, capture_output=True, timeout=10, text=True, encoding="utf-8")
+        return result.stdout.strip()
+    except Exception:
+        return None
+
+
+def environment_info():
+    """记录运行环境，便于比较不同机器或不同提交的结果"""
+    ffmpeg_version = None
+    if ffmpeg_available():
+        output = _command_output(["ffmpeg", "-version"])
+        ffmpeg_version = output.splitlines()[0] if output else None
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'ffmpeg': ffmpeg_version,
+        'git_commit': _command_output(["git", "-C", REPO_ROOT, "rev-parse", "--short", "HEAD"]),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def time_call(func, repeat=3, setup=None):
+    """多次执行 func 并返回耗时统计（秒）
+
+    Args:
+        func: 被计时的函数
+        repeat: 重复次数
+        setup: 每次计时前执行的准备函数（不计入耗时）
+    """
+    timings = []
+    result = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return {
+        'repeat': repeat,
+        'min': round(min(timings), 4),
+        'median': round(statistics.median(timings), 4),
+        'mean': round(statistics.mean(timings), 4),
+        'max': round(max(timings), 4),
+    }, result
+
+
+def save_results(name, results, output=None):
+    """保存结果为 JSON，默认写入 benchmarks/results/<name>-<时间戳>.json"""
+    if output is None:
+        if not os.path.exists(RESULTS_DIR):
+            os.makedirs(RESULTS_DIR)
+        output = os.path.join(RESULTS_DIR, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"结果已保存: {output}")
+    return output
@@ -0,0 +1,155 @@
+"""生成基准测试用的合成视频：ffmpeg lavfi 彩色画面 + 正弦波音频 + 生成的 SRT/ASS 字幕
+
+字幕内容有繁体、简体和英文三种，可以控制视频时长、码率（决定文件大小）和字幕轨数量。
+"""
+import os
+import subprocess
+import sys
+
+import zhconv
+
+# 繁体台词，简体版本由 zhconv 转换得到
+TRADITIONAL_LINES = [
+    "這是一個測試字幕，請不要在意內容。",
+    "我們明天早上在車站見面吧。",
+    "你聽說過關於那個傳說的故事嗎？",
+    "無論發生什麼事，我都會保護你。",
+    "這個問題的答案其實很簡單。",
+    "請把窗戶關上，外面風太大了。",
+    "他們已經準備好出發了。",
+    "電視上說今天會下雨。",
+    "學校的圖書館今天不開放。",
+    "謝謝你一直以來的幫助。",
+]
+ENGLISH_LINES = [
+    "This is a test subtitle, please ignore the content.",
+    "Let's meet at the station tomorrow morning.",
+    "Have you heard the story about that legend?",
+    "No matter what happens, I will protect you.",
+    "Thank you for all your help.",
+]
+
+ASS_HEADER = """[Script Info]
+ScriptType: v4.00+
+PlayResX: 1920
+PlayResY: 1080
+
+[V4+ Styles]
+Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding
+Style: Default,Arial,60,&H00FFFFFF,&H000000FF,&H00000000,&H00000000,0,0,0,0,100,100,0,0,1,2,1,2,10,10,30,1
+
+[Events]
+Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
+"""
+
+# 默认的一组测试视频：不同时长、大小和字幕轨组合
+DEFAULT_FIXTURES = [
+    {'name': 'short_cht_srt', 'container': 'mkv', 'duration': 60, 'bitrate': '200k',
+     'tracks': [('srt', 'traditional')]},
+    {'name': 'short_chs_srt', 'container': 'mkv', 'duration': 60, 'bitrate': '200k',
+     'tracks': [('srt', 'simplified')]},
+    {'name': 'medium_cht_ass_multi', 'container': 'mkv', 'duration': 600, 'bitrate': '500k',
+     'tracks': [('ass', 'traditional'), ('srt', 'english'), ('ass', 'traditional')]},
+    {'name': 'medium_untagged_cht', 'container': 'mkv', 'duration': 600, 'bitrate': '500k',
+     'tracks': [('srt', 'traditional')], 'tag_language': False},
+    {'name': 'long_cht_srt', 'container': 'mkv', 'duration': 1500, 'bitrate': '1000k',
+     'tracks': [('srt', 'english'), ('srt', 'traditional')]},
+    {'name': 'mp4_cht', 'container': 'mp4', 'duration': 300, 'bitrate': '300k',
+     'tracks': [('srt', 'traditional')]},
+]
+
+LANGUAGE_TAGS = {
+    'traditional': ('chi', '繁體中文'),
+    'simplified': ('chi', '简体中文'),
+    'english': ('eng', 'English'),
+}
+
+
+def _subtitle_lines(variant):
+    if variant == 'english':
+        return ENGLISH_LINES
+    if variant == 'simplified':
+        return [zhconv.convert(line, 'zh-cn') for line in TRADITIONAL_LINES]
+    return TRADITIONAL_LINES
+
+
+def _srt_time(seconds):
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    return f"{int(hours):02d}:{int(minutes):02d}:{int(secs):02d},{int(round((secs % 1) * 1000)):03d}"
+
+
+def _ass_time(seconds):
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    return f"{int(hours)}:{int(minutes):02d}:{secs:05.2f}"
+
+
+def write_subtitle(path, fmt, variant, duration, interval=2.0):
+    """生成一条字幕文件，每 interval 秒一句"""
+    lines = _subtitle_lines(variant)
+    count = int(duration / interval)
+    with open(path, 'w', encoding='utf-8') as f:
+        if fmt == 'ass':
+            f.write(ASS_HEADER)
+        for i in range(count):
+            start = i * interval
+            end = start + interval * 0.9
+            text = lines[i % len(lines)]
+            if fmt == 'ass':
+                f.write(f"Dialogue: 0,{_ass_time(start)},{_ass_time(end)},Default,,0,0,0,,{text}\n")
+            else:
+                f.write(f"{i + 1}\n{_srt_time(start)} --> {_srt_time(end)}\n{text}\n\n")
+    return path
+
+
+def generate_fixture(spec, output_dir):
+    """按照描述生成一个测试视频，已存在时直接返回路径"""
+    ffmpeg_cmd = "ffmpeg.exe" if sys.platform.startswith('win') else "ffmpeg"
+    container = spec.get('container', 'mkv')
+    output = os.path.join(output_dir, f"{spec['name']}.{container}")
+    if os.path.exists(output):
+        return output
+
+    duration = spec.get('duration', 60)
+    cmd = [
+        ffmpeg_cmd, "-v", "error", "-y",
+        "-f", "lavfi", "-i", f"color=c=black:s=320x240:r=10:d={duration}",
+        "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=22050:duration={duration}",
+    ]
+    subtitle_files = []
+    for i, (fmt, variant) in enumerate(spec['tracks']):
+        subtitle_path = os.path.join(output_dir, f"{spec['name']}_track{i}.{fmt}")
+        write_subtitle(subtitle_path, fmt, variant, duration)
+        subtitle_files.append(subtitle_path)
+        cmd.extend(["-i", subtitle_path])
+
+    cmd.extend(["-map", "0:v", "-map", "1:a"])
+    for i in range(len(subtitle_files)):
+        cmd.extend(["-map", f"{i + 2}:s"])
+    cmd.extend(["-c:v", "mpeg4", "-b:v", spec.get('bitrate', '200k'), "-c:a", "aac", "-b:a", "64k"])
+    cmd.extend(["-c:s", "mov_text" if container in ('mp4', 'mov') else "copy"])
+    for i, (_, variant) in enumerate(spec['tracks']):
+        language, title = LANGUAGE_TAGS[variant]
+        if spec.get('tag_language', True):
+            cmd.extend([f"-metadata:s:s:{i}", f"language={language}"])
+            cmd.extend([f"-metadata:s:s:{i}", f"title={title}"])
+    cmd.append(output)
+
+    result = subprocess.run(cmd, capture_output=True, timeout=600, text=True, encoding="utf-8")
+    for subtitle_path in subtitle_files:
+        os.remove(subtitle_path)
+    if result.returncode != 0:
+        raise RuntimeError(f"生成测试视频失败 {spec['name']}: {result.stderr}")
+    return output
+
+
+def generate_fixtures(output_dir, specs=None):
+    """生成一组测试视频，返回 {名称: 路径}"""
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    fixtures = {}
+    for spec in specs or DEFAULT_FIXTURES:
+        print(f"生成测试视频: {spec['name']}")
+        fixtures[spec['name']] = generate_fixture(spec, output_dir)
+    return fixtures
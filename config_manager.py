@@ -0,0 +1,185 @@
+"""配置管理：不可变配置快照、配置文件热加载和在线修改
+
+服务运行期间修改 data/config.json（或调用 PUT /config）后，ConfigManager 重新加载配置，
+发布新的只读快照并通知订阅者（调整线程池大小、I/O 限制等），不需要重启服务，
+正在执行的任务和 processing_status 都不受影响。
+
+快照是嵌套的只读映射（MappingProxyType），任务在提交时取得一次快照后一直使用，
+中途修改配置不会让同一个任务前后读到不同的设置；前端传入的覆盖项只复制顶层，
+未覆盖的嵌套配置与原快照共享。
+"""
+import copy
+import json
+import os
+import threading
+from collections.abc import Mapping
+from types import MappingProxyType
+
+# 检查配置文件是否修改的间隔（秒）
+WATCH_INTERVAL = 5
+
+
+def freeze(value):
+    """把配置转换为只读结构：dict → MappingProxyType，list → tuple，set → frozenset"""
+    if isinstance(value, Mapping):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(value)
+    return value
+
+
+def thaw(value):
+    """把只读配置转换回可以 JSON 序列化的普通结构"""
+    if isinstance(value, Mapping):
+        return {key: thaw(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [thaw(item) for item in value]
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    return value
+
+
+def overlay(snapshot, overrides):
+    """在快照上覆盖部分配置，返回新的快照
+
+    嵌套的配置（如 smtp_settings）按字段合并，没有覆盖项时直接返回原快照。
+    """
+    if not overrides:
+        return snapshot
+    merged = dict(snapshot)
+    for key, value in overrides.items():
+        if isinstance(value, Mapping) and isinstance(merged.get(key), Mapping):
+            merged[key] = freeze({**merged[key], **value})
+        else:
+            merged[key] = freeze(value)
+    return MappingProxyType(merged)
+
+
+def deep_merge(base, patch):
+    """把 patch 按字段合并到 base 的副本中（嵌套 dict 递归合并，其他值直接替换）"""
+    merged = copy.deepcopy(base)
+    for key, value in patch.items():
+        if isinstance(value, Mapping) and isinstance(merged.get(key), dict):
+            merged[key] = deep_merge(merged[key], value)
+        else:
+            merged[key] = copy.deepcopy(value)
+    return merged
+
+
+class ConfigManager:
+    """持有当前配置快照，支持从文件热加载和在线修改
+
+    Args:
+        config_file: 配置文件路径，为 None 时只使用 initial 且不写回文件
+        loader: 读取配置文件并补全默认值的函数，参数为文件路径，返回 dict
+        prepare: 把原始配置转换为快照的函数（计算派生字段、校验），配置无效时抛出 ValueError
+        initial: 初始的原始配置，为 None 时调用 loader 读取
+    """
+
+    def __init__(self, config_file, loader, prepare, initial=None):
+        self.config_file = config_file
+        self.loader = loader
+        self.prepare = prepare
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._watcher = None
+        self._stop = threading.Event()
+        self._mtime = self._file_mtime()
+        self._raw = initial if initial is not None else loader(config_file)
+        self._snapshot = prepare(self._raw)
+        self.version = 1
+
+    def _file_mtime(self):
+        if not self.config_file:
+            return None
+        try:
+            return os.path.getmtime(self.config_file)
+        except OSError:
+            return None
+
+    def snapshot(self):
+        """当前配置的只读快照"""
+        return self._snapshot
+
+    def raw(self):
+        """当前原始配置的副本（写回文件时使用的形式）"""
+        with self._lock:
+            return copy.deepcopy(self._raw)
+
+    def subscribe(self, callback):
+        """注册配置变化的回调 callback(旧快照, 新快照)"""
+        self._listeners.append(callback)
+
+    def _publish_locked(self, raw, snapshot):
+        """发布已校验的新配置，返回 (旧快照, 新快照)"""
+        previous = self._snapshot
+        self._raw = raw
+        self._snapshot = snapshot
+        self.version += 1
+        return previous, snapshot
+
+    def _notify(self, previous, snapshot):
+        for callback in self._listeners:
+            try:
+                callback(previous, snapshot)
+            except Exception as e:
+                print(f"应用配置变化失败: {str(e)}")
+
+    def reload(self):
+        """从配置文件重新加载，返回是否加载了新配置"""
+        with self._lock:
+            self._mtime = self._file_mtime()
+            try:
+                raw = self.loader(self.config_file)
+                previous, snapshot = self._publish_locked(raw, self.prepare(raw))
+            except ValueError as e:
+                print(f"配置文件无效，保留当前配置: {str(e)}")
+                return False
+        print(f"已重新加载配置文件: {self.config_file}")
+        self._notify(previous, snapshot)
+        return True
+
+    def update(self, patch, persist=True):
+        """按字段合并 patch 并发布新配置，persist 为 True 时写回配置文件
+
+        配置无效时抛出 ValueError，写入配置文件失败时抛出 OSError，两种情况下当前配置都不变。
+        返回 (旧快照, 新快照)。
+        """
+        with self._lock:
+            raw = deep_merge(self._raw, patch)
+            snapshot = self.prepare(raw)
+            if persist and self.config_file:
+                self._write_locked(raw)
+            previous, snapshot = self._publish_locked(raw, snapshot)
+        self._notify(previous, snapshot)
+        return previous, snapshot
+
+    def _write_locked(self, raw):
+        directory = os.path.dirname(self.config_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{self.config_file}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(raw, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, self.config_file)
+        # 自己写入的修改不需要再由监视线程重新加载
+        self._mtime = self._file_mtime()
+
+    def _watch_loop(self, interval):
+        while not self._stop.wait(interval):
+            mtime = self._file_mtime()
+            if mtime is not None and mtime != self._mtime:
+                self.reload()
+
+    def start_watching(self, interval=WATCH_INTERVAL):
+        """启动后台线程，配置文件修改后自动重新加载"""
+        if not self.config_file or self._watcher is not None:
+            return
+        self._watcher = threading.Thread(target=self._watch_loop, args=(interval,), name="config-watcher",
+                                         daemon=True)
+        self._watcher.start()
+
+    def stop_watching(self):
+        self._stop.set()
@@ -0,0 +1,249 @@
+"""后台转换的进程优先级和 I/O 限速
+
+批量重新封装会占满 NAS 的磁盘带宽，同一磁盘上正在播放的视频会卡顿。IOLimits 为
+ffmpeg 子进程提供三种限制：
+
+- 优先级：命令前加 nice / ionice（以及任意 command_prefix，如 systemd-run 的
+  cgroup 限制），这些命令都直接 exec 目标程序，进程号不变
+- 限速：令牌桶按 /proc/<pid>/io 中 ffmpeg 实际读写的字节数扣减，超出时用
+  SIGSTOP 暂停进程，令牌补足后 SIGCONT 继续；全局令牌桶在所有任务间共享，
+  每个 ffmpeg 进程另有自己的令牌桶
+- 本进程内的文件复制（替换原文件时的备份）按同样的令牌桶分块复制
+
+限速依赖 /proc 和 SIGSTOP，只在 Linux 上生效；其他系统上只使用 command_prefix。
+"""
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+MB = 1024 * 1024
+# ionice 调度类别
+IONICE_CLASSES = {'none': None, 'realtime': 1, 'best-effort': 2, 'idle': 3}
+# 检查子进程读写量的间隔（秒）
+GOVERNOR_INTERVAL = 0.1
+# 复制文件时每次读写的块大小
+COPY_CHUNK_SIZE = 4 * MB
+
+
+class TokenBucket:
+    """令牌桶：每秒补充 rate 个令牌，最多积累 burst 个（默认一秒的量）
+
+    线程安全，多个任务共享同一个令牌桶时按扣减顺序排队。
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst if burst is not None else rate)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def charge(self, amount):
+        """扣除 amount 个令牌（允许透支），返回还清透支需要等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= amount
+            return max(0.0, -self._tokens / self.rate)
+
+    def consume(self, amount):
+        """扣除 amount 个令牌，不够时阻塞等待"""
+        wait = self.charge(amount)
+        if wait > 0:
+            time.sleep(wait)
+
+
+def _process_io(pid):
+    """读取进程累计的 (读取字节数, 写入字节数)，不支持时返回 None"""
+    try:
+        with open(f"/proc/{pid}/io", 'r') as f:
+            counters = dict(line.split(': ', 1) for line in f.read().splitlines() if ': ' in line)
+        return int(counters['rchar']), int(counters['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+class _Governor(threading.Thread):
+    """按令牌桶限制一个子进程的读写速度，超出时暂停进程"""
+
+    def __init__(self, process, read_buckets, write_buckets):
+        super().__init__(name=f"io-governor-{process.pid}", daemon=True)
+        self.process = process
+        self.read_buckets = read_buckets
+        self.write_buckets = write_buckets
+        self.paused_seconds = 0.0
+        self._paused_since = None
+        self._stop = threading.Event()
+
+    def stop(self):
+        self._stop.set()
+
+    def paused_time(self):
+        """累计暂停的秒数（包括正在进行的暂停）"""
+        paused_since = self._paused_since
+        current = time.monotonic() - paused_since if paused_since is not None else 0.0
+        return self.paused_seconds + current
+
+    def run(self):
+        pid = self.process.pid
+        last = _process_io(pid)
+        if last is None:
+            return
+        while not self._stop.wait(GOVERNOR_INTERVAL) and self.process.poll() is None:
+            current = _process_io(pid)
+            if current is None:
+                return
+            read, written = current[0] - last[0], current[1] - last[1]
+            last = current
+            wait = max([bucket.charge(read) for bucket in self.read_buckets] +
+                       [bucket.charge(written) for bucket in self.write_buckets] + [0.0])
+            if wait <= 0:
+                continue
+            try:
+                os.kill(pid, signal.SIGSTOP)
+            except OSError:
+                return
+            self._paused_since = time.monotonic()
+            self._stop.wait(wait)
+            self.paused_seconds += time.monotonic() - self._paused_since
+            self._paused_since = None
+            try:
+                os.kill(pid, signal.SIGCONT)
+            except OSError:
+                return
+
+
+class IOLimits:
+    """ffmpeg 子进程的优先级和读写限速
+
+    Args:
+        nice: nice 值（0 表示不调整）
+        ionice_class: none、best-effort、idle 或 realtime
+        ionice_level: best-effort/realtime 的优先级（0-7，越大越低）
+        command_prefix: 加在命令最前面的参数列表，如 ["systemd-run", "--scope", "-p", "IOWeight=10"]
+        read_limit_mb, write_limit_mb: 所有任务合计的读写速度上限（MB/s，0 表示不限）
+        job_read_limit_mb, job_write_limit_mb: 每个 ffmpeg 进程的读写速度上限（MB/s，0 表示不限）
+    """
+
+    def __init__(self, nice=0, ionice_class='none', ionice_level=None, command_prefix=None,
+                 read_limit_mb=0, write_limit_mb=0, job_read_limit_mb=0, job_write_limit_mb=0):
+        if ionice_class not in IONICE_CLASSES:
+            raise ValueError(f"不支持的 ionice 类别: {ionice_class}，支持: {', '.join(IONICE_CLASSES)}")
+        self.nice = int(nice or 0)
+        self.ionice_class = ionice_class
+        self.ionice_level = ionice_level
+        self.job_read_rate = (job_read_limit_mb or 0) * MB
+        self.job_write_rate = (job_write_limit_mb or 0) * MB
+        self.read_bucket = TokenBucket(read_limit_mb * MB) if read_limit_mb else None
+        self.write_bucket = TokenBucket(write_limit_mb * MB) if write_limit_mb else None
+        self.prefix = self._build_prefix(list(command_prefix or []))
+
+    @classmethod
+    def from_settings(cls, settings):
+        """从 parallel_settings 创建"""
+        return cls(nice=settings.get('nice', 0),
+                   ionice_class=settings.get('ionice_class', 'none'),
+                   ionice_level=settings.get('ionice_level'),
+                   command_prefix=settings.get('command_prefix'),
+                   read_limit_mb=settings.get('read_limit_mb', 0),
+                   write_limit_mb=settings.get('write_limit_mb', 0),
+                   job_read_limit_mb=settings.get('job_read_limit_mb', 0),
+                   job_write_limit_mb=settings.get('job_write_limit_mb', 0))
+
+    def _build_prefix(self, prefix):
+        if sys.platform.startswith('win'):
+            return prefix
+        if self.nice and shutil.which('nice'):
+            prefix += ['nice', '-n', str(self.nice)]
+        ionice_class = IONICE_CLASSES[self.ionice_class]
+        if ionice_class is not None:
+            if shutil.which('ionice'):
+                prefix += ['ionice', '-c', str(ionice_class)]
+                if self.ionice_level is not None and ionice_class != 3:
+                    prefix += ['-n', str(self.ionice_level)]
+            else:
+                print("未找到 ionice，忽略 ionice_class 设置")
+        return prefix
+
+    @property
+    def throttled(self):
+        return bool(self.read_bucket or self.write_bucket or self.job_read_rate or self.job_write_rate)
+
+    def _buckets(self):
+        """本次调用使用的 (读取令牌桶列表, 写入令牌桶列表)：全局令牌桶 + 本进程自己的令牌桶"""
+        read_buckets = [bucket for bucket in (self.read_bucket,) if bucket]
+        write_buckets = [bucket for bucket in (self.write_bucket,) if bucket]
+        if self.job_read_rate:
+            read_buckets.append(TokenBucket(self.job_read_rate))
+        if self.job_write_rate:
+            write_buckets.append(TokenBucket(self.job_write_rate))
+        return read_buckets, write_buckets
+
+    def wrap(self, cmd):
+        """加上 nice/ionice 等前缀的命令"""
+        return self.prefix + list(cmd)
+
+    def popen(self, cmd, on_spawn=None, **kwargs):
+        """启动子进程并开始限速，返回 (process, governor)，governor 为 None 表示不限速
+
+        on_spawn 在子进程启动后立即以 process 调用（如设置内存上限）。
+        """
+        process = subprocess.Popen(self.wrap(cmd), **kwargs)
+        if on_spawn is not None:
+            on_spawn(process)
+        governor = None
+        if self.throttled and not sys.platform.startswith('win'):
+            governor = _Governor(process, *self._buckets())
+            governor.start()
+        return process, governor
+
+    def run(self, cmd, timeout=None, **kwargs):
+        """与 subprocess.run(capture_output=True) 相同，但超时不计入限速暂停的时间"""
+        process, governor = self.popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **kwargs)
+        started = time.monotonic()
+        try:
+            while True:
+                elapsed = time.monotonic() - started - (governor.paused_time() if governor else 0)
+                remaining = None if timeout is None else timeout - elapsed
+                if remaining is not None and remaining <= 0:
+                    process.kill()
+                    stdout, stderr = process.communicate()
+                    raise subprocess.TimeoutExpired(cmd, timeout, output=stdout, stderr=stderr)
+                try:
+                    stdout, stderr = process.communicate(timeout=remaining)
+                    break
+                except subprocess.TimeoutExpired:
+                    # 暂停的时间不算超时，重新计算剩余时间
+                    continue
+        finally:
+            if governor is not None:
+                governor.stop()
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+        return subprocess.CompletedProcess(process.args, process.returncode, stdout, stderr)
+
+    def copy_file(self, src, dst):
+        """按读写限速分块复制文件（保留修改时间等属性，与 shutil.copy2 相同）"""
+        read_buckets, write_buckets = self._buckets()
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            for chunk in iter(lambda: fsrc.read(COPY_CHUNK_SIZE), b''):
+                wait = max([bucket.charge(len(chunk)) for bucket in read_buckets + write_buckets] + [0.0])
+                if wait > 0:
+                    time.sleep(wait)
+                fdst.write(chunk)
+        shutil.copystat(src, dst)
+
+    def stats(self):
+        return {
+            'command_prefix': self.prefix,
+            'read_limit_bytes': self.read_bucket.rate if self.read_bucket else None,
+            'write_limit_bytes': self.write_bucket.rate if self.write_bucket else None,
+            'job_read_limit_bytes': self.job_read_rate or None,
+            'job_write_limit_bytes': self.job_write_rate or None,
+        }
@@ -0,0 +1,474 @@
+"""任务调度器：按优先级分道执行视频处理任务
+
+单文件 /process 请求走交互通道（PRIORITY_INTERACTIVE），批量转换中的文件走批量通道
+（PRIORITY_BATCH）。交互任务总是排在批量任务之前，并且批量任务最多只能占用
+max_workers - reserved_interactive_workers 个工作线程，保证批量任务占满线程池时
+交互请求仍有空闲线程可用。
+
+重新封装会在输出目录写一份完整的视频（替换原文件时还要再复制一份备份）。提交任务时
+可以指定 disk_path 和 disk_bytes：调度器为正在执行的任务预留这部分空间，
+shutil.disk_usage 显示的剩余空间减去已预留的空间放不下时，任务先留在队列中，等其他
+任务完成释放预留后再开始，而不是几个任务同时写满磁盘、写到一半一起失败。
+
+batch_gate 可以限制批量任务的开始时间（见 BatchSchedule）：关闭时批量任务留在队列中，
+交互任务和以 gated=False 提交的批量任务（如只读的批量处理计划）不受影响。memory_gate 在内存紧张时（见 memory_budget.MemoryBudget）暂停开始新任务
+（两个通道都暂停，但没有任务在执行时总是允许开始一个，保证队列继续前进）。
+
+resize() 在运行中调整线程数：增加时立即启动新线程，减少时多出的线程在当前任务完成后退出，
+正在执行的任务不会被中断。
+"""
+import heapq
+import itertools
+import os
+import shutil
+import threading
+import time
+import uuid
+
+from metrics import QUEUE_WAIT_SECONDS, WORKER_BUSY_SECONDS
+
+# 优先级（数值越小越优先）
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+
+LANE_NAMES = {
+    PRIORITY_INTERACTIVE: 'interactive',
+    PRIORITY_BATCH: 'batch',
+}
+
+# 有任务因磁盘空间不足或批量时段限制等待时，重新检查的间隔（秒）
+RECHECK_INTERVAL = 30
+# 因内存紧张暂停时重新检查的间隔（秒），任务执行中释放的内存也能及时用上
+MEMORY_RECHECK_INTERVAL = 5
+
+
+class BatchSchedule:
+    """批量任务的运行时段：只在 window 时段内和/或系统空闲时开始新的批量任务
+
+    作为 JobScheduler 的 batch_gate 使用，返回 None 表示可以开始，否则返回暂停原因。
+
+    Args:
+        window: 允许的时段，如 "01:00-07:00"（可跨午夜），为空时不限制
+        idle_only: 是否只在系统空闲时开始
+        idle_max_load: 1 分钟平均负载低于该值视为空闲（正在执行的批量任务也计入负载）
+    """
+
+    def __init__(self, window=None, idle_only=False, idle_max_load=1.0):
+        self.window = self._parse_window(window) if window else None
+        self.window_text = window or None
+        self.idle_only = idle_only
+        self.idle_max_load = idle_max_load
+        if idle_only and not hasattr(os, 'getloadavg'):
+            print("当前系统不支持读取平均负载，忽略 batch_idle_only 设置")
+            self.idle_only = False
+
+    @staticmethod
+    def _parse_window(window):
+        try:
+            start, end = window.split('-')
+            return tuple(int(h) * 60 + int(m) for h, m in (part.strip().split(':') for part in (start, end)))
+        except ValueError:
+            raise ValueError(f"批量时段格式错误: {window}，应为 HH:MM-HH:MM")
+
+    @property
+    def enabled(self):
+        return bool(self.window or self.idle_only)
+
+    def __call__(self):
+        if self.window:
+            now = time.localtime()
+            minute = now.tm_hour * 60 + now.tm_min
+            start, end = self.window
+            inside = start <= minute < end if start <= end else (minute >= start or minute < end)
+            if not inside:
+                return f"不在批量处理时段 {self.window_text} 内"
+        if self.idle_only:
+            load = os.getloadavg()[0]
+            if load >= self.idle_max_load:
+                return f"系统负载 {load:.2f} 不低于 {self.idle_max_load}，等待空闲"
+        return None
+
+
+class Job:
+    """调度器中的一个任务"""
+
+    def __init__(self, func, args, kwargs, priority, key=None, job_id=None, disk_path=None, disk_bytes=0,
+                 gated=True):
+        self.job_id = job_id or uuid.uuid4().hex
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.key = key
+        self.gated = gated
+        self.disk_path = disk_path
+        self.disk_bytes = disk_bytes if disk_path else 0
+        self.disk_device = None
+        self.waiting_for_disk = False
+        self.status = 'queued'
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        self._done = threading.Event()
+
+    @property
+    def lane(self):
+        return LANE_NAMES.get(self.priority, str(self.priority))
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """等待任务结束，返回任务结果"""
+        self._done.wait(timeout)
+        return self.result
+
+    def to_dict(self):
+        info = {
+            'job_id': self.job_id,
+            'key': self.key,
+            'lane': self.lane,
+            'status': self.status,
+            'submitted_at': self.submitted_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+        if self.started_at is not None:
+            info['queue_wait'] = round(self.started_at - self.submitted_at, 3)
+        if self.disk_bytes:
+            info['disk_bytes'] = self.disk_bytes
+            info['waiting_for_disk'] = self.waiting_for_disk
+        if self.error is not None:
+            info['error'] = self.error
+        return info
+
+
+class JobScheduler:
+    """带优先级通道和交互预留线程的线程池
+
+    Args:
+        max_workers: 工作线程总数
+        reserved_interactive_workers: 为交互任务预留的线程数（批量任务不能占用）
+        min_free_bytes: 每块磁盘在扣除预留空间后至少保留的剩余空间（字节）
+        disk_paths: 在 stats() 中报告剩余空间的目录（如视频目录），有任务写入的目录会自动加入
+        batch_gate: 返回 None 时允许开始批量任务，否则返回暂停原因（如 BatchSchedule）
+        memory_gate: 返回 None 时允许开始新任务，否则返回暂停原因（如 MemoryBudget）
+    """
+
+    def __init__(self, max_workers=3, reserved_interactive_workers=1, min_free_bytes=0, disk_paths=(),
+                 batch_gate=None, memory_gate=None):
+        self.max_workers = max(1, int(max_workers))
+        # 配置的交互预留线程数；实际预留数随线程数变化（见 reserved_interactive_workers）
+        self.configured_reserved_workers = max(0, int(reserved_interactive_workers))
+        self.min_free_bytes = max(0, int(min_free_bytes))
+        self.batch_gate = batch_gate
+        self._batch_paused = None
+        self.memory_gate = memory_gate
+        self._memory_paused = None
+        self._queue = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._running = {PRIORITY_INTERACTIVE: 0, PRIORITY_BATCH: 0}
+        self._jobs = {}
+        # 开始执行的任务数和它们的排队等待时间总和（供自动调整线程数计算平均等待时间）
+        self.started_jobs = 0
+        self.queue_wait_seconds = 0.0
+        # 设备号 → 正在执行的任务预留的字节数 / 该设备上的一个目录
+        self._disk_reserved = {}
+        self._disk_paths = {}
+        for path in disk_paths:
+            device = self._device_of(path)
+            if device is not None:
+                self._disk_paths.setdefault(device, path)
+        self._shutdown = False
+        self._threads = []
+        self._thread_seq = itertools.count()
+        with self._cond:
+            self._spawn_workers_locked()
+
+    def _spawn_workers_locked(self):
+        """启动线程直到线程数达到 max_workers"""
+        while len(self._threads) < self.max_workers:
+            thread = threading.Thread(target=self._worker_loop, name=f"job-worker-{next(self._thread_seq)}",
+                                      daemon=True)
+            self._threads.append(thread)
+            thread.start()
+
+    def resize(self, max_workers, reserved_interactive_workers=None):
+        """调整工作线程数和交互预留线程数，减少时正在执行的任务继续完成"""
+        with self._cond:
+            if self._shutdown:
+                return
+            self.max_workers = max(1, int(max_workers))
+            # 只保存配置值，线程数减少时临时缩小的预留在线程数恢复后也随之恢复
+            if reserved_interactive_workers is not None:
+                self.configured_reserved_workers = max(0, int(reserved_interactive_workers))
+            self._spawn_workers_locked()
+            # 唤醒空闲线程：多出的线程退出，批量通道名额变化后重新选择任务
+            self._cond.notify_all()
+
+    @property
+    def reserved_interactive_workers(self):
+        """实际的交互预留线程数：至少留一个线程给批量任务，否则批量任务永远无法执行"""
+        return max(0, min(self.configured_reserved_workers, self.max_workers - 1))
+
+    @property
+    def batch_capacity(self):
+        """批量任务可同时占用的线程数"""
+        return self.max_workers - self.reserved_interactive_workers
+
+    def submit(self, func, *args, priority=PRIORITY_INTERACTIVE, key=None, job_id=None,
+               disk_path=None, disk_bytes=0, gated=True, **kwargs):
+        """提交任务，返回 Job 对象
+        
+        disk_path/disk_bytes: 任务将在 disk_path 所在磁盘上写入的估算字节数，放不下时延后执行
+        gated: 为 False 时批量任务不受 batch_gate 限制（仍受批量通道线程数限制）
+        """
+        job = Job(func, args, kwargs, priority, key=key, job_id=job_id, disk_path=disk_path, disk_bytes=disk_bytes,
+                  gated=gated)
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError('调度器已关闭')
+            heapq.heappush(self._queue, (priority, next(self._seq), job))
+            self._jobs[job.job_id] = job
+            self._cond.notify()
+        return job
+
+    def submit_many(self, func, calls, priority=PRIORITY_INTERACTIVE):
+        """一次提交多个任务，全部放入队列后才唤醒工作线程，返回 Job 列表
+
+        calls: 每个任务的参数字典，包含 args 和可选的 key、job_id、disk_path、disk_bytes
+        """
+        jobs = [Job(func, tuple(call.get('args', ())), {}, priority, key=call.get('key'), job_id=call.get('job_id'),
+                    disk_path=call.get('disk_path'), disk_bytes=call.get('disk_bytes', 0))
+                for call in calls]
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError('调度器已关闭')
+            for job in jobs:
+                heapq.heappush(self._queue, (priority, next(self._seq), job))
+                self._jobs[job.job_id] = job
+            self._cond.notify_all()
+        return jobs
+
+    def get_job(self, job_id):
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def _can_start(self, job):
+        self._memory_paused = None
+        if self.memory_gate is not None and any(self._running.values()):
+            self._memory_paused = self.memory_gate()
+            if self._memory_paused:
+                return False
+        if job.priority == PRIORITY_INTERACTIVE:
+            return True
+        if self._running[PRIORITY_BATCH] >= self.batch_capacity:
+            return False
+        if job.gated and self.batch_gate is not None:
+            self._batch_paused = self.batch_gate()
+            if self._batch_paused:
+                return False
+        return True
+
+    @staticmethod
+    def _device_of(path):
+        try:
+            return os.stat(path).st_dev
+        except OSError:
+            return None
+
+    def _free_bytes(self, path, cache):
+        """path 所在磁盘的剩余空间，同一次调度中每个目录只检查一次"""
+        if path not in cache:
+            try:
+                cache[path] = shutil.disk_usage(path).free
+            except OSError:
+                cache[path] = None
+        return cache[path]
+
+    def _disk_fits_locked(self, job, free_cache):
+        """任务的预计写入量能否放进磁盘（需持有锁）"""
+        if not job.disk_bytes:
+            return True
+        device = self._device_of(job.disk_path)
+        free = self._free_bytes(job.disk_path, free_cache)
+        if device is None or free is None:
+            # 无法检查时不阻止任务，由任务自己报错
+            return True
+        self._disk_paths.setdefault(device, job.disk_path)
+        reserved = self._disk_reserved.get(device, 0)
+        # 正在执行的任务已经写入的部分同时计入了剩余空间和预留空间，这里的估算偏保守
+        if free - reserved - self.min_free_bytes >= job.disk_bytes or reserved == 0:
+            # 没有其他任务占用这块磁盘时仍然放不下，等待也不会有空间，直接执行，
+            # 由 process_single_video 在写入前检查空间并报错
+            job.disk_device = device
+            return True
+        return False
+
+    def _start_locked(self, job):
+        job.waiting_for_disk = False
+        if job.disk_device is not None:
+            self._disk_reserved[job.disk_device] = self._disk_reserved.get(job.disk_device, 0) + job.disk_bytes
+        return job
+
+    def _next_job_locked(self):
+        """取出下一个可执行的任务（需持有锁）"""
+        # 队首是优先级最高的任务；交互任务永远排在批量任务之前，
+        # 所以队首不能执行时说明只剩批量任务且批量通道已满
+        while self._queue and self._queue[0][2].status == 'cancelled':
+            heapq.heappop(self._queue)
+        if not self._queue:
+            return None
+        if not self._can_start(self._queue[0][2]):
+            # 批量时段外队首的批量任务不能开始，后面不受时段限制的批量任务仍可以执行
+            if self._queue[0][2].gated and self._batch_paused and not self._memory_paused:
+                return self._next_ungated_locked()
+            return None
+        free_cache = {}
+        job = self._queue[0][2]
+        if self._disk_fits_locked(job, free_cache):
+            heapq.heappop(self._queue)
+            return self._start_locked(job)
+        
+        # 队首任务放不下时，按优先级顺序找一个放得下的任务（通常是写入量小的）先执行
+        job.waiting_for_disk = True
+        for entry in sorted(self._queue)[1:]:
+            job = entry[2]
+            if job.status == 'cancelled':
+                continue
+            if not self._can_start(job):
+                break
+            if self._disk_fits_locked(job, free_cache):
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                return self._start_locked(job)
+            job.waiting_for_disk = True
+        return None
+
+    def _next_ungated_locked(self):
+        """批量时段外取出一个不受时段限制的批量任务（需持有锁）"""
+        free_cache = {}
+        for entry in sorted(self._queue):
+            job = entry[2]
+            if job.status == 'cancelled' or job.gated:
+                continue
+            if not self._can_start(job):
+                break
+            if self._disk_fits_locked(job, free_cache):
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                return self._start_locked(job)
+            job.waiting_for_disk = True
+        return None
+
+    def _needs_recheck_locked(self):
+        """有任务在等待磁盘空间或批量时段时，需要定期重新检查"""
+        return any(entry[2].status == 'queued' and
+                   (entry[2].waiting_for_disk or (self._batch_paused and entry[2].priority == PRIORITY_BATCH))
+                   for entry in self._queue)
+
+    def _surplus_locked(self):
+        return len(self._threads) > self.max_workers
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                job = None if self._surplus_locked() else self._next_job_locked()
+                while job is None:
+                    if self._shutdown:
+                        return
+                    if self._surplus_locked():
+                        # 线程数已减少，多出的线程退出
+                        self._threads.remove(threading.current_thread())
+                        return
+                    # 有任务在等待磁盘空间、批量时段或内存时定期重新检查
+                    if self._memory_paused and self._queue:
+                        self._cond.wait(MEMORY_RECHECK_INTERVAL)
+                    else:
+                        self._cond.wait(RECHECK_INTERVAL if self._needs_recheck_locked() else None)
+                    job = self._next_job_locked()
+                job.status = 'running'
+                job.started_at = time.time()
+                self._running[job.priority] = self._running.get(job.priority, 0) + 1
+                self.started_jobs += 1
+                self.queue_wait_seconds += job.started_at - job.submitted_at
+            QUEUE_WAIT_SECONDS.observe(job.started_at - job.submitted_at, lane=job.lane)
+
+            try:
+                job.result = job.func(*job.args, **job.kwargs)
+                job.status = 'done'
+            except Exception as e:
+                job.error = str(e)
+                job.status = 'error'
+                print(f"任务执行出错 ({job.key or job.job_id}): {str(e)}")
+            finally:
+                job.finished_at = time.time()
+                WORKER_BUSY_SECONDS.inc(job.finished_at - job.started_at)
+                with self._cond:
+                    self._running[job.priority] -= 1
+                    self._jobs.pop(job.job_id, None)
+                    if job.disk_device is not None:
+                        self._disk_reserved[job.disk_device] -= job.disk_bytes
+                    # 释放的可能是批量通道名额，唤醒其他线程重新检查
+                    self._cond.notify_all()
+                job._done.set()
+
+    def cancel(self, job_id):
+        """取消尚未开始的任务"""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None or job.status != 'queued':
+                return False
+            job.status = 'cancelled'
+            self._jobs.pop(job_id, None)
+        job._done.set()
+        return True
+
+    def stats(self):
+        """返回各通道的排队和执行情况"""
+        with self._cond:
+            queued = {name: 0 for name in LANE_NAMES.values()}
+            for _, _, job in self._queue:
+                if job.status == 'queued':
+                    queued[job.lane] = queued.get(job.lane, 0) + 1
+            running = {LANE_NAMES.get(p, str(p)): n for p, n in self._running.items()}
+            busy = sum(self._running.values())
+            waiting_for_disk = sum(1 for _, _, job in self._queue
+                                   if job.status == 'queued' and job.waiting_for_disk)
+            disk = []
+            for device, path in self._disk_paths.items():
+                free = self._free_bytes(path, {})
+                reserved = self._disk_reserved.get(device, 0)
+                disk.append({
+                    'path': path,
+                    'free_bytes': free,
+                    'reserved_bytes': reserved,
+                    'min_free_bytes': self.min_free_bytes,
+                    'headroom_bytes': free - reserved - self.min_free_bytes if free is not None else None,
+                })
+            return {
+                'max_workers': self.max_workers,
+                'reserved_interactive_workers': self.reserved_interactive_workers,
+                'batch_capacity': self.batch_capacity,
+                'busy_workers': busy,
+                'idle_workers': max(0, self.max_workers - busy),
+                'queued': queued,
+                'running': running,
+                'waiting_for_disk': waiting_for_disk,
+                'batch_paused': self._batch_paused if queued.get('batch') else None,
+                'memory_paused': self._memory_paused if any(queued.values()) else None,
+                'disk': disk,
+                'started_jobs': self.started_jobs,
+                'queue_wait_seconds': round(self.queue_wait_seconds, 3),
+            }
+
+    def shutdown(self, wait=True):
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify_all()
+        if wait:
+            for thread in list(self._threads):
+                thread.join()
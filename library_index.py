@@ -0,0 +1,334 @@
+"""媒体库目录索引：一次遍历 video_directory，按文件名、去掉扩展名的文件名和通配符查找文件
+
+/process 按文件名查找视频时原本每次都要遍历整个目录树（精确匹配一次，模糊匹配再一次）。
+LibraryIndex 缓存一次遍历的结果（Catalog），在 ttl 秒内复用；按文件名找不到时重新遍历一次，
+刚下载完成的文件也能立即找到。
+
+批量处理前按转换状态排除文件，不再对它们调用 ffprobe：
+- 按命名规则（NamingRules）：本工具生成的 *_simplified、*_backup 文件是派生文件；
+  旁边已有输出文件（Episode_simplified.mkv、Episode.chs.srt）的源文件已转换
+- 按 ConversionStateIndex 记录的处理结果：分析后因没有繁体字幕等原因跳过、或已原地替换的文件，
+  大小和修改时间不变时再次处理结果也相同
+"""
+import atexit
+import fnmatch
+import json
+import os
+import threading
+import time
+
+# 通配符字符，文件名中包含时按 fnmatch 匹配
+GLOB_CHARS = '*?['
+# 转换状态：派生文件（输出、备份、临时文件）/ 旁边已有输出文件的源文件
+STATE_DERIVED = 'derived'
+STATE_CONVERTED = 'converted'
+# 转换状态索引写盘的最小间隔（秒）
+SAVE_INTERVAL = 5
+
+
+def is_glob(pattern):
+    return any(char in pattern for char in GLOB_CHARS)
+
+
+class CatalogEntry:
+    """索引中的一个文件"""
+
+    __slots__ = ('filename', 'relative_path', 'full_path', 'size', 'mtime')
+
+    def __init__(self, filename, relative_path, full_path, size, mtime):
+        self.filename = filename
+        self.relative_path = relative_path
+        self.full_path = full_path
+        self.size = size
+        self.mtime = mtime
+
+    def to_dict(self):
+        return {
+            'filename': self.filename,
+            'relative_path': self.relative_path,
+            'full_path': self.full_path,
+            'size_mb': round(self.size / (1024 * 1024), 2),
+        }
+
+
+class NamingRules:
+    """本工具生成文件的命名规则
+
+    Args:
+        output_suffix: 重新封装输出文件的后缀（Episode_simplified.mkv）
+        output_mode: remux、sidecar 或 both
+        replace_original: 是否替换原文件（替换后的文件无法按命名判断，只能按 ConversionStateIndex）
+        backup_suffix: 替换原文件时备份文件的后缀
+        sidecar_tag: 简体外挂字幕的语言标记（Episode.chs.srt）
+        sidecar_output: 繁体外挂字幕文件名 → 简体外挂字幕文件名的函数，不是繁体外挂字幕时返回 None
+    """
+
+    def __init__(self, output_suffix='_simplified', output_mode='remux', replace_original=False,
+                 backup_suffix='_backup', sidecar_tag='chs', sidecar_output=None):
+        self.output_suffix = output_suffix
+        self.output_mode = output_mode
+        self.replace_original = replace_original
+        self.backup_suffix = backup_suffix
+        self.sidecar_tag = sidecar_tag
+        self.sidecar_output = sidecar_output
+        self.derived_suffixes = tuple(suffix for suffix in (output_suffix, backup_suffix, '_temp_output') if suffix)
+
+
+class Catalog:
+    """一次目录遍历的结果（创建后不再修改，可以在线程间共享）
+
+    Args:
+        root: 媒体库根目录
+        entries: CatalogEntry 列表，按目录遍历的顺序（根目录在前，同一目录内按名称排序）
+        extensions: 允许的视频扩展名（小写），模糊匹配只返回这些扩展名的文件
+        dir_files: 目录 → 该目录下所有文件名（包括没有加入 entries 的文件，用于判断输出文件是否存在）
+    """
+
+    def __init__(self, root, entries, extensions, dir_files=None):
+        self.root = root
+        self.entries = entries
+        self.dir_files = dir_files or {}
+        self._sidecar_stems = {}
+        self.built_at = time.time()
+        self.by_name = {}
+        self.by_stem = {}
+        for entry in entries:
+            self.by_name.setdefault(entry.filename, entry)
+            if os.path.splitext(entry.filename)[1].lower() in extensions:
+                self.by_stem.setdefault(os.path.splitext(entry.filename)[0], entry)
+
+    def find(self, filename):
+        """按文件名查找：先精确匹配，再忽略扩展名匹配，找不到时返回 None"""
+        if filename in self.by_name:
+            return self.by_name[filename]
+        return self.by_stem.get(os.path.splitext(filename)[0])
+
+    def match(self, pattern):
+        """返回文件名或相对路径与通配符匹配的所有文件"""
+        return [entry for entry in self.entries
+                if fnmatch.fnmatch(entry.filename, pattern) or
+                fnmatch.fnmatch(entry.relative_path.replace(os.sep, '/'), pattern)]
+
+    def _stems_with_sidecar(self, directory, tag):
+        """目录中已有简体外挂字幕（<stem>.chs.srt、<stem>.chs.2.ass）的文件名主干"""
+        key = (directory, tag)
+        stems = self._sidecar_stems.get(key)
+        if stems is None:
+            marker = f".{tag}."
+            stems = frozenset(name[:name.rfind(marker)] for name in self.dir_files.get(directory, ())
+                              if marker in name)
+            self._sidecar_stems[key] = stems
+        return stems
+
+    def conversion_state(self, entry, rules):
+        """按命名规则判断文件的转换状态：STATE_DERIVED、STATE_CONVERTED 或 None（需要分析）"""
+        directory = os.path.dirname(entry.full_path)
+        siblings = self.dir_files.get(directory, ())
+        if rules.sidecar_output is not None:
+            simplified = rules.sidecar_output(entry.filename)
+            if simplified is not None:
+                return STATE_CONVERTED if simplified in siblings else None
+        stem, ext = os.path.splitext(entry.filename)
+        if rules.derived_suffixes and stem.endswith(rules.derived_suffixes):
+            return STATE_DERIVED
+        if rules.replace_original:
+            return None
+        if rules.output_mode == 'sidecar':
+            return STATE_CONVERTED if stem in self._stems_with_sidecar(directory, rules.sidecar_tag) else None
+        return STATE_CONVERTED if f"{stem}{rules.output_suffix}{ext}" in siblings else None
+
+
+class LibraryIndex:
+    """缓存的媒体库目录索引
+
+    Args:
+        root: 媒体库根目录（video_directory）
+        include: 判断文件名是否加入索引的函数（如允许的扩展名和繁体外挂字幕）
+        extensions: 允许的视频扩展名，用于模糊匹配
+        ttl: 索引的有效时间（秒），超过后下一次查找时重新遍历
+    """
+
+    def __init__(self, root, include, extensions=(), ttl=30):
+        self._lock = threading.Lock()
+        self._catalog = None
+        self.rebuilds = 0
+        self.configure(root, include, extensions, ttl)
+
+    def configure(self, root, include, extensions=(), ttl=30):
+        """修改目录或筛选条件（配置热加载时调用），下一次查找时重新遍历"""
+        with self._lock:
+            self.root = root
+            self.include = include
+            self.extensions = frozenset(ext.lower() for ext in extensions)
+            self.ttl = ttl
+            self._catalog = None
+
+    def invalidate(self):
+        with self._lock:
+            self._catalog = None
+
+    def _build(self):
+        root, include, extensions = self.root, self.include, self.extensions
+        entries = []
+        dir_files = {}
+        for directory, dirs, files in os.walk(root):
+            # 按名称排序，通配符匹配的结果按剧集顺序排列
+            dirs.sort()
+            dir_files[directory] = frozenset(files)
+            for file in sorted(files):
+                if not include(file):
+                    continue
+                full_path = os.path.join(directory, file)
+                try:
+                    stat = os.stat(full_path)
+                except OSError:
+                    continue
+                entries.append(CatalogEntry(file, os.path.relpath(full_path, root), full_path,
+                                            stat.st_size, stat.st_mtime))
+        return Catalog(root, entries, extensions, dir_files)
+
+    def catalog(self, max_age=None):
+        """返回当前索引，超过 max_age（默认 ttl）秒时重新遍历"""
+        max_age = self.ttl if max_age is None else max_age
+        with self._lock:
+            catalog = self._catalog
+            if catalog is None or time.time() - catalog.built_at > max_age:
+                catalog = self._build()
+                self._catalog = catalog
+                self.rebuilds += 1
+            return catalog
+
+    def find(self, filename):
+        """按文件名查找文件，索引中没有时重新遍历一次，返回 CatalogEntry 或 None"""
+        catalog = self.catalog()
+        entry = catalog.find(filename)
+        if entry is None:
+            entry = self.catalog(max_age=0).find(filename)
+        return entry
+
+    def resolve(self, names):
+        """一次查找多个文件名或通配符，返回 (匹配的 CatalogEntry 列表, 未找到的名称列表)
+
+        包含通配符字符的名称先按文件名精确查找，找不到时才按通配符匹配。
+        同一个文件被多个名称匹配时只返回一次；有名称未找到时重新遍历一次再查找。
+        """
+        catalog = self.catalog()
+        matched, missing = self._resolve(catalog, names)
+        if missing:
+            matched, missing = self._resolve(self.catalog(max_age=0), names)
+        return matched, missing
+
+    @staticmethod
+    def _resolve(catalog, names):
+        matched = {}
+        missing = []
+        for name in names:
+            # 先按文件名精确查找：文件名中常有方括号（如 "[SubsPlease] Show - 01.mkv"），不能直接当作通配符
+            entry = catalog.find(name)
+            found = [entry] if entry else (catalog.match(name) if is_glob(name) else [])
+            if not found:
+                missing.append(name)
+            for entry in found:
+                matched.setdefault(entry.full_path, entry)
+        return list(matched.values()), missing
+
+    def stats(self):
+        catalog = self._catalog
+        return {
+            'root': self.root,
+            'files': len(catalog.entries) if catalog else None,
+            'age_seconds': round(time.time() - catalog.built_at, 1) if catalog else None,
+            'ttl': self.ttl,
+            'rebuilds': self.rebuilds,
+        }
+
+
+class ConversionStateIndex:
+    """按相对路径记录每个文件最近一次的处理结果，文件大小和修改时间不变时可以直接沿用
+
+    Args:
+        path: 保存记录的 JSON 文件路径，为 None 时只保存在内存中
+        save_interval: 写盘的最小间隔（秒），进程退出时也会保存
+    """
+
+    def __init__(self, path='data/conversion_state.json', save_interval=SAVE_INTERVAL):
+        self.path = path
+        self.save_interval = save_interval
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._dirty = False
+        self._last_save = 0
+        self.hits = 0
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self._entries = json.load(f)
+            except Exception as e:
+                print(f"读取转换状态索引失败: {str(e)}")
+        if path:
+            atexit.register(self.flush)
+
+    def _save_locked(self, force=False):
+        if not self.path or not self._dirty or (not force and time.time() - self._last_save < self.save_interval):
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f, ensure_ascii=False)
+            os.replace(temp_path, self.path)
+            self._dirty = False
+            self._last_save = time.time()
+        except Exception as e:
+            print(f"保存转换状态索引失败: {str(e)}")
+
+    def record(self, relative_path, full_path, outcome, signature=None):
+        """记录文件的处理结果（按处理后的文件大小和修改时间），signature 为 None 时不随设置变化"""
+        try:
+            stat = os.stat(full_path)
+        except OSError:
+            return
+        with self._lock:
+            self._entries[relative_path] = {
+                'size': stat.st_size,
+                'mtime': stat.st_mtime,
+                'outcome': outcome,
+                'signature': signature,
+                'recorded_at': time.time(),
+            }
+            self._dirty = True
+            self._save_locked()
+
+    def forget(self, relative_path):
+        with self._lock:
+            if self._entries.pop(relative_path, None) is not None:
+                self._dirty = True
+                self._save_locked()
+
+    def settled(self, entry, signature=None):
+        """文件未变化且记录的设置与 signature 相同时返回记录的处理结果，否则返回 None"""
+        with self._lock:
+            record = self._entries.get(entry.relative_path)
+            if (record is None or record['size'] != entry.size or record['mtime'] != entry.mtime or
+                    record['signature'] not in (None, signature)):
+                return None
+            self.hits += 1
+            return record['outcome']
+
+    def flush(self):
+        with self._lock:
+            self._save_locked(force=True)
+
+    def stats(self):
+        with self._lock:
+            outcomes = {}
+            for record in self._entries.values():
+                outcomes[record['outcome']] = outcomes.get(record['outcome'], 0) + 1
+            return {
+                'entries': len(self._entries),
+                'outcomes': outcomes,
+                'hits': self.hits,
+                'path': self.path,
+            }
@@ -0,0 +1,260 @@
+"""内存预算：限制同时处理的字幕数据量、ffmpeg 子进程的地址空间和处理状态记录数
+
+docker-compose.yml 把服务限制在 2GB 内存，超出时整个容器被 OOM 杀掉。内存主要用在：
+- 字幕内容：转换字幕文件时按 CONVERT_CHUNK_CHARS 分块读写；原地转换的扫描结果包含整条字幕轨的数据。
+  每块/每个扫描结果在处理前向 MemoryBudget 预留字节数，所有工作线程合计超过预算时等待其他任务释放
+- ffmpeg/ffprobe 子进程：设置了 ffmpeg_memory_limit_mb 时，启动后用 prlimit 设置 RLIMIT_AS（地址空间上限），
+  异常文件导致 ffmpeg 占用大量内存时只有这个 ffmpeg 分配失败退出，不影响其他任务。地址空间包括每个线程的栈和
+  内存映射，远大于实际使用的内存，多线程解码时 1GB 左右的上限就可能让正常的 ffmpeg 启动失败，所以默认不限制，
+  只按 RSS（admission_rss_mb）控制开始新任务
+- 处理状态：BoundedStatus 只保留最近 max_entries 个已结束文件的状态，排队和处理中的状态不会被删除
+
+MemoryBudget 同时作为 JobScheduler 的 memory_gate：字幕预留已满，或本进程与 ffmpeg 子进程的
+RSS 合计超过 admission_rss_mb 时不开始新任务（已有任务执行时），直到内存回落。
+"""
+import collections
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+MB = 1024 * 1024
+# 处理状态中已结束的状态，超过上限时按时间顺序删除
+FINISHED_STATUSES = ('completed', 'skipped', 'error', 'cancelled')
+DEFAULT_SETTINGS = {
+    'subtitle_budget_mb': 256,
+    'admission_rss_mb': 1536,
+    'ffmpeg_memory_limit_mb': 0,
+    'status_max_entries': 2000,
+}
+
+
+def _status_rss(pid='self'):
+    """/proc/<pid>/status 中的 VmRSS（字节），无法读取时返回 None"""
+    try:
+        with open(f'/proc/{pid}/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def rss_bytes():
+    """本进程当前的 RSS（字节），不支持时返回 None"""
+    return _status_rss()
+
+
+def peak_rss_bytes(children=False):
+    """本进程（children 为 True 时为已结束子进程中最大的一个）的 RSS 峰值（字节），不支持时返回 None"""
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # macOS 的 ru_maxrss 单位是字节，Linux 是 KB
+    return usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
+
+
+class ChildMemoryLimit:
+    """ffmpeg/ffprobe 子进程的地址空间上限，并记录正在运行的子进程用于统计 RSS
+
+    Args:
+        limit_bytes: RLIMIT_AS 上限，0 表示不限制（仍然记录子进程）
+    """
+
+    def __init__(self, limit_bytes=0):
+        self.limit_bytes = max(0, int(limit_bytes))
+        self._lock = threading.Lock()
+        self._pids = set()
+        self.failures = 0
+
+    def attach(self, process):
+        """子进程启动后调用：设置地址空间上限并开始记录"""
+        if self.limit_bytes and resource is not None and hasattr(resource, 'prlimit'):
+            try:
+                resource.prlimit(process.pid, resource.RLIMIT_AS, (self.limit_bytes, self.limit_bytes))
+            except (OSError, ValueError):
+                # 进程已退出，或容器不允许修改其他进程的资源限制
+                self.failures += 1
+        with self._lock:
+            self._pids.add(process.pid)
+
+    def rss_bytes(self):
+        """正在运行的子进程的 RSS 合计（字节），已退出的子进程不再记录"""
+        with self._lock:
+            pids = list(self._pids)
+        total = 0
+        for pid in pids:
+            rss = _status_rss(pid)
+            if rss is None:
+                # 已退出（或已成为僵尸进程，没有 VmRSS）
+                with self._lock:
+                    self._pids.discard(pid)
+            else:
+                total += rss
+        return total
+
+    def stats(self):
+        rss = self.rss_bytes()
+        with self._lock:
+            running = len(self._pids)
+        return {
+            'limit_bytes': self.limit_bytes or None,
+            'running': running,
+            'rss_bytes': rss,
+            'limit_failures': self.failures,
+        }
+
+
+class MemoryBudget:
+    """所有工作线程合计同时处理的字幕字节数上限
+
+    单次预留超过整个预算时，等其他预留全部释放后单独执行（不会永远等待）。
+
+    Args:
+        limit_bytes: 字幕数据预算，0 表示不限制
+        admission_rss_bytes: 本进程与子进程 RSS 合计达到该值时不开始新任务，0 表示不检查
+        children: ChildMemoryLimit，用于统计子进程 RSS
+    """
+
+    def __init__(self, limit_bytes=0, admission_rss_bytes=0, children=None):
+        self._cond = threading.Condition()
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.children = children
+        self.configure(limit_bytes, admission_rss_bytes)
+
+    @classmethod
+    def from_settings(cls, settings, children=None):
+        settings = dict(DEFAULT_SETTINGS, **(settings or {}))
+        return cls(int(settings['subtitle_budget_mb'] * MB), int(settings['admission_rss_mb'] * MB), children)
+
+    def configure(self, limit_bytes, admission_rss_bytes=0):
+        """修改预算（配置热加载时调用），等待中的预留按新的预算重新检查"""
+        with self._cond:
+            self.limit_bytes = max(0, int(limit_bytes))
+            self.admission_rss_bytes = max(0, int(admission_rss_bytes))
+            self._cond.notify_all()
+
+    @contextmanager
+    def reserve(self, nbytes):
+        """预留 nbytes 字节，预算不够时等待其他线程释放"""
+        nbytes = max(0, int(nbytes))
+        if not nbytes or not self.limit_bytes:
+            yield
+            return
+        with self._cond:
+            started = None
+            while self.in_use and self.in_use + nbytes > self.limit_bytes:
+                if started is None:
+                    started = time.monotonic()
+                    self.waits += 1
+                self._cond.wait()
+            if started is not None:
+                self.wait_seconds += time.monotonic() - started
+            self.in_use += nbytes
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.in_use -= nbytes
+                self._cond.notify_all()
+
+    def rss_bytes(self):
+        """本进程与正在运行的 ffmpeg 子进程的 RSS 合计（字节），不支持时返回 None"""
+        own = rss_bytes()
+        if own is None:
+            return None
+        return own + (self.children.rss_bytes() if self.children is not None else 0)
+
+    def __call__(self):
+        """作为 JobScheduler 的 memory_gate：返回 None 表示可以开始新任务，否则返回等待原因"""
+        if self.limit_bytes and self.in_use >= self.limit_bytes:
+            return f"字幕内存预算已用完（{self.in_use // MB}MB）"
+        if self.admission_rss_bytes:
+            rss = self.rss_bytes()
+            if rss is not None and rss >= self.admission_rss_bytes:
+                return f"内存占用 {rss // MB}MB 超过 {self.admission_rss_bytes // MB}MB"
+        return None
+
+    def stats(self):
+        with self._cond:
+            info = {
+                'subtitle_budget_bytes': self.limit_bytes or None,
+                'subtitle_in_use_bytes': self.in_use,
+                'subtitle_peak_bytes': self.peak_in_use,
+                'waits': self.waits,
+                'wait_seconds': round(self.wait_seconds, 3),
+                'admission_rss_bytes': self.admission_rss_bytes or None,
+            }
+        info['rss_bytes'] = self.rss_bytes()
+        info['peak_rss_bytes'] = peak_rss_bytes()
+        if self.children is not None:
+            info['ffmpeg'] = self.children.stats()
+        return info
+
+
+class BoundedStatus(collections.OrderedDict):
+    """处理状态字典：记录数超过 max_entries 时删除最早的已结束状态
+
+    排队中和处理中的状态、以及 keep 中的键（如 batch_convert）不会被删除。
+    多个工作线程同时写入，写入、删除和 snapshot() 在同一个锁内进行；遍历全部状态（如 /status）
+    必须使用 snapshot()，直接遍历时其他线程的写入会改变顺序，抛出 RuntimeError。
+    """
+
+    def __init__(self, max_entries=DEFAULT_SETTINGS['status_max_entries'], keep=('batch_convert',)):
+        super().__init__()
+        self.max_entries = max_entries
+        self.keep = frozenset(keep)
+        self.evicted = 0
+        self._writes = 0
+        self._lock = threading.RLock()
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            is_new = key not in self
+            super().__setitem__(key, value)
+            if not is_new:
+                # 重新提交的文件移到末尾，按最近一次提交的时间排序
+                self.move_to_end(key)
+            # 排队中的文件不能删除，每写入 max_entries/10 次才检查一次，避免大批量处理时每次写入都遍历全部状态
+            self._writes += 1
+            if self.max_entries and len(self) > self.max_entries and self._writes >= max(1, self.max_entries // 10):
+                self.prune()
+
+    def __delitem__(self, key):
+        with self._lock:
+            super().__delitem__(key)
+
+    def pop(self, key, *default):
+        with self._lock:
+            return super().pop(key, *default)
+
+    def snapshot(self):
+        """所有状态的副本（每个状态字典也复制一份），用于遍历和序列化"""
+        with self._lock:
+            return {key: dict(info) if isinstance(info, dict) else info for key, info in self.items()}
+
+    def prune(self):
+        """删除最早的已结束状态，直到记录数不超过 max_entries"""
+        with self._lock:
+            excess = len(self) - self.max_entries
+            if excess > 0 and self.max_entries:
+                stale = []
+                for key, info in self.items():
+                    if key not in self.keep and isinstance(info, dict) and info.get('status') in FINISHED_STATUSES:
+                        stale.append(key)
+                        if len(stale) >= excess:
+                            break
+                for key in stale:
+                    del self[key]
+                self.evicted += len(stale)
+            self._writes = 0
@@ -0,0 +1,231 @@
+"""Prometheus 指标：计数器、仪表和直方图，以文本格式通过 /metrics 导出
+
+不依赖 prometheus_client，只实现本服务用到的部分。
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+# 阶段耗时直方图的默认分桶（秒），覆盖 ffprobe 启动到大文件重新封装
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _format_labels(labelnames, labelvalues, extra=None):
+    pairs = list(zip(labelnames, labelvalues))
+    if extra:
+        pairs.extend(extra)
+    if not pairs:
+        return ''
+    escaped = []
+    for name, value in pairs:
+        value = str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+        escaped.append(f'{name}="{value}"')
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    metric_type = ''
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"指标 {self.name} 需要标签 {self.labelnames}，实际为 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self):
+        with self._lock:
+            return [(self.name, key, None, value) for key, value in sorted(self._values.items())]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        for sample_name, key, extra, value in self._samples():
+            lines.append(f"{sample_name}{_format_labels(self.labelnames, key, extra)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    """只增不减的计数器"""
+    metric_type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    """可增可减的仪表"""
+    metric_type = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Histogram(_Metric):
+    """分桶直方图"""
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+                self._values[key] = state
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state['counts'][i] += 1
+                    break
+            state['sum'] += value
+            state['count'] += 1
+
+    def _samples(self):
+        samples = []
+        with self._lock:
+            for key, state in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, state['counts']):
+                    cumulative += count
+                    samples.append((f"{self.name}_bucket", key, [('le', _format_value(float(bound)))], cumulative))
+                samples.append((f"{self.name}_sum", key, None, state['sum']))
+                samples.append((f"{self.name}_count", key, None, state['count']))
+        return samples
+
+
+class Registry:
+    """指标注册表"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """生成 Prometheus 文本格式"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+# 处理流水线各阶段的指标
+STAGE_SECONDS = REGISTRY.histogram(
+    'video_converter_stage_seconds',
+    '处理阶段耗时（秒）：ffprobe/classification/extraction/conversion/remux/backup',
+    ['stage'])
+BYTES_READ = REGISTRY.counter(
+    'video_converter_bytes_read_total', '各阶段读取的字节数', ['stage'])
+BYTES_WRITTEN = REGISTRY.counter(
+    'video_converter_bytes_written_total', '各阶段写入的字节数', ['stage'])
+SUBTITLE_CACHE_LOOKUPS = REGISTRY.counter(
+    'video_converter_subtitle_cache_lookups_total',
+    '字幕内容缓存查询次数（kind: classification/converted，result: hit/miss）', ['kind', 'result'])
+LINE_CACHE_LOOKUPS = REGISTRY.counter(
+    'video_converter_line_cache_lookups_total', '逐行转换缓存查询次数（result: hit/miss）', ['result'])
+LINE_CACHE_HIT_RATIO = REGISTRY.gauge(
+    'video_converter_line_cache_hit_ratio', '逐行转换缓存累计命中率（0-1）')
+LINE_CACHE_ENTRIES = REGISTRY.gauge(
+    'video_converter_line_cache_entries', '逐行转换缓存中的行数')
+CLASSIFICATION_DECISIONS = REGISTRY.counter(
+    'video_converter_classification_total',
+    '字幕流分类方式（path: metadata 直接采用标签/verified 标签经内容抽查/content 按内容判断）', ['path'])
+METADATA_OVERRULED = REGISTRY.counter(
+    'video_converter_metadata_overruled_total', '内容抽查结果与标签判断不一致、改用内容判断的次数')
+
+# 任务和调度器的指标
+JOBS_TOTAL = REGISTRY.counter(
+    'video_converter_jobs_total', '按处理结果统计的任务数', ['outcome', 'lane'])
+QUEUE_WAIT_SECONDS = REGISTRY.histogram(
+    'video_converter_queue_wait_seconds', '任务从提交到开始执行的等待时间（秒）', ['lane'])
+QUEUE_DEPTH = REGISTRY.gauge(
+    'video_converter_queue_depth', '排队中的任务数', ['lane'])
+WORKERS_TOTAL = REGISTRY.gauge(
+    'video_converter_workers', '工作线程总数')
+WORKERS_BUSY = REGISTRY.gauge(
+    'video_converter_workers_busy', '正在执行任务的工作线程数')
+WORKER_UTILIZATION = REGISTRY.gauge(
+    'video_converter_worker_utilization', '忙碌工作线程占比（0-1）')
+WORKER_BUSY_SECONDS = REGISTRY.counter(
+    'video_converter_worker_busy_seconds_total', '工作线程累计忙碌时间（秒），除以线程数和时长即为平均利用率')
+JOBS_WAITING_FOR_DISK = REGISTRY.gauge(
+    'video_converter_jobs_waiting_for_disk', '因磁盘空间不足而延后执行的任务数')
+DISK_HEADROOM_BYTES = REGISTRY.gauge(
+    'video_converter_disk_headroom_bytes', '剩余空间减去正在执行的任务预留空间和保留空间后的余量（字节）', ['path'])
+MEMORY_RSS_BYTES = REGISTRY.gauge(
+    'video_converter_memory_rss_bytes', '本进程与正在运行的 ffmpeg 子进程的 RSS 合计（字节）')
+SUBTITLE_MEMORY_BYTES = REGISTRY.gauge(
+    'video_converter_subtitle_memory_bytes', '正在处理的字幕数据在内存预算中预留的字节数')
+
+
+@contextmanager
+def stage_timer(stage):
+    """记录一个处理阶段的耗时"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+
+def record_io(stage, bytes_read=0, bytes_written=0):
+    """记录一个处理阶段的读写字节数"""
+    if bytes_read:
+        BYTES_READ.inc(bytes_read, stage=stage)
+    if bytes_written:
+        BYTES_WRITTEN.inc(bytes_written, stage=stage)
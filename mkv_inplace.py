@@ -0,0 +1,445 @@
+"""MKV 字幕原地转换：只改写字幕块，不重新封装整个视频
+
+即使使用 -c copy，ffmpeg 重新封装也要把整个视频读一遍、写一遍（替换原文件时还要复制一份备份），
+写入量与视频大小成正比。MKV 的文本字幕（S_TEXT/UTF8、S_TEXT/ASS）以 UTF-8 明文存放在各个
+Block 中，繁体转简体后字节数通常不变或变少，可以直接在原位置覆盖：
+
+- 只读取 EBML 元素头，跳过视频、音频数据，收集目标字幕轨的 Block
+- 转换后的 Block 写回原位置，变短时在后面用 EBML Void 元素填满（只差 1 字节时加长 Block 的
+  长度字段），所有元素的位置都不变，SeekHead 和 Cues 仍然有效
+- 修改过的 Cluster、Tracks 中的 CRC-32 元素改为同样长度的 Void（CRC-32 是可选元素）
+- 字幕轨标题中的“繁體”等标记和 zh-TW 等语言标签改为简体，同样不能变长
+
+写入量只与字幕数据量有关。转换后变长、使用了 lacing 或压缩（ContentEncoding）、元素长度未知等
+无法原地修改的情况抛出 InPlaceError，此时文件没有被修改，由调用方改用 ffmpeg 重新封装。
+"""
+import os
+import shutil
+
+# EBML/Matroska 元素 ID
+EBML_HEADER = 0x1A45DFA3
+SEGMENT = 0x18538067
+TRACKS = 0x1654AE6B
+TRACK_ENTRY = 0xAE
+TRACK_NUMBER = 0xD7
+TRACK_TYPE = 0x83
+CODEC_ID = 0x86
+TRACK_NAME = 0x536E
+LANGUAGE = 0x22B59C
+LANGUAGE_IETF = 0x22B59D
+CONTENT_ENCODINGS = 0x6D80
+CLUSTER = 0x1F43B675
+BLOCK_GROUP = 0xA0
+BLOCK = 0xA1
+SIMPLE_BLOCK = 0xA3
+VOID = 0xEC
+CRC32 = 0xBF
+
+TRACK_TYPE_SUBTITLE = 0x11
+# 可以原地转换的文本字幕编码 → (ffprobe 报告的 codec_name, 块内容格式)
+TEXT_CODECS = {
+    'S_TEXT/UTF8': (('subrip', 'srt'), 'srt'),
+    'S_TEXT/ASS': (('ass', 'ssa'), 'ass'),
+    'S_TEXT/SSA': (('ass', 'ssa'), 'ass'),
+}
+# 读取元素头时一次读取的字节数（ID 最多 4 字节 + 长度最多 8 字节 + Block 的轨道号）
+HEADER_READ_SIZE = 16
+# Linux 的 FICLONE ioctl（btrfs、XFS 等写时复制文件系统上共享数据块，不复制数据）
+FICLONE = 0x40049409
+
+
+class InPlaceError(Exception):
+    """无法原地转换（文件未被修改），需要完整重新封装"""
+
+
+def _parse_vint(data, pos, keep_marker):
+    """解析 EBML 变长整数，返回 (值, 字节数)；keep_marker 为 True 时保留长度标记位（元素 ID）"""
+    if pos >= len(data):
+        raise InPlaceError("文件不完整")
+    first = data[pos]
+    length = 1
+    mask = 0x80
+    while not first & mask:
+        mask >>= 1
+        length += 1
+        if length > 8:
+            raise InPlaceError("无效的 EBML 变长整数")
+    if pos + length > len(data):
+        raise InPlaceError("文件不完整")
+    value = first if keep_marker else first & (mask - 1)
+    for byte in data[pos + 1:pos + length]:
+        value = (value << 8) | byte
+    return value, length
+
+
+def _encode_size(value, length):
+    return ((1 << (7 * length)) | value).to_bytes(length, 'big')
+
+
+def _size_length(value):
+    """编码 value 至少需要的长度字段字节数（全 1 表示长度未知，不能使用）"""
+    length = 1
+    while value >= (1 << (7 * length)) - 1:
+        length += 1
+    return length
+
+
+def void_element(total):
+    """正好 total 字节（至少 2 字节）的 Void 元素"""
+    for size_length in range(1, 9):
+        data_length = total - 1 - size_length
+        if 0 <= data_length < (1 << (7 * size_length)) - 1:
+            return bytes([VOID]) + _encode_size(data_length, size_length) + bytes(data_length)
+    raise ValueError(f"无法生成 {total} 字节的 Void 元素")
+
+
+def fit_element(element_id, content, total):
+    """把元素编码为正好 total 字节，内容变短时用 Void 填充，放不下时返回 None"""
+    id_bytes = element_id.to_bytes((element_id.bit_length() + 7) // 8, 'big')
+    for size_length in range(_size_length(len(content)), 9):
+        rest = total - len(id_bytes) - size_length - len(content)
+        if rest < 0:
+            return None
+        if rest == 1:
+            # Void 至少 2 字节，改为加长长度字段
+            continue
+        element = id_bytes + _encode_size(len(content), size_length) + content
+        return element + void_element(rest) if rest else element
+    return None
+
+
+class _Reader:
+    """按位置读取元素头和元素内容，统计读取的字节数"""
+
+    def __init__(self, f, file_size):
+        self.f = f
+        self.file_size = file_size
+        self.bytes_read = 0
+
+    def read_at(self, position, length):
+        self.f.seek(position)
+        data = self.f.read(length)
+        self.bytes_read += len(data)
+        if len(data) < length:
+            raise InPlaceError("文件不完整")
+        return data
+
+    def header(self, position):
+        """读取元素头，返回 (ID, 元素头字节数, 内容字节数或 None（长度未知）, 读到的原始字节)"""
+        data = self.read_at(position, min(HEADER_READ_SIZE, self.file_size - position))
+        element_id, id_length = _parse_vint(data, 0, True)
+        if id_length > 4:
+            raise InPlaceError("无效的 EBML 元素 ID")
+        size, size_length = _parse_vint(data, id_length, False)
+        if size == (1 << (7 * size_length)) - 1:
+            size = None
+        return element_id, id_length + size_length, size, data
+
+    def children(self, start, end):
+        """依次返回 [start, end) 中的子元素 (ID, 位置, 元素头字节数, 内容字节数, 原始字节)"""
+        position = start
+        while position < end:
+            element_id, header_length, size, data = self.header(position)
+            if size is None:
+                raise InPlaceError(f"不支持长度未知的元素 0x{element_id:X}")
+            if position + header_length + size > end:
+                raise InPlaceError("元素超出父元素范围，文件可能不完整")
+            yield element_id, position, header_length, size, data
+            position += header_length + size
+
+
+class TrackInfo:
+    """Tracks 中的一条字幕轨"""
+
+    __slots__ = ('number', 'codec_id', 'encoded', 'name', 'languages')
+
+    def __init__(self):
+        self.number = None
+        self.codec_id = ''
+        self.encoded = False
+        # (位置, 元素总字节数, 文本)
+        self.name = None
+        # [(元素 ID, 位置, 元素总字节数, 文本)]
+        self.languages = []
+
+    @property
+    def codec_names(self):
+        return TEXT_CODECS.get(self.codec_id, ((), None))[0]
+
+    @property
+    def kind(self):
+        return TEXT_CODECS.get(self.codec_id, ((), None))[1]
+
+
+class BlockRef:
+    """目标字幕轨的一个 Block/SimpleBlock"""
+
+    __slots__ = ('element_id', 'track', 'position', 'total', 'header', 'payload', 'cluster')
+
+    def __init__(self, element_id, track, position, total, header, payload, cluster):
+        self.element_id = element_id
+        self.track = track
+        self.position = position
+        self.total = total
+        self.header = header
+        self.payload = payload
+        self.cluster = cluster
+
+
+class InPlacePlan:
+    """原地转换的计划：要写入的 (位置, 数据) 列表
+
+    计划按原文件生成，应用到原文件或它的完整副本上都可以（元素位置相同）。
+    """
+
+    def __init__(self):
+        self.patches = []
+        self.tracks = []
+        self.blocks = 0
+        self.subtitle_bytes = 0
+        self.bytes_scanned = 0
+
+    @property
+    def bytes_written(self):
+        return sum(len(data) for _, data in self.patches)
+
+
+def _read_string(reader, position, size):
+    return reader.read_at(position, size).rstrip(b'\0').decode('utf-8', errors='replace')
+
+
+def _read_tracks(reader, start, end):
+    """读取 Tracks 中的所有字幕轨，返回 (TrackInfo 列表, CRC-32 元素 (位置, 字节数) 或 None)"""
+    tracks = []
+    crc = None
+    for element_id, position, header_length, size, _ in reader.children(start, end):
+        if element_id == CRC32:
+            crc = (position, header_length + size)
+            continue
+        if element_id != TRACK_ENTRY:
+            continue
+        track = TrackInfo()
+        track_type = None
+        data_start = position + header_length
+        for child_id, child_position, child_header, child_size, _ in reader.children(data_start, data_start + size):
+            data_position = child_position + child_header
+            child_total = child_header + child_size
+            if child_id == TRACK_NUMBER:
+                track.number = int.from_bytes(reader.read_at(data_position, child_size), 'big')
+            elif child_id == TRACK_TYPE:
+                track_type = int.from_bytes(reader.read_at(data_position, child_size), 'big')
+            elif child_id == CODEC_ID:
+                track.codec_id = _read_string(reader, data_position, child_size)
+            elif child_id == TRACK_NAME:
+                track.name = (child_position, child_total, _read_string(reader, data_position, child_size))
+            elif child_id in (LANGUAGE, LANGUAGE_IETF):
+                track.languages.append((child_id, child_position, child_total,
+                                        _read_string(reader, data_position, child_size)))
+            elif child_id == CONTENT_ENCODINGS:
+                track.encoded = True
+        if track_type == TRACK_TYPE_SUBTITLE:
+            tracks.append(track)
+    return tracks, crc
+
+
+def _read_block(reader, element_id, position, header_length, size, data, targets, cluster, blocks):
+    """Block/SimpleBlock 属于目标字幕轨时读取内容并加入 blocks"""
+    data_position = position + header_length
+    head = data[header_length:]
+    # 元素头之后读到的字节不够解析轨道号时再读一次
+    if not head or not head[0] or len(head) < 9 - head[0].bit_length():
+        head = reader.read_at(data_position, min(size, 8))
+    track_number, track_length = _parse_vint(head, 0, False)
+    if track_number not in targets:
+        return
+    content = reader.read_at(data_position, size)
+    if len(content) < track_length + 3:
+        raise InPlaceError("无效的字幕块")
+    if content[track_length + 2] & 0x06:
+        raise InPlaceError("字幕块使用了 lacing")
+    blocks.append(BlockRef(element_id, track_number, position, header_length + size, content[:track_length + 3],
+                           content[track_length + 3:], cluster))
+
+
+def _scan(path, subtitle_indices, subtitle_codecs):
+    """扫描文件结构，返回 (目标 TrackInfo 列表, BlockRef 列表, Cluster 位置 → CRC-32 元素, Tracks 的 CRC-32, 读取字节数)"""
+    file_size = os.path.getsize(path)
+    with open(path, 'rb', buffering=0) as f:
+        reader = _Reader(f, file_size)
+        element_id, header_length, size, _ = reader.header(0)
+        if element_id != EBML_HEADER or size is None:
+            raise InPlaceError("不是 Matroska 文件")
+        position = header_length + size
+        element_id, header_length, size, _ = reader.header(position)
+        if element_id != SEGMENT:
+            raise InPlaceError("没有找到 Segment")
+        segment_start = position + header_length
+        segment_end = file_size if size is None else min(file_size, segment_start + size)
+
+        targets = None
+        target_tracks = []
+        tracks_crc = None
+        cluster_crcs = {}
+        blocks = []
+        for element_id, position, header_length, size, _ in reader.children(segment_start, segment_end):
+            data_start = position + header_length
+            if element_id == TRACKS:
+                if targets is not None:
+                    raise InPlaceError("文件中有多个 Tracks")
+                all_tracks, tracks_crc = _read_tracks(reader, data_start, data_start + size)
+                if len(all_tracks) != len(subtitle_codecs):
+                    raise InPlaceError("字幕轨数量与 ffprobe 结果不一致")
+                for index in subtitle_indices:
+                    track = all_tracks[index]
+                    if track.kind is None or subtitle_codecs[index] not in track.codec_names:
+                        raise InPlaceError(f"字幕轨 {index} 的编码 {track.codec_id} 不支持原地转换")
+                    if track.encoded:
+                        raise InPlaceError(f"字幕轨 {index} 使用了压缩（ContentEncoding）")
+                    target_tracks.append(track)
+                targets = {track.number for track in target_tracks}
+            elif element_id == CLUSTER:
+                if targets is None:
+                    raise InPlaceError("Cluster 出现在 Tracks 之前")
+                for child_id, child_position, child_header, child_size, data in reader.children(data_start,
+                                                                                               data_start + size):
+                    if child_id == CRC32:
+                        cluster_crcs[position] = (child_position, child_header + child_size)
+                    elif child_id == SIMPLE_BLOCK:
+                        _read_block(reader, child_id, child_position, child_header, child_size, data, targets,
+                                    position, blocks)
+                    elif child_id == BLOCK_GROUP:
+                        group_start = child_position + child_header
+                        for inner_id, inner_position, inner_header, inner_size, inner_data in reader.children(
+                                group_start, group_start + child_size):
+                            if inner_id == BLOCK:
+                                _read_block(reader, inner_id, inner_position, inner_header, inner_size, inner_data,
+                                            targets, position, blocks)
+        if targets is None:
+            raise InPlaceError("没有找到 Tracks")
+        return target_tracks, blocks, cluster_crcs, tracks_crc, reader.bytes_read
+
+
+def _metadata_patches(track, retitle, relabel):
+    """字幕轨标题和语言标签的修改，放不下时抛出 InPlaceError"""
+    patches = []
+    if retitle is not None and track.name is not None:
+        position, total, title = track.name
+        new_title = retitle(title)
+        if new_title is not None and new_title != title:
+            element = fit_element(TRACK_NAME, new_title.encode('utf-8'), total)
+            if element is None:
+                raise InPlaceError(f"新标题“{new_title}”比原标题长")
+            patches.append((position, element))
+    for element_id, position, total, language in track.languages:
+        new_language = (relabel or {}).get(language.lower())
+        if new_language is None:
+            continue
+        element = fit_element(element_id, new_language.encode('utf-8'), total)
+        if element is None:
+            raise InPlaceError(f"语言标签 {new_language} 比原标签长")
+        patches.append((position, element))
+    return patches
+
+
+def plan_conversion(path, subtitle_indices, subtitle_codecs, convert_texts, retitle=None, relabel=None):
+    """扫描 MKV 文件，生成原地转换指定字幕轨的计划（不修改文件）
+
+    Args:
+        path: MKV 文件路径
+        subtitle_indices: 要转换的字幕轨序号（在所有字幕轨中的序号，与 ffprobe 的字幕流顺序相同）
+        subtitle_codecs: ffprobe 返回的所有字幕流的 codec_name，用于确认轨道对应关系
+        convert_texts: 转换函数 (文本列表, 'srt' 或 'ass') → 转换后的文本列表
+        retitle: 旧标题 → 新标题的函数，返回 None 表示不修改
+        relabel: 小写语言标签 → 新标签的字典
+
+    Returns:
+        InPlacePlan
+
+    Raises:
+        InPlaceError: 无法原地转换
+    """
+    tracks, blocks, cluster_crcs, tracks_crc, bytes_scanned = _scan(path, subtitle_indices, subtitle_codecs)
+    plan = InPlacePlan()
+    plan.tracks = tracks
+    plan.bytes_scanned = bytes_scanned
+
+    metadata_patches = []
+    for track in tracks:
+        metadata_patches.extend(_metadata_patches(track, retitle, relabel))
+    if metadata_patches and tracks_crc is not None:
+        metadata_patches.append((tracks_crc[0], void_element(tracks_crc[1])))
+
+    patched_clusters = set()
+    for track in tracks:
+        track_blocks = [block for block in blocks if block.track == track.number]
+        try:
+            texts = [block.payload.decode('utf-8') for block in track_blocks]
+        except UnicodeDecodeError:
+            raise InPlaceError(f"字幕轨 {track.number} 不是 UTF-8 文本")
+        converted = convert_texts(texts, track.kind)
+        for block, text, new_text in zip(track_blocks, texts, converted):
+            plan.blocks += 1
+            plan.subtitle_bytes += len(block.payload)
+            if new_text == text:
+                continue
+            element = fit_element(block.element_id, block.header + new_text.encode('utf-8'), block.total)
+            if element is None:
+                raise InPlaceError(f"转换后的字幕块比原来长: {new_text[:20]}")
+            plan.patches.append((block.position, element))
+            patched_clusters.add(block.cluster)
+
+    for cluster in sorted(patched_clusters):
+        if cluster in cluster_crcs:
+            position, total = cluster_crcs[cluster]
+            plan.patches.append((position, void_element(total)))
+    plan.patches.extend(metadata_patches)
+    plan.patches.sort()
+    return plan
+
+
+def apply_plan(path, plan):
+    """把计划写入文件（原文件或复制出的副本）"""
+    with open(path, 'r+b') as f:
+        for position, data in plan.patches:
+            f.seek(position)
+            f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def clone_file(src, dst, copy=shutil.copy2, kernel_copy=True):
+    """复制文件，尽量不经过本进程读写数据
+
+    依次尝试 reflink（FICLONE，写时复制文件系统上不复制数据）、copy_file_range（在内核中复制，
+    NFS 4.2/SMB 上由服务端复制），都不支持时调用 copy(src, dst)。kernel_copy 为 False 时
+    （需要按令牌桶限速）不使用 copy_file_range。
+
+    Returns:
+        使用的方式：'reflink'、'copy_file_range' 或 'copy'
+    """
+    method = None
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            import fcntl
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            method = 'reflink'
+        except (ImportError, OSError):
+            pass
+        if method is None and kernel_copy and hasattr(os, 'copy_file_range'):
+            size = os.fstat(fsrc.fileno()).st_size
+            offset = 0
+            try:
+                while offset < size:
+                    copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), size - offset, offset, offset)
+                    if copied == 0:
+                        break
+                    offset += copied
+                if offset == size:
+                    method = 'copy_file_range'
+            except OSError:
+                pass
+    if method is None:
+        copy(src, dst)
+        return 'copy'
+    shutil.copystat(src, dst)
+    return method
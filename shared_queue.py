@@ -0,0 +1,497 @@
+"""共享任务队列：多进程/多主机通过共享磁盘上的 SQLite 数据库领取任务
+
+API 节点只负责把任务写入队列并查询状态；工作节点（python api_server.py --worker）
+从队列中领取任务执行。领取任务时会获得一个租约（lease），执行期间工作节点定期发送
+心跳续租；工作节点崩溃或失联后租约过期，任务会被重新放回队列由其他节点领取。
+
+工作节点发送心跳失败（租约已被回收，或超过租约时长没有成功续租）时中止正在执行的任务：
+handler 收到的中止信号被设置，处理在修改原文件前停止，避免与重新领取该任务的节点同时写同一个文件。
+执行前还会在源文件旁边用 O_EXCL 创建锁文件（source_lock），同一文件同时只会被一个节点处理。
+
+工作节点与单机模式使用相同的准入条件：内存紧张时（memory_gate）不领取新任务；领取后按
+disk_reservation 预留磁盘空间，放不下时把任务放回队列，等本节点其他任务完成后再领取。
+
+注意：SQLite 的 WAL 模式不支持网络文件系统，这里保持默认的回滚日志模式，
+并通过 BEGIN IMMEDIATE 保证同一任务只会被一个节点领取，同一文件只会有一个排队或执行中的任务。
+"""
+import json
+import os
+import shutil
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    filename TEXT NOT NULL,
+    relative_path TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    batch_id TEXT,
+    config TEXT,
+    status TEXT NOT NULL DEFAULT 'queued',
+    worker_id TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_expires REAL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    heartbeat_at REAL,
+    finished_at REAL,
+    message TEXT,
+    result TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs (status, priority, created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_filename ON jobs (filename, created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_batch ON jobs (batch_id);
+"""
+
+
+def default_worker_id():
+    """生成工作节点标识：主机名-进程号"""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class SQLiteJobQueue:
+    """基于 SQLite 的共享任务队列
+
+    Args:
+        db_path: 数据库文件路径（放在所有节点都能访问的共享目录上）
+        lease_seconds: 租约时长，超过该时间没有心跳的任务会被重新排队
+        max_attempts: 任务最多被领取的次数，超过后标记为错误
+    """
+
+    def __init__(self, db_path, lease_seconds=120, max_attempts=3):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        db_dir = os.path.dirname(db_path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+        conn = self._connect()
+        conn.executescript(SCHEMA)
+        # 兼容旧版本创建的数据库
+        columns = [row['name'] for row in conn.execute("PRAGMA table_info(jobs)")]
+        if 'result' not in columns:
+            conn.execute("ALTER TABLE jobs ADD COLUMN result TEXT")
+
+    def _connect(self):
+        # 每个线程使用独立连接，sqlite3 连接不能跨线程共享
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def enqueue_many(self, items, config=None, priority=0, batch_id=None):
+        """在一个事务中写入多个任务，已有排队或执行中任务的文件不重复写入
+
+        检查和写入在同一个 BEGIN IMMEDIATE 事务中，多个 API 节点同时提交同一文件时也只会写入一次。
+
+        items: (filename, relative_path) 列表
+        返回 (filename, job_id, 是否重复) 列表，重复时 job_id 是已有任务的ID
+        """
+        config_json = json.dumps(config or {}, ensure_ascii=False)
+        results = []
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            for filename, relative_path in items:
+                row = conn.execute(
+                    "SELECT job_id FROM jobs WHERE filename = ? AND status IN ('queued', 'running') LIMIT 1",
+                    (filename,)
+                ).fetchone()
+                if row is not None:
+                    results.append((filename, row['job_id'], True))
+                    continue
+                job_id = uuid.uuid4().hex
+                conn.execute(
+                    "INSERT INTO jobs (job_id, filename, relative_path, priority, batch_id, config, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (job_id, filename, relative_path, priority, batch_id, config_json, now)
+                )
+                results.append((filename, job_id, False))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return results
+
+    def _requeue_expired_locked(self, conn, now):
+        """把租约过期的任务放回队列（需在事务中调用）"""
+        conn.execute(
+            "UPDATE jobs SET status = 'error', finished_at = ?, message = '工作节点失联，任务多次超时' "
+            "WHERE status = 'running' AND lease_expires < ? AND attempts >= ?",
+            (now, now, self.max_attempts)
+        )
+        cursor = conn.execute(
+            "UPDATE jobs SET status = 'queued', worker_id = NULL, lease_expires = NULL, "
+            "message = '工作节点租约过期，重新排队' "
+            "WHERE status = 'running' AND lease_expires < ?",
+            (now,)
+        )
+        return cursor.rowcount
+
+    def requeue_expired(self):
+        """回收失联工作节点的任务，返回重新排队的任务数"""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            count = self._requeue_expired_locked(conn, time.time())
+            conn.execute("COMMIT")
+            return count
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def claim(self, worker_id, max_priority=None):
+        """领取一个任务并获得租约
+
+        Args:
+            worker_id: 工作节点标识
+            max_priority: 只领取优先级数值不大于该值的任务（用于交互预留线程）
+
+        Returns:
+            任务字典，队列为空时返回 None
+        """
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._requeue_expired_locked(conn, now)
+            query = "SELECT * FROM jobs WHERE status = 'queued'"
+            params = []
+            if max_priority is not None:
+                query += " AND priority <= ?"
+                params.append(max_priority)
+            query += " ORDER BY priority, created_at LIMIT 1"
+            row = conn.execute(query, params).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', worker_id = ?, attempts = attempts + 1, "
+                "lease_expires = ?, started_at = ?, heartbeat_at = ?, message = ? WHERE job_id = ?",
+                (worker_id, now + self.lease_seconds, now, now, f'工作节点 {worker_id} 处理中', row['job_id'])
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return self.get_job(row['job_id'])
+
+    def release(self, job_id, worker_id, message):
+        """把已领取但没有开始执行的任务放回队列（不计入领取次数），返回是否成功"""
+        cursor = self._connect().execute(
+            "UPDATE jobs SET status = 'queued', worker_id = NULL, lease_expires = NULL, started_at = NULL, "
+            "heartbeat_at = NULL, attempts = MAX(attempts - 1, 0), message = ? "
+            "WHERE job_id = ? AND worker_id = ? AND status = 'running'",
+            (message, job_id, worker_id)
+        )
+        return cursor.rowcount == 1
+
+    def heartbeat(self, job_id, worker_id):
+        """续租，返回 False 表示租约已丢失（任务已被回收）"""
+        conn = self._connect()
+        now = time.time()
+        cursor = conn.execute(
+            "UPDATE jobs SET lease_expires = ?, heartbeat_at = ? "
+            "WHERE job_id = ? AND worker_id = ? AND status = 'running'",
+            (now + self.lease_seconds, now, job_id, worker_id)
+        )
+        return cursor.rowcount == 1
+
+    def finish(self, job_id, worker_id, status, message, result=None):
+        """记录任务结果（status: completed/skipped/error，result 为可选的结构化处理结果）"""
+        conn = self._connect()
+        cursor = conn.execute(
+            "UPDATE jobs SET status = ?, message = ?, result = ?, finished_at = ?, lease_expires = NULL "
+            "WHERE job_id = ? AND worker_id = ? AND status = 'running'",
+            (status, message, json.dumps(result, ensure_ascii=False) if result is not None else None,
+             time.time(), job_id, worker_id)
+        )
+        return cursor.rowcount == 1
+
+    def get_job(self, job_id):
+        row = self._connect().execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return self._row_to_dict(row)
+
+    def latest_job_for(self, filename):
+        """返回某个文件最近一次提交的任务"""
+        row = self._connect().execute(
+            "SELECT * FROM jobs WHERE filename = ? ORDER BY created_at DESC LIMIT 1", (filename,)
+        ).fetchone()
+        return self._row_to_dict(row)
+
+    def is_pending(self, filename):
+        """文件是否已有排队或执行中的任务"""
+        row = self._connect().execute(
+            "SELECT 1 FROM jobs WHERE filename = ? AND status IN ('queued', 'running') LIMIT 1", (filename,)
+        ).fetchone()
+        return row is not None
+
+    def batch_counts(self, batch_id):
+        """统计某个批次中各状态的任务数"""
+        rows = self._connect().execute(
+            "SELECT status, COUNT(*) AS n FROM jobs WHERE batch_id = ? GROUP BY status", (batch_id,)
+        ).fetchall()
+        return {row['status']: row['n'] for row in rows}
+
+    def stats(self):
+        """统计队列中各状态、各优先级的任务数以及活跃的工作节点"""
+        conn = self._connect()
+        counts = {}
+        for row in conn.execute(
+                "SELECT status, priority, COUNT(*) AS n FROM jobs "
+                "WHERE status IN ('queued', 'running') GROUP BY status, priority"):
+            counts.setdefault(row['status'], {})[row['priority']] = row['n']
+        workers = [row['worker_id'] for row in conn.execute(
+            "SELECT DISTINCT worker_id FROM jobs WHERE status = 'running' AND lease_expires >= ?",
+            (time.time(),))]
+        return {'counts': counts, 'active_workers': workers}
+
+    @staticmethod
+    def _row_to_dict(row):
+        if row is None:
+            return None
+        job = dict(row)
+        try:
+            job['config'] = json.loads(job.get('config') or '{}')
+        except ValueError:
+            job['config'] = {}
+        try:
+            job['result'] = json.loads(job['result']) if job.get('result') else None
+        except ValueError:
+            job['result'] = None
+        return job
+
+
+class QueueWorker:
+    """工作节点：从共享队列领取任务并执行
+
+    Args:
+        queue: SQLiteJobQueue 实例
+        handler: 处理函数，接收任务字典和中止信号（abort_factory 创建，租约丢失时被 set()），
+            返回 (status, message) 或 (status, message, result)
+        threads: 并行执行的线程数
+        reserved_interactive_threads: 只领取交互任务的线程数
+        interactive_priority: 交互任务的优先级数值
+        heartbeat_interval: 心跳间隔（秒），应明显小于租约时长
+        poll_interval: 队列为空时的轮询间隔（秒）
+        worker_id: 工作节点标识
+        batch_gate: 返回非空的暂停原因时只领取交互任务（如 job_scheduler.BatchSchedule）
+        memory_gate: 返回非空的暂停原因时不领取新任务（本节点没有任务执行时除外，如 memory_budget.MemoryBudget）
+        disk_reservation: 接收任务字典，返回 {'disk_path': ..., 'disk_bytes': ...}，为执行中的任务预留磁盘空间
+        min_free_bytes: 预留后磁盘至少保留的剩余空间
+        abort_factory: 创建中止信号的函数，默认 threading.Event（如 video_processor_v1.AbortSignal 还会结束 ffmpeg）
+        source_lock: 接收任务字典，返回源文件锁文件的路径（None 表示不加锁）
+    """
+
+    def __init__(self, queue, handler, threads=1, reserved_interactive_threads=0, interactive_priority=0,
+                 heartbeat_interval=30, poll_interval=2, worker_id=None, batch_gate=None, memory_gate=None,
+                 disk_reservation=None, min_free_bytes=0, abort_factory=threading.Event, source_lock=None):
+        self.queue = queue
+        self.handler = handler
+        self.threads = max(1, int(threads))
+        self.reserved_interactive_threads = max(0, min(int(reserved_interactive_threads), self.threads - 1))
+        self.interactive_priority = interactive_priority
+        self.heartbeat_interval = heartbeat_interval
+        self.poll_interval = poll_interval
+        self.worker_id = worker_id or default_worker_id()
+        self.batch_gate = batch_gate
+        self.memory_gate = memory_gate
+        self.disk_reservation = disk_reservation
+        self.min_free_bytes = max(0, int(min_free_bytes))
+        self.abort_factory = abort_factory
+        self.source_lock = source_lock
+        self._lock = threading.Lock()
+        self._running = 0
+        self._disk_reserved = {}
+        self._stop = threading.Event()
+
+    def stop(self):
+        self._stop.set()
+
+    def _heartbeat_loop(self, job_id, worker_id, finished, abort, lock_path):
+        last_renewed = time.monotonic()
+        while not finished.wait(self.heartbeat_interval):
+            try:
+                if not self.queue.heartbeat(job_id, worker_id):
+                    print(f"任务 {job_id} 的租约已丢失，可能已被其他节点重新领取，中止处理")
+                    abort.set()
+                    return
+                last_renewed = time.monotonic()
+                if lock_path is not None:
+                    # 锁文件的修改时间随心跳更新，超过租约时长没有更新的锁视为已失效
+                    os.utime(lock_path)
+            except Exception as e:
+                print(f"发送心跳失败 ({job_id}): {str(e)}")
+                if time.monotonic() - last_renewed >= self.queue.lease_seconds:
+                    print(f"任务 {job_id} 超过租约时长没有续租成功，中止处理")
+                    abort.set()
+                    return
+
+    def _acquire_source_lock(self, path, owner):
+        """用 O_EXCL 创建源文件锁，返回是否取得；超过租约时长没有更新的锁（节点已失联）先删除再重试"""
+        for _ in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                try:
+                    age = time.time() - os.stat(path).st_mtime
+                except FileNotFoundError:
+                    continue
+                if age < self.queue.lease_seconds:
+                    return False
+                print(f"删除失效的锁文件: {path}")
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                continue
+            with os.fdopen(fd, 'w') as f:
+                f.write(owner)
+            return True
+        return False
+
+    @staticmethod
+    def _release_source_lock(path, owner):
+        """删除自己持有的锁文件（锁已失效并被其他节点取得时不删除）"""
+        try:
+            with open(path, 'r') as f:
+                if f.read() != owner:
+                    return
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _run_one(self, job, worker_id):
+        """执行一个任务；源文件正被其他节点处理时把任务放回队列并返回 False"""
+        lock_path = self.source_lock(job) if self.source_lock is not None else None
+        owner = f"{worker_id} {job['job_id']}"
+        if lock_path is not None:
+            try:
+                locked = self._acquire_source_lock(lock_path, owner)
+            except OSError as e:
+                print(f"创建锁文件失败，不加锁处理 ({lock_path}): {str(e)}")
+                lock_path = None
+                locked = True
+            if not locked:
+                self.queue.release(job['job_id'], worker_id, '源文件正在被其他节点处理，稍后重试')
+                return False
+        abort = self.abort_factory()
+        finished = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat_loop,
+                                     args=(job['job_id'], worker_id, finished, abort, lock_path), daemon=True)
+        heartbeat.start()
+        result = None
+        try:
+            outcome = self.handler(job, abort)
+            status, message = outcome[0], outcome[1]
+            if len(outcome) > 2:
+                result = outcome[2]
+        except Exception as e:
+            status, message = 'error', f'处理过程中发生错误: {str(e)}'
+        finally:
+            finished.set()
+            heartbeat.join()
+            if lock_path is not None:
+                self._release_source_lock(lock_path, owner)
+        if abort.is_set():
+            status, message = 'error', f'任务租约丢失，已中止处理: {message}'
+        if not self.queue.finish(job['job_id'], worker_id, status, message, result):
+            print(f"任务 {job['job_id']} 结果未写入（租约已被回收）")
+        return True
+
+    def _acquire_slot(self):
+        """开始领取前占用一个执行名额；内存紧张且本节点已有任务在执行时返回 False
+
+        检查和计数在同一个锁内，多个线程不会同时在内存紧张时领取任务。
+        """
+        with self._lock:
+            if self.memory_gate is not None and self._running and self.memory_gate():
+                return False
+            self._running += 1
+            return True
+
+    def _release_slot(self, reservation=(None, 0)):
+        device, disk_bytes = reservation
+        with self._lock:
+            self._running -= 1
+            if device is not None:
+                self._disk_reserved[device] -= disk_bytes
+
+    def _reserve_disk(self, job):
+        """为任务预留磁盘空间，返回 (设备号, 字节数)；放不下（且本节点已有预留）时返回 None"""
+        reservation = self.disk_reservation(job) if self.disk_reservation is not None else {}
+        disk_bytes = reservation.get('disk_bytes', 0)
+        if not disk_bytes or not reservation.get('disk_path'):
+            return (None, 0)
+        try:
+            device = os.stat(reservation['disk_path']).st_dev
+            free = shutil.disk_usage(reservation['disk_path']).free
+        except OSError:
+            return (None, 0)
+        with self._lock:
+            reserved = self._disk_reserved.get(device, 0)
+            # 没有其他预留时总是允许开始，空间确实不够时由处理过程报错
+            if reserved and free - reserved - self.min_free_bytes < disk_bytes:
+                return None
+            self._disk_reserved[device] = reserved + disk_bytes
+        return (device, disk_bytes)
+
+    def _thread_loop(self, max_priority):
+        # 每个线程以独立的 worker_id 持有租约，心跳和结果写入都使用该标识
+        thread_worker_id = f"{self.worker_id}-{threading.current_thread().name}"
+        while not self._stop.is_set():
+            if not self._acquire_slot():
+                self._stop.wait(self.poll_interval)
+                continue
+            claim_priority = max_priority
+            if claim_priority is None and self.batch_gate is not None and self.batch_gate():
+                # 不在批量时段内，只领取交互任务
+                claim_priority = self.interactive_priority
+            try:
+                job = self.queue.claim(thread_worker_id, max_priority=claim_priority)
+            except sqlite3.Error as e:
+                print(f"领取任务失败: {str(e)}")
+                job = None
+            if job is None:
+                self._release_slot()
+                self._stop.wait(self.poll_interval)
+                continue
+            reservation = self._reserve_disk(job)
+            if reservation is None:
+                # 放回队列，其他节点或本节点的任务完成释放空间后再领取
+                self._release_slot()
+                self.queue.release(job['job_id'], thread_worker_id, '磁盘剩余空间不足，等待其他任务完成')
+                self._stop.wait(self.poll_interval)
+                continue
+            try:
+                started = self._run_one(job, thread_worker_id)
+            finally:
+                self._release_slot(reservation)
+            if not started:
+                self._stop.wait(self.poll_interval)
+
+    def run(self):
+        """启动所有线程并阻塞直到 stop() 被调用"""
+        threads = []
+        for i in range(self.threads):
+            max_priority = self.interactive_priority if i < self.reserved_interactive_threads else None
+            thread = threading.Thread(target=self._thread_loop, args=(max_priority,),
+                                      name=f"queue-worker-{i}", daemon=True)
+            thread.start()
+            threads.append(thread)
+        print(f"工作节点 {self.worker_id} 已启动，线程数: {self.threads}，队列: {self.queue.db_path}")
+        try:
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads:
+                    thread.join(timeout=1)
+        except KeyboardInterrupt:
+            print("\n用户中断，工作节点停止领取新任务")
+            self.stop()
@@ -0,0 +1,324 @@
+"""字幕内容缓存：按字幕数据的哈希保存分类结果和转换后的简体字幕
+
+同一个发布常以多种封装出现在媒体库中，不同文件里的字幕流也经常逐字节相同。
+以字幕内容的 SHA-256 为键缓存分类结果和转换后的字幕，相同的字幕在整个媒体库中
+只分类、转换一次。
+
+缓存保存在 data/subtitle_cache/ 下：index.json 记录每个条目，转换后的字幕以
+<哈希>.<扩展名> 保存。总大小超过上限时按最近使用时间淘汰。
+
+LineConversionCache 是逐行的繁简转换缓存：动画字幕中 OP/ED 歌词、固定台词在同一季
+各集中反复出现，相同的行只调用一次 zhconv。
+"""
+import atexit
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+# 每个条目在索引中的估算开销（字节），只有分类结果的条目也计入大小上限
+ENTRY_OVERHEAD = 256
+# 索引写盘的最小间隔（秒），转换结果写入时立即保存
+SAVE_INTERVAL = 5
+
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_text(text):
+    return hash_bytes(text.encode('utf-8'))
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """计算文件内容的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class SubtitleCache:
+    """按内容哈希缓存字幕分类结果和转换输出，大小有上限
+
+    Args:
+        cache_dir: 缓存目录
+        max_bytes: 缓存总大小上限（字节）
+    """
+
+    def __init__(self, cache_dir='data/subtitle_cache', max_bytes=256 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(cache_dir, 'index.json')
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._total_bytes = 0
+        self._dirty = False
+        self._last_save = 0
+        self.hits = {'classification': 0, 'converted': 0}
+        self.misses = {'classification': 0, 'converted': 0}
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load()
+        atexit.register(self.flush)
+
+    def _payload_path(self, digest, ext):
+        return os.path.join(self.cache_dir, f"{digest}.{ext}")
+
+    def _entry_size(self, entry):
+        return ENTRY_OVERHEAD + entry.get('payload_size', 0)
+
+    def _load(self):
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except Exception as e:
+            print(f"读取字幕缓存索引失败，重新建立缓存: {str(e)}")
+            return
+        for digest, entry in entries.items():
+            # 转换结果文件丢失时只保留分类结果
+            if entry.get('payload_ext') and not os.path.exists(self._payload_path(digest, entry['payload_ext'])):
+                entry.pop('payload_ext', None)
+                entry.pop('payload_size', None)
+            self._entries[digest] = entry
+            self._total_bytes += self._entry_size(entry)
+
+    def _save_locked(self, force=False):
+        if not self._dirty or (not force and time.time() - self._last_save < SAVE_INTERVAL):
+            return
+        temp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f)
+            os.replace(temp_path, self.index_path)
+            self._dirty = False
+            self._last_save = time.time()
+        except Exception as e:
+            print(f"保存字幕缓存索引失败: {str(e)}")
+
+    def _touch_locked(self, digest):
+        entry = self._entries.setdefault(digest, {})
+        entry['last_used'] = time.time()
+        self._dirty = True
+        return entry
+
+    def _evict_locked(self):
+        """超过大小上限时淘汰最久未使用的条目"""
+        if self._total_bytes <= self.max_bytes:
+            return
+        for digest, entry in sorted(self._entries.items(), key=lambda item: item[1].get('last_used', 0)):
+            if self._total_bytes <= self.max_bytes:
+                break
+            self._total_bytes -= self._entry_size(entry)
+            del self._entries[digest]
+            if entry.get('payload_ext'):
+                try:
+                    os.remove(self._payload_path(digest, entry['payload_ext']))
+                except OSError:
+                    pass
+
+    def get_classification(self, digest):
+        """返回缓存的分类结果，没有时返回 None"""
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None or 'classification' not in entry:
+                self.misses['classification'] += 1
+                return None
+            self.hits['classification'] += 1
+            self._touch_locked(digest)
+            self._save_locked()
+            return dict(entry['classification'])
+
+    def put_classification(self, digest, classification):
+        with self._lock:
+            is_new = digest not in self._entries
+            entry = self._touch_locked(digest)
+            entry['classification'] = dict(classification)
+            if is_new:
+                self._total_bytes += self._entry_size(entry)
+            self._evict_locked()
+            self._save_locked()
+
+    def fetch_converted(self, digest, output_file):
+        """把缓存的转换结果复制到 output_file，命中时返回 True"""
+        with self._lock:
+            entry = self._entries.get(digest)
+            payload_ext = entry.get('payload_ext') if entry else None
+            if not payload_ext:
+                self.misses['converted'] += 1
+                return False
+            payload_path = self._payload_path(digest, payload_ext)
+            try:
+                shutil.copyfile(payload_path, output_file)
+            except OSError:
+                # 缓存文件被删除，当作未命中
+                self._total_bytes -= entry.pop('payload_size', 0)
+                entry.pop('payload_ext', None)
+                self.misses['converted'] += 1
+                return False
+            self.hits['converted'] += 1
+            self._touch_locked(digest)
+            self._save_locked()
+            return True
+
+    def store_converted(self, digest, converted_file):
+        """保存转换结果（单个字幕超过缓存上限时不保存）"""
+        size = os.path.getsize(converted_file)
+        if size + ENTRY_OVERHEAD > self.max_bytes:
+            return
+        ext = os.path.splitext(converted_file)[1].lstrip('.') or 'srt'
+        with self._lock:
+            is_new = digest not in self._entries
+            entry = self._touch_locked(digest)
+            if not is_new:
+                self._total_bytes -= self._entry_size(entry)
+            # 先写临时文件再改名，避免其他进程读到写了一半的文件
+            payload_path = self._payload_path(digest, ext)
+            temp_path = f"{payload_path}.{os.getpid()}.tmp"
+            try:
+                shutil.copyfile(converted_file, temp_path)
+                os.replace(temp_path, payload_path)
+                entry['payload_ext'] = ext
+                entry['payload_size'] = size
+            except OSError as e:
+                print(f"写入字幕缓存失败: {str(e)}")
+            self._total_bytes += self._entry_size(entry)
+            self._evict_locked()
+            self._save_locked(force=True)
+
+    def flush(self):
+        with self._lock:
+            self._save_locked(force=True)
+
+    def stats(self):
+        with self._lock:
+            lookups = {kind: self.hits[kind] + self.misses[kind] for kind in self.hits}
+            return {
+                'entries': len(self._entries),
+                'converted_entries': sum(1 for entry in self._entries.values() if entry.get('payload_ext')),
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': dict(self.hits),
+                'misses': dict(self.misses),
+                'hit_rate': {kind: round(self.hits[kind] / lookups[kind], 3) if lookups[kind] else None
+                             for kind in lookups},
+            }
+
+
+class LineConversionCache:
+    """有上限的 LRU 逐行转换缓存（原文 → 转换结果），同一进程内的所有任务共享
+
+    Args:
+        max_entries: 最多缓存的行数
+        persist_path: 持久化文件路径，为 None 时只保存在内存中
+        save_interval: 持久化的最小间隔（秒），进程退出时也会保存
+    """
+
+    def __init__(self, max_entries=50000, persist_path=None, save_interval=60):
+        self.max_entries = max_entries
+        self.persist_path = persist_path
+        self.save_interval = save_interval
+        self._lock = threading.Lock()
+        self._lines = OrderedDict()
+        self._dirty = False
+        self._last_save = time.time()
+        self.hits = 0
+        self.misses = 0
+        if persist_path:
+            self._load()
+            atexit.register(self.save)
+
+    def _load(self):
+        if not os.path.exists(self.persist_path):
+            return
+        try:
+            with open(self.persist_path, 'r', encoding='utf-8') as f:
+                pairs = json.load(f)
+        except Exception as e:
+            print(f"读取逐行转换缓存失败: {str(e)}")
+            return
+        # 文件中按最近使用时间从旧到新排列
+        for source, converted in pairs[-self.max_entries:]:
+            self._lines[source] = converted
+
+    def save(self):
+        if not self.persist_path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            pairs = list(self._lines.items())
+            self._dirty = False
+            self._last_save = time.time()
+        directory = os.path.dirname(self.persist_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{self.persist_path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(pairs, f, ensure_ascii=False)
+            os.replace(temp_path, self.persist_path)
+        except Exception as e:
+            print(f"保存逐行转换缓存失败: {str(e)}")
+
+    def convert_many(self, texts, converter):
+        """转换一组文本行，缓存未命中的行调用 converter，返回 (转换结果, 命中数, 实际转换的行数)"""
+        results = [None] * len(texts)
+        missing = {}
+        with self._lock:
+            for i, text in enumerate(texts):
+                converted = self._lines.get(text)
+                if converted is None:
+                    missing.setdefault(text, []).append(i)
+                else:
+                    self._lines.move_to_end(text)
+                    results[i] = converted
+        # 同一批中重复的行只转换一次，也算作命中
+        hits = len(texts) - len(missing)
+        
+        # 在锁外调用 zhconv，避免阻塞其他任务
+        converted_missing = {text: converter(text) for text in missing}
+        for text, positions in missing.items():
+            for i in positions:
+                results[i] = converted_missing[text]
+        
+        with self._lock:
+            for text, converted in converted_missing.items():
+                self._lines[text] = converted
+                self._lines.move_to_end(text)
+            while len(self._lines) > self.max_entries:
+                self._lines.popitem(last=False)
+            self.hits += hits
+            self.misses += len(missing)
+            if converted_missing:
+                self._dirty = True
+            should_save = self._dirty and time.time() - self._last_save >= self.save_interval
+        if should_save:
+            self.save()
+        return results, hits, len(missing)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._lines)
+
+    def hit_rate(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._lines),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+                'persist_path': self.persist_path,
+            }
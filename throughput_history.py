@@ -0,0 +1,91 @@
+"""处理吞吐量历史：记录实际转换写入的字节数和耗时，用于估算批量处理时间
+
+每种处理方式（remux/sidecar/inplace）保留最近的若干次记录，保存在 data/throughput.json。
+"""
+import json
+import os
+import threading
+
+# 每种处理方式保留的最近记录数
+MAX_SAMPLES = 200
+
+
+class ThroughputHistory:
+    """最近转换的写入字节数和耗时
+
+    Args:
+        path: 历史记录文件路径，为 None 时只保存在内存中
+    """
+
+    def __init__(self, path='data/throughput.json'):
+        self.path = path
+        self._lock = threading.Lock()
+        self._samples = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self._samples = {kind: samples[-MAX_SAMPLES:] for kind, samples in json.load(f).items()}
+            except Exception as e:
+                print(f"读取吞吐量历史失败: {str(e)}")
+
+    def _save_locked(self):
+        if not self.path:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._samples, f)
+            os.replace(temp_path, self.path)
+        except Exception as e:
+            print(f"保存吞吐量历史失败: {str(e)}")
+
+    def record(self, result):
+        """记录一次成功转换（ProcessResult），试运行和未转换的结果不记录"""
+        if not result or result.dry_run:
+            return
+        summary = result.to_dict()
+        if 'inplace' in summary['stages']:
+            kind = 'inplace'
+        else:
+            kind = 'remux' if 'remux' in summary['stages'] else 'sidecar'
+        written = sum(info['written'] for info in summary['io'].values())
+        if summary['wall_time'] <= 0:
+            return
+        with self._lock:
+            samples = self._samples.setdefault(kind, [])
+            samples.append([written, summary['wall_time']])
+            del samples[:-MAX_SAMPLES]
+            self._save_locked()
+
+    def throughput(self, kind):
+        """返回 (每秒写入字节数, 每个文件的平均耗时)，没有历史记录时返回 (None, None)"""
+        with self._lock:
+            samples = self._samples.get(kind) or []
+            total_bytes = sum(sample[0] for sample in samples)
+            total_seconds = sum(sample[1] for sample in samples)
+        if not samples or total_seconds <= 0:
+            return None, None
+        return total_bytes / total_seconds, total_seconds / len(samples)
+
+    def estimate_seconds(self, kind, rewrite_bytes, files):
+        """按历史吞吐量估算写入 rewrite_bytes 字节、处理 files 个文件所需的时间（秒，单线程）"""
+        bytes_per_second, seconds_per_file = self.throughput(kind)
+        if bytes_per_second is None:
+            return None
+        if bytes_per_second > 0 and rewrite_bytes:
+            return rewrite_bytes / bytes_per_second
+        return seconds_per_file * files
+
+    def stats(self):
+        info = {}
+        for kind in list(self._samples):
+            bytes_per_second, seconds_per_file = self.throughput(kind)
+            info[kind] = {
+                'samples': len(self._samples.get(kind, [])),
+                'bytes_per_second': round(bytes_per_second) if bytes_per_second is not None else None,
+                'seconds_per_file': round(seconds_per_file, 3) if seconds_per_file is not None else None,
+            }
+        return info
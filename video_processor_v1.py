@@ -1,3 +1,4 @@
+import argparse
 import subprocess
 import json
 import os
@@ -5,17 +6,378 @@ import sys
 import re
 import time
 import random
+import fnmatch
 import glob
-# 改用zhconv替代pyzh，更稳定可靠
-import zhconv
+import io
+import queue
+import threading
+import zlib
+from contextlib import contextmanager, nullcontext, redirect_stdout
+from metrics import (
+    stage_timer, record_io, SUBTITLE_CACHE_LOOKUPS, LINE_CACHE_LOOKUPS, LINE_CACHE_HIT_RATIO, LINE_CACHE_ENTRIES,
+    CLASSIFICATION_DECISIONS, METADATA_OVERRULED
+)
+from subtitle_cache import LineConversionCache, hash_file, hash_text
+import mkv_inplace
+
+try:
+    import resource  # 仅Unix可用，用于统计ffmpeg子进程的CPU时间
+except ImportError:
+    resource = None
+
+# 处理结果原因
+OUTCOME_CONVERTED = 'converted'
+OUTCOME_NOT_FOUND = 'not_found'
+OUTCOME_NO_SUBTITLES = 'no_subtitles'
+OUTCOME_ALREADY_SIMPLIFIED = 'already_simplified'
+OUTCOME_NO_TRADITIONAL = 'no_traditional'
+OUTCOME_OUTPUT_EXISTS = 'output_exists'
+OUTCOME_ERROR = 'error'
+
+# 文本字幕编码 → 提取时使用的文件扩展名（其他文本编码统一转为srt）
+TEXT_SUBTITLE_EXTENSIONS = {
+    'ass': 'ass',
+    'ssa': 'ass',
+    'subrip': 'srt',
+    'srt': 'srt',
+    'webvtt': 'vtt',
+    'mov_text': 'srt',
+    'text': 'srt',
+}
+# 文件扩展名 → ffmpeg字幕编码器
+SUBTITLE_ENCODERS = {'ass': 'ass', 'srt': 'srt', 'vtt': 'webvtt'}
+# 图形字幕无法提取为文本
+BITMAP_SUBTITLE_CODECS = {'hdmv_pgs_subtitle', 'dvd_subtitle', 'dvb_subtitle', 'xsub'}
+MP4_EXTENSIONS = {'.mp4', '.m4v', '.mov'}
+# 输出方式：remux 重新封装视频；sidecar 只在视频旁写外挂字幕；both 两者都做
+OUTPUT_MODES = ('remux', 'sidecar', 'both')
+# 重新封装方式：ffmpeg 完整重新封装并追加简体字幕流；inplace 在 MKV 中原地把繁体字幕轨转换为简体
+# （只写入字幕数据，无法原地转换时改用 ffmpeg）
+REMUX_ENGINES = ('ffmpeg', 'inplace')
+INPLACE_EXTENSIONS = {'.mkv', '.mk3d'}
+# 字幕文件转换时每块读取的字符数（按整行），每块在字幕内存预算中按最多 4 字节/字符预留
+CONVERT_CHUNK_CHARS = 256 * 1024
+SIDECAR_EXTENSIONS = ('.srt', '.ass', '.ssa', '.vtt')
+# 外挂字幕文件名中的语言标记：繁体 → 简体（如 Episode.cht.srt → Episode.chs.srt）
+SIDECAR_LANGUAGE_TAGS = {
+    'cht': 'chs', 'tc': 'sc', 'big5': 'gb', 'zh-tw': 'zh-cn', 'zh-hk': 'zh-cn',
+    'zh-hant': 'zh-hans', '繁体': '简体', '繁體': '简体', '繁中': '简中',
+}
+SIMPLIFIED_SIDECAR_TAG = 'chs'
+# 字幕分类的取样方式：head 取开头若干行；windows 在视频中均匀分布的多个时间点用 -ss/-t 各取一段；
+# reservoir 对读取到的全部文本行做蓄水池抽样（内存有上限，读取范围受 max_read_mb 限制）
+SAMPLING_STRATEGIES = ('head', 'windows', 'reservoir')
+DEFAULT_CLASSIFICATION_SETTINGS = {
+    'sampling_strategy': 'head',
+    'sample_lines': 200,
+    'window_count': 5,
+    'window_seconds': 60,
+    # head/reservoir 取样只把视频文件的前 max_read_mb MB 交给 ffmpeg（0 表示不限制），
+    # 字幕包分散在整个文件中，完整提取需要读取整个文件
+    'max_read_mb': 64,
+    # 中文字符中繁体字的占比达到该阈值才判定为繁体；低于阈值且中文字符足够多时判定为简体
+    'traditional_ratio_threshold': 0.1,
+    'min_cjk_chars': 10,
+    # 先根据 language/title/handler_name 标签判断，标签明确时不提取字幕内容
+    'metadata_first': True,
+    # 标签判断的得分下限，以及仍然抽查内容的比例（0-1）
+    'metadata_min_score': 2,
+    'verify_fraction': 0.05,
+}
+
+# 字幕流标签：语言代码和标题/handler_name 中的繁简标记
+TRADITIONAL_LANGUAGE_TAGS = {'cht', 'zht', 'zh-tw', 'zh-hk', 'zh-mo', 'zh-hant'}
+SIMPLIFIED_LANGUAGE_TAGS = {'chs', 'zhs', 'zh-cn', 'zh-sg', 'zh-hans'}
+CHINESE_LANGUAGE_TAGS = {'zh', 'zho', 'chi'}
+# 原地转换时繁体语言标签 → 相同长度的简体标签
+SIMPLIFIED_LANGUAGE_EQUIVALENTS = {
+    'cht': 'chs', 'zht': 'zhs', 'zh-tw': 'zh-CN', 'zh-hk': 'zh-CN', 'zh-mo': 'zh-CN', 'zh-hant': 'zh-Hans',
+}
+TRADITIONAL_TAG_PATTERN = re.compile(r'繁|正體|\bBIG5\b|\bCHT\b|\bTC\b|Traditional|Hant\b|zh[-_]?(?:TW|HK)', re.IGNORECASE)
+SIMPLIFIED_TAG_PATTERN = re.compile(r'简|簡|\bCHS\b|\bSC\b|\bGB(?:K|2312)?\b|Simplified|Hans\b|zh[-_]?CN', re.IGNORECASE)
+# 实际转换的吞吐量历史（与 API 服务共用），用于试运行时估算耗时
+THROUGHPUT_HISTORY_PATH = "data/throughput.json"
+# 繁体字幕流标题中的标记 → 简体标记
+TITLE_MARKERS = [
+    ('繁體', '简体'), ('繁体', '简体'), ('繁中', '简中'),
+    ('CHT', 'CHS'), ('BIG5', 'GB'), ('Big5', 'GB'), ('Traditional', 'Simplified'),
+]
+
+# 当前线程正在处理的结果对象，供各阶段记录耗时和读写量
+_current = threading.local()
+
+class ProcessResult:
+    """process_single_video 的处理结果
+    
+    布尔值与旧版返回值兼容：只有成功转换时为 True。
+    stages 记录各阶段的墙钟时间、本线程CPU时间和子进程CPU时间（多线程并行时子进程CPU时间为近似值），
+    io 记录各阶段读写的字节数。dry_run 为 True 时 outcome 表示实际处理会得到的结果，
+    estimated_rewrite_bytes 为实际处理需要写入的字节数。
+    """
+    
+    def __init__(self, video_file, dry_run=False):
+        self.video_file = video_file
+        self.dry_run = dry_run
+        self.estimated_rewrite_bytes = 0
+        self.outcome = None
+        self.message = ''
+        self.output_file = None
+        self.subtitle_stream_count = 0
+        self.traditional_indices = []
+        self.selected_indices = []
+        self.sidecar_files = []
+        self.subtitle_bytes = 0
+        self.stages = {}
+        self.io = {}
+        self.start_time = time.time()
+        self.end_time = None
+    
+    def __bool__(self):
+        return self.outcome == OUTCOME_CONVERTED
+    
+    def finish(self, outcome, message):
+        """记录最终结果并返回自身"""
+        self.outcome = outcome
+        self.message = message
+        self.end_time = time.time()
+        return self
+    
+    def add_stage(self, stage, wall, cpu, child_cpu):
+        info = self.stages.setdefault(stage, {'wall': 0.0, 'cpu': 0.0, 'child_cpu': 0.0, 'calls': 0})
+        info['wall'] += wall
+        info['cpu'] += cpu
+        info['child_cpu'] += child_cpu
+        info['calls'] += 1
+    
+    def add_io(self, stage, bytes_read, bytes_written):
+        info = self.io.setdefault(stage, {'read': 0, 'written': 0})
+        info['read'] += bytes_read
+        info['written'] += bytes_written
+    
+    def to_dict(self):
+        info = {
+            'outcome': self.outcome,
+            'message': self.message,
+            'output_file': self.output_file,
+            'subtitle_stream_count': self.subtitle_stream_count,
+            'traditional_indices': self.traditional_indices,
+            'selected_indices': self.selected_indices,
+            'sidecar_files': self.sidecar_files,
+            'subtitle_bytes': self.subtitle_bytes,
+            'wall_time': round((self.end_time or time.time()) - self.start_time, 3),
+            'stages': {
+                stage: {key: round(value, 3) if isinstance(value, float) else value for key, value in info.items()}
+                for stage, info in self.stages.items()
+            },
+            'io': self.io,
+        }
+        if self.dry_run:
+            info['dry_run'] = True
+            info['estimated_rewrite_bytes'] = self.estimated_rewrite_bytes
+        return info
+
+# 字幕内容缓存（SubtitleCache），由 set_subtitle_cache 设置，为 None 时不使用缓存
+_subtitle_cache = None
+
+def set_subtitle_cache(cache):
+    """设置按内容哈希缓存分类结果和转换输出的字幕缓存，传入 None 关闭缓存"""
+    global _subtitle_cache
+    _subtitle_cache = cache
+
+# 繁简转换使用 zhconv（替代 pyzh，更稳定可靠）。导入 zhconv 和加载词典约需 0.1 秒，
+# 推迟到第一次转换时进行，只列出文件、查询状态的进程不需要付出这个代价
+_zhconv = None
+_zhconv_lock = threading.Lock()
+
+def _to_simplified(text):
+    global _zhconv
+    if _zhconv is None:
+        with _zhconv_lock:
+            if _zhconv is None:
+                import zhconv
+                zhconv.convert('繁體', 'zh-cn')  # 加载词典
+                _zhconv = zhconv
+    return _zhconv.convert(text, 'zh-cn')
+
+def prewarm_converter():
+    """预先加载繁简转换词典（API 服务启动后在后台线程中调用）"""
+    start = time.perf_counter()
+    _to_simplified('繁體')
+    print(f"繁简转换词典已加载（{time.perf_counter() - start:.2f}秒）")
+
+# 逐行转换缓存，同一进程内的所有任务共享；由 set_line_cache 替换，为 None 时整段调用 zhconv
+_line_cache = LineConversionCache()
+
+def set_line_cache(cache):
+    """设置逐行转换缓存（LineConversionCache），传入 None 关闭缓存"""
+    global _line_cache
+    _line_cache = cache
+
+# 字幕内存预算（memory_budget.MemoryBudget）和 ffmpeg 子进程内存上限（ChildMemoryLimit），
+# 由 set_memory_limits 设置，为 None 时不限制
+_memory_budget = None
+_child_memory = None
+
+def set_memory_limits(budget=None, children=None):
+    """设置同时处理的字幕数据预算和 ffmpeg/ffprobe 子进程的内存上限"""
+    global _memory_budget, _child_memory
+    _memory_budget = budget
+    _child_memory = children
+
+def _reserve_subtitle_memory(nbytes):
+    """在字幕内存预算中预留 nbytes 字节（所有工作线程合计），没有设置预算时不限制"""
+    budget = _memory_budget
+    return budget.reserve(nbytes) if budget is not None else nullcontext()
+
+def _attach_child(process):
+    """ffmpeg/ffprobe 启动后设置内存上限，并登记到当前线程的中止信号"""
+    children = _child_memory
+    if children is not None:
+        children.attach(process)
+    signal = getattr(_current, 'abort', None)
+    if signal is not None:
+        signal.attach(process)
+
+class ProcessingAborted(Exception):
+    """处理已被中止（如工作节点失去任务租约），在修改原文件、写入输出前抛出"""
+
+class AbortSignal:
+    """中止一个文件的处理：set() 后结束已登记的 ffmpeg/ffprobe，处理在下一次修改文件前抛出 ProcessingAborted
+    
+    接口与 threading.Event 相同（set/is_set/wait），可以作为 shared_queue.QueueWorker 的 abort_factory。
+    """
+    
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._processes = []
+    
+    def attach(self, process):
+        with self._lock:
+            self._processes = [p for p in self._processes if p.poll() is None]
+            self._processes.append(process)
+            aborted = self._event.is_set()
+        if aborted:
+            self._kill(process)
+    
+    def set(self):
+        with self._lock:
+            self._event.set()
+            processes = list(self._processes)
+        for process in processes:
+            self._kill(process)
+    
+    def is_set(self):
+        return self._event.is_set()
+    
+    def wait(self, timeout=None):
+        return self._event.wait(timeout)
+    
+    @staticmethod
+    def _kill(process):
+        try:
+            if process.poll() is None:
+                process.kill()
+        except OSError:
+            pass
+
+@contextmanager
+def abort_on(signal):
+    """在当前线程中使用中止信号（AbortSignal），为 None 时不检查"""
+    previous = getattr(_current, 'abort', None)
+    _current.abort = signal
+    try:
+        yield
+    finally:
+        _current.abort = previous
+
+def _check_abort():
+    """当前线程的处理已被中止时抛出 ProcessingAborted"""
+    signal = getattr(_current, 'abort', None)
+    if signal is not None and signal.is_set():
+        raise ProcessingAborted("处理已中止（任务租约丢失）")
+
+# 字幕分类设置，由 configure_classification 修改
+_classification_settings = dict(DEFAULT_CLASSIFICATION_SETTINGS)
+
+def configure_classification(settings):
+    """更新字幕分类设置（取样方式、取样行数、时间窗口、繁体字占比阈值等）"""
+    merged = dict(DEFAULT_CLASSIFICATION_SETTINGS)
+    merged.update(settings or {})
+    if merged['sampling_strategy'] not in SAMPLING_STRATEGIES:
+        raise ValueError(f"不支持的取样方式: {merged['sampling_strategy']}，支持: {', '.join(SAMPLING_STRATEGIES)}")
+    _classification_settings.clear()
+    _classification_settings.update(merged)
+
+def _children_cpu_time():
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+@contextmanager
+def _stage(stage):
+    """记录处理阶段耗时：导出到指标，并写入当前线程的处理结果"""
+    process_result = getattr(_current, 'result', None)
+    wall_start = time.perf_counter()
+    cpu_start = time.thread_time()
+    child_start = _children_cpu_time()
+    try:
+        with stage_timer(stage):
+            yield
+    finally:
+        if process_result is not None:
+            process_result.add_stage(stage, time.perf_counter() - wall_start,
+                                     time.thread_time() - cpu_start, _children_cpu_time() - child_start)
+
+def _record_io(stage, bytes_read=0, bytes_written=0):
+    """记录处理阶段读写字节数：导出到指标，并写入当前线程的处理结果"""
+    record_io(stage, bytes_read, bytes_written)
+    process_result = getattr(_current, 'result', None)
+    if process_result is not None:
+        process_result.add_io(stage, bytes_read, bytes_written)
+
+@contextmanager
+def io_limits(limits):
+    """在当前线程中使用 limits（io_throttle.IOLimits）运行 ffmpeg 和复制文件，为 None 时不限制"""
+    previous = getattr(_current, 'io_limits', None)
+    _current.io_limits = limits
+    try:
+        yield
+    finally:
+        _current.io_limits = previous
+
+def _run_ffmpeg(cmd, timeout):
+    """运行 ffmpeg/ffprobe 并捕获输出，限制子进程内存；当前线程设置了 I/O 限制时降低优先级并限速"""
+    limits = getattr(_current, 'io_limits', None)
+    if limits is not None:
+        return limits.run(cmd, timeout=timeout, text=True, encoding="utf-8", on_spawn=_attach_child)
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, encoding="utf-8") as process:
+        _attach_child(process)
+        try:
+            stdout, stderr = process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.communicate()
+            raise
+    return subprocess.CompletedProcess(process.args, process.returncode, stdout, stderr)
+
+def _copy_file(src, dst):
+    """复制文件（保留属性），当前线程设置了 I/O 限制时限速"""
+    limits = getattr(_current, 'io_limits', None)
+    if limits is None:
+        import shutil
+        shutil.copy2(src, dst)
+    else:
+        limits.copy_file(src, dst)
 
 def cleanup_orphaned_temp_files():
     """清理可能遗留的临时文件"""
     try:
         # 查找所有临时文件
         temp_patterns = [
-            "temp_traditional_*.srt",
-            "temp_simplified_*.srt", 
+            "temp_traditional_*.*",
+            "temp_simplified_*.*",
             "temp_sample_*.srt",
             "*_temp_output.*"
         ]
@@ -49,186 +411,549 @@ def contains_traditional_chars(text):
     clean_text = ''.join(chinese_chars)
     
     # 将文本转换为简体
-    simplified_text = zhconv.convert(clean_text, 'zh-cn')  # 使用zhconv的写法
+    simplified_text = _to_simplified(clean_text)
     
     # 如果转换前后有差异，说明包含繁体字
     return clean_text != simplified_text
 
-def extract_sample_subtitle_text(video_file, subtitle_index, sample_lines=300):
-    """提取字幕的部分内容用于判断"""
-    # 使用更唯一的临时文件名，避免并行处理时的冲突
-    timestamp = int(time.time() * 1000)  # 毫秒时间戳
-    random_id = random.randint(1000, 9999)
-    temp_subtitle = f"temp_sample_{timestamp}_{random_id}_{subtitle_index}.srt"
-    
-    try:
-        # 获取ffmpeg路径（兼容不同系统）
-        ffmpeg_cmd = "ffmpeg.exe" if sys.platform.startswith('win') else "ffmpeg"
-        
-        # 提取字幕样本
-        cmd = [
-            ffmpeg_cmd,
-            "-i", video_file,
-            "-map", f"0:s:{subtitle_index}",
-            "-c:s", "srt",
-            "-f", "srt",
-            "-y",  # 覆盖输出文件
-            temp_subtitle
-        ]
-        
-        # 执行命令，指定编码为utf-8解决Windows编码问题
-        run_kwargs = {
-            "capture_output": True,
-            "timeout": 60,
-            "text": True,
-            "encoding": "utf-8"  # 明确指定编码
-        }
-        result = subprocess.run(cmd, **run_kwargs)
-            
-        if result.returncode != 0:
-            return ""
-        
-        # 检查文件是否存在且不为空
-        if not os.path.exists(temp_subtitle) or os.path.getsize(temp_subtitle) == 0:
-            return ""
-        
-        # 读取样本内容
-        with open(temp_subtitle, 'r', encoding='utf-8', errors='ignore') as f:
-            lines = f.readlines()
-        
-        # 只取字幕文本部分（跳过时间戳和序号）
-        subtitle_text = ""
-        valid_line_count = 0
-        
-        for line in lines:
-            stripped_line = line.strip()
-            # 跳过空行、数字行和时间戳行
-            if (stripped_line and 
-                not stripped_line.isdigit() and 
+def traditional_char_ratio(text):
+    """返回 (中文字符中繁体字的占比, 中文字符数)"""
+    chinese_chars = re.findall(r'[\u4e00-\u9fff]', text or '')
+    if not chinese_chars:
+        return 0.0, 0
+    clean_text = ''.join(chinese_chars)
+    simplified_text = _to_simplified(clean_text)
+    if len(simplified_text) == len(clean_text):
+        changed = sum(1 for a, b in zip(clean_text, simplified_text) if a != b)
+    else:
+        # 个别词组转换后长度变化，逐字比较
+        changed = sum(1 for char in clean_text if _to_simplified(char) != char)
+    return changed / len(clean_text), len(clean_text)
+
+def _is_subtitle_text_line(stripped_line):
+    """SRT 输出中的字幕文本行（跳过空行、序号和时间轴）"""
+    return bool(stripped_line and
+                not stripped_line.isdigit() and
                 '-->' not in stripped_line and
                 not re.match(r'^\d{2}:\d{2}:\d{2},\d{3}', stripped_line) and
-                not re.match(r'^\d{1,2}:\d{2}:\d{2}.\d{2}$', stripped_line)):
-                subtitle_text += stripped_line + "\n"
-                valid_line_count += 1
-                if valid_line_count >= sample_lines:
+                not re.match(r'^\d{1,2}:\d{2}:\d{2}.\d{2}$', stripped_line))
+
+def _process_bytes_read(pid):
+    """读取子进程已读取的字节数（仅 Linux 的 /proc 可用，其他情况返回 None）"""
+    try:
+        with open(f"/proc/{pid}/io", 'r') as f:
+            for line in f:
+                if line.startswith('rchar:'):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+def _sample_command(video_file, subtitle_index, seek=None, window=None, from_stdin=False):
+    """把字幕流以 SRT 格式输出到标准输出的 ffmpeg 命令
+    
+    可选只读取 seek 开始的 window 秒；from_stdin 为 True 时从标准输入读取视频数据。
+    """
+    ffmpeg_cmd = "ffmpeg.exe" if sys.platform.startswith('win') else "ffmpeg"
+    cmd = [ffmpeg_cmd, "-v", "error"]
+    if seek is not None:
+        # 放在 -i 之前为输入定位，MKV/MP4 通过索引直接跳转，不读取前面的数据
+        cmd.extend(["-ss", f"{seek:.3f}"])
+    if window is not None:
+        cmd.extend(["-t", f"{window:.3f}"])
+    cmd.extend(["-i", "pipe:0" if from_stdin else video_file,
+                "-map", f"0:s:{subtitle_index}", "-c:s", "srt", "-f", "srt", "pipe:1"])
+    return cmd
+
+def _feed_file_head(process, input_file, input_limit, fed):
+    """把 input_file 的前 input_limit 字节写入 ffmpeg 的标准输入"""
+    try:
+        with open(input_file, 'rb') as f:
+            remaining = input_limit
+            while remaining > 0:
+                chunk = f.read(min(1024 * 1024, remaining))
+                if not chunk:
                     break
-        
-        return subtitle_text
-        
+                process.stdin.write(chunk)
+                fed[0] += len(chunk)
+                remaining -= len(chunk)
+    except (BrokenPipeError, OSError, ValueError):
+        # ffmpeg 已读够字幕行被结束
+        pass
+    finally:
+        try:
+            process.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+
+def _read_subtitle_pipe(cmd, handle_line, timeout=60, input_file=None, input_limit=None):
+    """运行 ffmpeg 并把输出的字幕文本行逐行交给 handle_line
+    
+    handle_line 返回 False 时立即结束 ffmpeg，不再读取视频文件的剩余部分。
+    指定 input_file 时只把它的前 input_limit 字节通过标准输入交给 ffmpeg。
+    返回 ffmpeg 读取的字节数（无法获取时为 None）；超时抛出 subprocess.TimeoutExpired，
+    ffmpeg 以非零状态退出时抛出 subprocess.SubprocessError（提前结束和截断输入除外）。
+    """
+    # 标准输入写入视频的二进制数据，标准输出按 utf-8 解码
+    popen_args = dict(stdin=subprocess.PIPE if input_file else subprocess.DEVNULL,
+                      stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    limits = getattr(_current, 'io_limits', None)
+    governor = None
+    if limits is None:
+        process = subprocess.Popen(cmd, **popen_args)
+        _attach_child(process)
+    else:
+        process, governor = limits.popen(cmd, on_spawn=_attach_child, **popen_args)
+    timed_out = threading.Event()
+    done = threading.Event()
+    def watch():
+        # 限速暂停（SIGSTOP）的时间不算超时，与 IOLimits.run 相同
+        started = time.monotonic()
+        while True:
+            elapsed = time.monotonic() - started - (governor.paused_time() if governor is not None else 0)
+            if elapsed >= timeout:
+                timed_out.set()
+                process.kill()
+                return
+            if done.wait(timeout - elapsed):
+                return
+    watchdog = threading.Thread(target=watch, daemon=True)
+    watchdog.start()
+    fed = [0]
+    feeder = None
+    if input_file:
+        feeder = threading.Thread(target=_feed_file_head, args=(process, input_file, input_limit, fed), daemon=True)
+        feeder.start()
+    bytes_read = None
+    stopped = False
+    try:
+        for line in io.TextIOWrapper(process.stdout, encoding="utf-8", errors="ignore"):
+            stripped_line = line.strip()
+            if _is_subtitle_text_line(stripped_line) and handle_line(stripped_line) is False:
+                stopped = True
+                break
+        if not input_file:
+            bytes_read = _process_bytes_read(process.pid)
+    finally:
+        done.set()
+        watchdog.join()
+        if governor is not None:
+            governor.stop()
+        if process.poll() is None:
+            process.kill()
+        process.stdout.close()
+        process.wait()
+        if feeder is not None:
+            feeder.join()
+            bytes_read = fed[0]
+    if timed_out.is_set():
+        raise subprocess.TimeoutExpired(cmd, timeout)
+    # 只输入文件开头时 ffmpeg 读到截断的数据可能报错退出，已读到的字幕仍然有效
+    truncated = input_file is not None and fed[0] >= input_limit
+    if process.returncode != 0 and not stopped and not truncated:
+        raise subprocess.SubprocessError(f"ffmpeg提取字幕失败，退出码 {process.returncode}")
+    return bytes_read
+
+def _read_sample_lines(video_file, subtitle_index, handle_line):
+    """读取字幕流的文本行用于取样，设置了 max_read_mb 时只读取文件开头部分
+    
+    开头部分没有读到任何字幕（字幕很稀疏，或 MP4 的索引在文件末尾无法流式读取）时退回完整读取。
+    返回读取的字节数（无法获取时为 None）。
+    """
+    input_limit = int(_classification_settings['max_read_mb'] * 1024 * 1024)
+    if input_limit > 0 and os.path.getsize(video_file) > input_limit:
+        got_lines = [0]
+        def counted(line):
+            got_lines[0] += 1
+            return handle_line(line)
+        bytes_read = _read_subtitle_pipe(_sample_command(video_file, subtitle_index, from_stdin=True), counted,
+                                         input_file=video_file, input_limit=input_limit)
+        if got_lines[0]:
+            return bytes_read
+        print(f"- 字幕流 {subtitle_index} 在文件开头 {_classification_settings['max_read_mb']}MB 内没有字幕，读取完整文件")
+        full_bytes = _read_subtitle_pipe(_sample_command(video_file, subtitle_index), handle_line)
+        return (bytes_read or 0) + (full_bytes or 0)
+    return _read_subtitle_pipe(_sample_command(video_file, subtitle_index), handle_line)
+
+def extract_sample_subtitle_text(video_file, subtitle_index, sample_lines=300, duration=None, strategy=None):
+    """按取样方式提取字幕的部分文本用于判断
+    
+    Args:
+        video_file: 视频文件路径
+        subtitle_index: 字幕流序号
+        sample_lines: 取样的文本行数
+        duration: 视频时长（秒），windows 取样需要；未知时退回 head 取样
+        strategy: 取样方式，默认使用分类设置中的 sampling_strategy
+    """
+    strategy = strategy or _classification_settings['sampling_strategy']
+    if strategy == 'windows' and not duration:
+        strategy = 'head'
+    sampled = []
+    bytes_read = 0
+    
+    try:
+        if strategy == 'windows':
+            # 在均匀分布的多个时间点各取一段，避免开头的英文标题、制作人员名单影响判断
+            window_count = max(1, int(_classification_settings['window_count']))
+            window_seconds = float(_classification_settings['window_seconds'])
+            lines_per_window = max(1, -(-sample_lines // window_count))
+            for k in range(window_count):
+                seek = max(0.0, duration * (k + 0.5) / window_count - window_seconds / 2)
+                window_lines = []
+                def take(line, window_lines=window_lines):
+                    window_lines.append(line)
+                    return len(window_lines) < lines_per_window
+                window_bytes = _read_subtitle_pipe(
+                    _sample_command(video_file, subtitle_index, seek=seek, window=window_seconds), take)
+                bytes_read += window_bytes or 0
+                sampled.extend(window_lines)
+        elif strategy == 'reservoir':
+            # 对读取到的文本行做蓄水池抽样，按原顺序返回
+            rng = random.Random(subtitle_index)
+            reservoir = []
+            seen = [0]
+            def take(line):
+                position = seen[0]
+                seen[0] += 1
+                if len(reservoir) < sample_lines:
+                    reservoir.append((position, line))
+                else:
+                    slot = rng.randint(0, position)
+                    if slot < sample_lines:
+                        reservoir[slot] = (position, line)
+            window_bytes = _read_sample_lines(video_file, subtitle_index, take)
+            bytes_read = window_bytes if window_bytes is not None else os.path.getsize(video_file)
+            sampled = [line for _, line in sorted(reservoir)]
+        else:
+            # 读够 sample_lines 行后立即结束 ffmpeg
+            def take(line):
+                sampled.append(line)
+                return len(sampled) < sample_lines
+            bytes_read = _read_sample_lines(video_file, subtitle_index, take) or 0
     except Exception as e:
+        # 提取失败不能当作没有字幕文本，交给调用方按错误处理
         print(f"提取字幕样本出错: {str(e)}")
-        return ""
-    finally:
-        # 清理临时文件
-        if os.path.exists(temp_subtitle):
-            try:
-                os.remove(temp_subtitle)
-            except Exception:
-                pass
+        raise
+    
+    if bytes_read:
+        _record_io('classification', bytes_read=bytes_read)
+    return ''.join(line + "\n" for line in sampled)
+
+def classify_sample_text(sample_text):
+    """根据字幕样本判断类型，返回 {'simplified': 是否简体, 'traditional': 是否繁体, 'traditional_ratio': 繁体字占比}"""
+    if not sample_text or len(sample_text.strip()) < 30:  # 文本太短无法准确判断
+        return {'simplified': False, 'traditional': False, 'traditional_ratio': 0.0}
+    ratio, cjk_count = traditional_char_ratio(sample_text)
+    # 英文等不含中文（或中文太少）的字幕既不算简体也不算繁体
+    if cjk_count < _classification_settings['min_cjk_chars']:
+        return {'simplified': False, 'traditional': False, 'traditional_ratio': round(ratio, 4)}
+    is_traditional = ratio >= _classification_settings['traditional_ratio_threshold']
+    return {'simplified': not is_traditional, 'traditional': is_traditional, 'traditional_ratio': round(ratio, 4)}
+
+def _stream_identity_digest(video_file, subtitle_index):
+    """提取样本前就能确定的缓存键：文件路径、大小、修改时间、字幕流序号和分类设置
+
+    同一个文件（如先 /batch-plan 再批量处理、抽查标签）重复分类时不需要再运行 ffmpeg 提取样本；
+    文件被替换或修改后大小/修改时间变化，键随之失效。无法读取文件信息时返回 None。
+    """
+    try:
+        st = os.stat(video_file)
+    except OSError:
+        return None
+    settings = json.dumps(_classification_settings, sort_keys=True)
+    return hash_text(f"stream|{os.path.abspath(video_file)}|{st.st_size}|{st.st_mtime_ns}|{subtitle_index}|{settings}")
+
+def subtitle_stream_verdict(video_file, subtitle_index, duration=None):
+    """提取一次字幕样本并判断类型
+    
+    先按文件和流序号查缓存（不需要运行 ffmpeg），再按样本内容查缓存（不同文件中相同的字幕流）。
+    提取样本失败时抛出异常；失败或没有取到文本的样本不写入缓存，下次重新提取。
+    """
+    cache = _subtitle_cache
+    identity = _stream_identity_digest(video_file, subtitle_index) if cache is not None else None
+    if identity is not None:
+        verdict = cache.get_classification(identity)
+        if verdict is not None:
+            SUBTITLE_CACHE_LOOKUPS.inc(kind='classification', result='hit')
+            return verdict
+    
+    sample_text = extract_sample_subtitle_text(video_file, subtitle_index,
+                                               sample_lines=_classification_settings['sample_lines'],
+                                               duration=duration)
+    if cache is None or not sample_text.strip():
+        return classify_sample_text(sample_text)
+    
+    # 判断结果取决于阈值设置，一并计入缓存键
+    digest = hash_text(f"{_classification_settings['traditional_ratio_threshold']}|"
+                       f"{_classification_settings['min_cjk_chars']}|{sample_text}")
+    verdict = cache.get_classification(digest)
+    SUBTITLE_CACHE_LOOKUPS.inc(kind='classification', result='hit' if verdict is not None else 'miss')
+    if verdict is None:
+        verdict = classify_sample_text(sample_text)
+        cache.put_classification(digest, verdict)
+    if identity is not None:
+        cache.put_classification(identity, verdict)
+    return verdict
 
 def is_traditional_subtitle(video_file, subtitle_index):
     """判断指定字幕流是否包含繁体字"""
-    try:
-        sample_text = extract_sample_subtitle_text(video_file, subtitle_index, sample_lines=200)
-        if not sample_text or len(sample_text.strip()) < 30:  # 文本太短无法准确判断
-            return False
-            
-        return contains_traditional_chars(sample_text)
-    except Exception as e:
-        print(f"判断字幕类型出错: {str(e)}")
-        return False
+    return subtitle_stream_verdict(video_file, subtitle_index)['traditional']
 
 def has_simplified_subtitle(video_file, subtitle_index):
-    """判断指定字幕流是否为简体字幕（不包含任何繁体字）"""
-    try:
-        sample_text = extract_sample_subtitle_text(video_file, subtitle_index, sample_lines=200)
-        if not sample_text or len(sample_text.strip()) < 30:
-            return False
-            
-        return not contains_traditional_chars(sample_text)
-    except Exception:
-        return False
+    """判断指定字幕流是否为简体字幕（包含中文且不包含任何繁体字）"""
+    return subtitle_stream_verdict(video_file, subtitle_index)['simplified']
 
 def analyze_subtitle_streams(video_file):
-    """分析视频文件中的字幕流"""
-    try:
-        # 获取ffprobe路径
-        ffprobe_cmd = "ffprobe.exe" if sys.platform.startswith('win') else "ffprobe"
-        
-        # 获取所有流信息
-        cmd = [
-            ffprobe_cmd, 
-            "-v", "quiet", 
-            "-print_format", "json", 
-            "-show_streams", 
-            video_file
-        ]
-        
-        # 执行命令，指定编码为utf-8
-        result = subprocess.run(cmd, capture_output=True, timeout=30, text=True, encoding="utf-8")
-            
-        if result.returncode != 0:
-            raise subprocess.SubprocessError(f"ffprobe执行失败: {result.stderr}")
-        
-        output = result.stdout if hasattr(result, 'stdout') else ""
-        if not output or not output.strip():
-            raise ValueError("ffprobe未返回有效数据")
-        
-        try:
-            streams_info = json.loads(output)
-        except json.JSONDecodeError:
-            # 尝试清理输出后再解析
-            cleaned_output = output.strip()
-            if cleaned_output.startswith('\ufeff'):  # BOM标记
-                cleaned_output = cleaned_output[1:]
-            streams_info = json.loads(cleaned_output)
-        
-        # 查找字幕流
-        subtitle_streams = []
-        for stream in streams_info.get("streams", []):
-            if stream.get("codec_type") == "subtitle":
-                subtitle_streams.append(stream)
-        
-        if not subtitle_streams:
-            return [], False, []
-        
-        # 分析每个字幕流
-        has_simplified = False
-        traditional_indices = []
-        
-        for i, stream in enumerate(subtitle_streams):
-            try:
-                # 首先检查语言标记
-                language = stream.get("tags", {}).get("language", "").lower()
-                if language in ["zh", "zho", "chi", "chs"]:
-                    # 标记为简体，但仍需验证
-                    if has_simplified_subtitle(video_file, i):
-                        has_simplified = True
-                        continue
-                elif language in ["cht", "zh-tw", "zh-hk"]:
-                    traditional_indices.append(i)
-                    continue
-                
-                # 检查是否为繁体字幕（包含任何繁体字）
-                if is_traditional_subtitle(video_file, i):
-                    traditional_indices.append(i)
-                else:
-                    # 检查是否为简体字幕
-                    if has_simplified_subtitle(video_file, i):
-                        has_simplified = True
-                            
-            except Exception as e:
-                print(f"分析字幕流 {i} 时出错: {str(e)}")
-                continue  # 继续分析其他流
-        
-        return subtitle_streams, has_simplified, traditional_indices
+    """分析视频文件中的字幕流
+    
+    ffprobe 失败、超时或任一字幕流无法判断时抛出异常，不能当作没有字幕或没有繁体字幕。
+    """
+    # 获取ffprobe路径
+    ffprobe_cmd = "ffprobe.exe" if sys.platform.startswith('win') else "ffprobe"
+    
+    # 获取所有流信息
+    cmd = [
+        ffprobe_cmd, 
+        "-v", "quiet", 
+        "-print_format", "json", 
+        "-show_streams", 
+        "-show_format",
+        video_file
+    ]
+    
+    # 执行命令，指定编码为utf-8
+    with _stage('ffprobe'):
+        result = _run_ffmpeg(cmd, timeout=30)
         
-    except Exception as e:
-        print(f"分析字幕流时出错: {str(e)}")
+    if result.returncode != 0:
+        raise subprocess.SubprocessError(f"ffprobe执行失败: {result.stderr}")
+    
+    output = result.stdout if hasattr(result, 'stdout') else ""
+    if not output or not output.strip():
+        raise ValueError("ffprobe未返回有效数据")
+    
+    try:
+        streams_info = json.loads(output)
+    except json.JSONDecodeError:
+        # 尝试清理输出后再解析
+        cleaned_output = output.strip()
+        if cleaned_output.startswith('\ufeff'):  # BOM标记
+            cleaned_output = cleaned_output[1:]
+        streams_info = json.loads(cleaned_output)
+    
+    # 查找字幕流
+    subtitle_streams = []
+    for stream in streams_info.get("streams", []):
+        if stream.get("codec_type") == "subtitle":
+            subtitle_streams.append(stream)
+    
+    if not subtitle_streams:
         return [], False, []
+    
+    # 视频时长用于按时间窗口取样
+    try:
+        duration = float(streams_info.get("format", {}).get("duration") or 0) or None
+    except (TypeError, ValueError):
+        duration = None
+    
+    # 分析每个字幕流
+    has_simplified = False
+    traditional_indices = []
+    
+    for i, stream in enumerate(subtitle_streams):
+        try:
+            with _stage('classification'):
+                is_simplified, is_traditional = classify_subtitle_stream(video_file, i, stream, duration)
+        except Exception as e:
+            raise RuntimeError(f"字幕流 {i} 无法判断: {str(e)}") from e
+        if is_traditional:
+            traditional_indices.append(i)
+        elif is_simplified:
+            has_simplified = True
+    
+    return subtitle_streams, has_simplified, traditional_indices
+
+def score_stream_metadata(stream):
+    """根据字幕流标签打分，返回 (语言代码, {'traditional': 得分, 'simplified': 得分})
+    
+    语言代码和标题各计 2 分，handler_name 计 1 分。
+    """
+    tags = {key.lower(): str(value) for key, value in stream.get("tags", {}).items()}
+    language = tags.get("language", "").lower()
+    scores = {'traditional': 0, 'simplified': 0}
+    if language in TRADITIONAL_LANGUAGE_TAGS:
+        scores['traditional'] += 2
+    elif language in SIMPLIFIED_LANGUAGE_TAGS:
+        scores['simplified'] += 2
+    for field, weight in (("title", 2), ("handler_name", 1)):
+        value = tags.get(field, "")
+        if TRADITIONAL_TAG_PATTERN.search(value):
+            scores['traditional'] += weight
+        if SIMPLIFIED_TAG_PATTERN.search(value):
+            scores['simplified'] += weight
+    return language, scores
+
+def metadata_verdict(stream):
+    """只根据标签判断字幕流类型，标签不明确（或互相矛盾）时返回 None"""
+    language, scores = score_stream_metadata(stream)
+    min_score = _classification_settings['metadata_min_score']
+    if scores['traditional'] >= min_score and scores['simplified'] == 0:
+        return {'simplified': False, 'traditional': True}
+    if scores['simplified'] >= min_score and scores['traditional'] == 0:
+        return {'simplified': True, 'traditional': False}
+    # 明确标记为其他语言、标题中也没有汉字的字幕流（如 eng/English）既不是简体也不是繁体
+    title = stream.get("tags", {}).get("title", "")
+    if (scores['traditional'] == 0 and scores['simplified'] == 0 and language and
+            language not in CHINESE_LANGUAGE_TAGS and language != 'und' and
+            not re.search(r'[\u4e00-\u9fff]', title)):
+        return {'simplified': False, 'traditional': False}
+    return None
+
+def _should_verify(video_file, i):
+    """按 verify_fraction 抽查标签判断的结果（按文件名和流序号固定选择，重复运行结果一致）"""
+    fraction = _classification_settings['verify_fraction']
+    if fraction <= 0:
+        return False
+    if fraction >= 1:
+        return True
+    return zlib.crc32(f"{os.path.basename(video_file)}:{i}".encode('utf-8')) % 10000 < fraction * 10000
+
+def classify_subtitle_stream(video_file, i, stream, duration=None):
+    """判断单个字幕流的类型，返回 (是否简体, 是否繁体)
+    
+    标签明确时直接采用（按 verify_fraction 抽查内容）；标签不明确时按样本内容判断。
+    图形字幕无法提取文本，只按标签判断。
+    """
+    if subtitle_extension(stream) is None:
+        CLASSIFICATION_DECISIONS.inc(path='metadata')
+        verdict = metadata_verdict(stream) or {'simplified': False, 'traditional': False}
+        return verdict['simplified'], verdict['traditional']
+    
+    verdict = metadata_verdict(stream) if _classification_settings['metadata_first'] else None
+    if verdict is None:
+        CLASSIFICATION_DECISIONS.inc(path='content')
+        content_verdict = subtitle_stream_verdict(video_file, i, duration)
+        return content_verdict['simplified'], content_verdict['traditional']
+    
+    if not _should_verify(video_file, i):
+        CLASSIFICATION_DECISIONS.inc(path='metadata')
+        return verdict['simplified'], verdict['traditional']
+    
+    # 抽查：内容判断结果明确且与标签不一致时以内容为准
+    CLASSIFICATION_DECISIONS.inc(path='verified')
+    content_verdict = subtitle_stream_verdict(video_file, i, duration)
+    content_decided = content_verdict['simplified'] or content_verdict['traditional']
+    if content_decided and (content_verdict['simplified'], content_verdict['traditional']) != \
+            (verdict['simplified'], verdict['traditional']):
+        METADATA_OVERRULED.inc()
+        print(f"- 字幕流 {i} 的标签与内容不一致，按内容判断")
+        return content_verdict['simplified'], content_verdict['traditional']
+    return verdict['simplified'], verdict['traditional']
+
+def convert_subtitle_text(content, is_ass=None):
+    """把字幕内容转换为简体
+    
+    ASS/SSA 字幕只转换 Dialogue/Comment 行的字段，逐行缓存以文本字段为键（前面的字段含时间，
+    每行都不同）；Style 行只转换样式名，与 Dialogue 行中转换后的样式名保持一致（字体名等不转换）。
+    其他格式逐行转换。纯 ASCII 的行（序号、时间轴、英文）不需要转换。
+    分块转换时由调用方传入 is_ass（按文件开头判断），否则按 content 开头判断。
+    """
+    if is_ass is None:
+        is_ass = '[Script Info]' in content[:1024]
+    cache = _line_cache
+    if cache is None:
+        if not is_ass:
+            return _to_simplified(content)
+        lines = content.split('\n')
+        for i, line in enumerate(lines):
+            if line.startswith(('Dialogue:', 'Comment:')):
+                lines[i] = _to_simplified(line)
+            elif line.startswith('Style:'):
+                lines[i] = _convert_style_name(line)
+        return '\n'.join(lines)
+    
+    lines = content.split('\n')
+    targets = []
+    for i, line in enumerate(lines):
+        prefix, text = '', line
+        if is_ass:
+            if line.startswith('Style:'):
+                lines[i] = _convert_style_name(line)
+                continue
+            if not line.startswith(('Dialogue:', 'Comment:')):
+                continue
+            fields = line.split(',', 9)
+            if len(fields) == 10:
+                prefix, text = ','.join(fields[:9]) + ',', fields[9]
+                # 说话人等字段中偶尔也有中文
+                if not prefix.isascii():
+                    prefix = _to_simplified(prefix)
+        if text.isascii():
+            if prefix:
+                lines[i] = prefix + text
+            continue
+        targets.append((i, prefix, text))
+    
+    converted = _convert_cached(cache, [text for _, _, text in targets])
+    for (i, prefix, _), text in zip(targets, converted):
+        lines[i] = prefix + text
+    return '\n'.join(lines)
+
+def _convert_style_name(line):
+    """转换 ASS Style 行的样式名（第一个字段），其余字段（字体名等）保持不变"""
+    name, sep, rest = line.partition(',')
+    if name.isascii():
+        return line
+    return _to_simplified(name) + sep + rest
+
+def _convert_cached(cache, texts):
+    """用逐行缓存转换一组文本，并更新缓存命中指标"""
+    converted, hits, misses = cache.convert_many(texts, _to_simplified)
+    if hits:
+        LINE_CACHE_LOOKUPS.inc(hits, result='hit')
+    if misses:
+        LINE_CACHE_LOOKUPS.inc(misses, result='miss')
+    LINE_CACHE_HIT_RATIO.set(cache.hit_rate())
+    LINE_CACHE_ENTRIES.set(len(cache))
+    return converted
+
+def convert_block_texts(texts, kind):
+    """转换 MKV 字幕块中的文本（原地转换使用）
+    
+    SRT 块只有字幕文本；ASS 块为 ReadOrder,Layer,Style,Name,MarginL,MarginR,MarginV,Effect,Text，
+    与 Dialogue 行一样转换文本字段（说话人等字段有中文时也转换）。纯 ASCII 的文本不转换。
+    样式定义在 CodecPrivate 中，原地转换不修改，所以 Style 字段保持原样，否则会引用不存在的样式。
+    """
+    prefixes = []
+    bodies = []
+    for text in texts:
+        prefix = ''
+        if kind == 'ass':
+            fields = text.split(',', 8)
+            if len(fields) == 9:
+                if not ','.join(fields[3:8]).isascii():
+                    fields[3:8] = [_to_simplified(field) for field in fields[3:8]]
+                prefix, text = ','.join(fields[:8]) + ',', fields[8]
+        prefixes.append(prefix)
+        bodies.append(text)
+    
+    targets = [i for i, text in enumerate(bodies) if not text.isascii()]
+    cache = _line_cache
+    if cache is None:
+        converted = [_to_simplified(bodies[i]) for i in targets]
+    else:
+        converted = _convert_cached(cache, [bodies[i] for i in targets])
+    for i, text in zip(targets, converted):
+        bodies[i] = text
+    return [prefix + text for prefix, text in zip(prefixes, bodies)]
 
 def convert_traditional_to_simplified(input_file, output_file):
-    """将繁体字幕转换为简体字幕，使用zhconv库"""
+    """将繁体字幕转换为简体字幕，使用zhconv库
+    
+    ASS/SSA 字幕只转换 Dialogue/Comment 行和样式名，保留样式中的字体名等设置不变。
+    按 CONVERT_CHUNK_CHARS 个字符（整行）分块读取、转换和写入，每块在字幕内存预算中预留，
+    内存占用与字幕文件大小无关。
+    """
     try:
         # 检查输入文件
         if not os.path.exists(input_file):
@@ -239,196 +964,571 @@ def convert_traditional_to_simplified(input_file, output_file):
             print("输入文件为空")
             return False
         
-        with open(input_file, 'r', encoding='utf-8', errors='ignore') as f:
-            content = f.read()
+        input_size = os.path.getsize(input_file)
+        has_text = False
+        try:
+            with open(input_file, 'r', encoding='utf-8', errors='ignore') as src, \
+                    open(output_file, 'w', encoding='utf-8') as dst:
+                is_ass = '[Script Info]' in src.read(1024)
+                src.seek(0)
+                # 使用zhconv进行繁体转简体（重复出现的行使用逐行缓存）
+                with _stage('conversion'):
+                    while True:
+                        with _reserve_subtitle_memory(min(input_size, CONVERT_CHUNK_CHARS * 4)):
+                            chunk = ''.join(src.readlines(CONVERT_CHUNK_CHARS))
+                            if not chunk:
+                                break
+                            has_text = has_text or bool(chunk.strip())
+                            dst.write(convert_subtitle_text(chunk, is_ass=is_ass))
+        except Exception:
+            # 不留下转换了一半的输出文件
+            if os.path.exists(output_file):
+                os.remove(output_file)
+            raise
         
-        if not content.strip():
+        if not has_text:
+            os.remove(output_file)
             print("输入文件内容为空")
             return False
-            
-        # 使用zhconv进行繁体转简体
-        simplified_content = zhconv.convert(content, 'zh-cn')
         
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write(simplified_content)
-            
+        _record_io('conversion', bytes_read=input_size, bytes_written=os.path.getsize(output_file))
         return True
     except Exception as e:
         print(f"转换失败: {str(e)}")
         return False
 
-def process_single_video(video_file, replace_original=False, output_suffix="_simplified", backup_original=True):
+def convert_subtitle_file(input_file, output_file):
+    """转换字幕文件；内容相同的字幕直接使用缓存的转换结果"""
+    cache = _subtitle_cache
+    if cache is None:
+        return convert_traditional_to_simplified(input_file, output_file)
+    
+    digest = hash_file(input_file)
+    if cache.fetch_converted(digest, output_file):
+        SUBTITLE_CACHE_LOOKUPS.inc(kind='converted', result='hit')
+        _record_io('conversion_cache', bytes_read=os.path.getsize(output_file))
+        print(f"- 使用缓存的转换结果: {digest[:12]}")
+        return True
+    
+    SUBTITLE_CACHE_LOOKUPS.inc(kind='converted', result='miss')
+    if not convert_traditional_to_simplified(input_file, output_file):
+        return False
+    cache.store_converted(digest, output_file)
+    return True
+
+def subtitle_extension(stream):
+    """返回文本字幕流提取时使用的文件扩展名，图形字幕返回 None"""
+    codec_name = (stream.get("codec_name") or "").lower()
+    if codec_name in BITMAP_SUBTITLE_CODECS:
+        return None
+    return TEXT_SUBTITLE_EXTENSIONS.get(codec_name, "srt")
+
+def simplified_track_title(title):
+    """根据繁体字幕流的标题生成简体字幕流的标题"""
+    if not title:
+        return "简体中文"
+    new_title = title
+    for traditional_marker, simplified_marker in TITLE_MARKERS:
+        new_title = new_title.replace(traditional_marker, simplified_marker)
+    new_title = _to_simplified(new_title)
+    if new_title == title:
+        new_title = f"{title} (简体)"
+    return new_title
+
+def _inplace_track_title(title):
+    """原地转换后字幕轨的标题：标题中有繁体标记时改为简体标记，否则不修改（返回 None）"""
+    if not title or not TRADITIONAL_TAG_PATTERN.search(title):
+        return None
+    return simplified_track_title(title)
+
+def convert_in_place(video_file, subtitle_streams, indices, output_file, backup_file=None):
+    """在 MKV 中原地把繁体字幕轨转换为简体（mkv_inplace），只写入字幕数据
+    
+    output_file 与 video_file 相同时直接修改原文件（backup_file 不为 None 且不存在时先备份），
+    否则先复制一份（文件系统支持时使用 reflink/copy_file_range，不经过本进程读写）再修改副本。
+    
+    扫描结果包含所选字幕轨的全部字幕块，按字幕流的 NUMBER_OF_BYTES 标签在字幕内存预算中预留
+    （没有标签时扫描后按实际大小预留）。
+    
+    Returns:
+        是否已转换；无法原地转换时返回 False，此时没有修改或创建任何文件
+    """
+    if os.path.splitext(video_file)[1].lower() not in INPLACE_EXTENSIONS:
+        return False
+    estimate = sum(_estimated_subtitle_bytes(subtitle_streams[i]) for i in indices)
+    with _reserve_subtitle_memory(estimate):
+        try:
+            with _stage('inplace_scan'):
+                plan = mkv_inplace.plan_conversion(
+                    video_file, indices, [stream.get('codec_name') for stream in subtitle_streams],
+                    convert_block_texts, retitle=_inplace_track_title, relabel=SIMPLIFIED_LANGUAGE_EQUIVALENTS)
+        except mkv_inplace.InPlaceError as e:
+            print(f"- 无法原地转换: {str(e)}")
+            return False
+        with _reserve_subtitle_memory(0 if estimate else plan.subtitle_bytes):
+            return _apply_in_place(video_file, plan, output_file, backup_file)
+
+def _apply_in_place(video_file, plan, output_file, backup_file=None):
+    """按 plan_conversion 的结果写入 output_file（必要时先备份或复制视频）"""
+    _record_io('inplace_scan', bytes_read=plan.bytes_scanned)
+    process_result = getattr(_current, 'result', None)
+    if process_result is not None:
+        process_result.subtitle_bytes += plan.subtitle_bytes
+    
+    limits = getattr(_current, 'io_limits', None)
+    _check_abort()
+    if output_file == video_file:
+        if backup_file is not None and not os.path.exists(backup_file):
+            try:
+                with _stage('backup'):
+                    method = mkv_inplace.clone_file(video_file, backup_file, copy=_copy_file,
+                                                    kernel_copy=limits is None or not limits.throttled)
+            except Exception:
+                # 不完整的备份会让下次处理误以为已经备份过
+                if os.path.exists(backup_file):
+                    os.remove(backup_file)
+                raise
+            backup_size = os.path.getsize(backup_file)
+            copied = backup_size if method != 'reflink' else 0
+            _record_io('backup', bytes_read=copied, bytes_written=copied)
+            print(f"- 已备份原文件（{method}）: {os.path.basename(backup_file)}")
+    
+    try:
+        if output_file != video_file:
+            with _stage('clone'):
+                method = mkv_inplace.clone_file(video_file, output_file, copy=_copy_file,
+                                                kernel_copy=limits is None or not limits.throttled)
+            copied = os.path.getsize(output_file) if method != 'reflink' else 0
+            _record_io('clone', bytes_read=copied, bytes_written=copied)
+            print(f"- 已复制视频（{method}）")
+        _check_abort()
+        with _stage('inplace'):
+            mkv_inplace.apply_plan(output_file, plan)
+    except Exception:
+        # 复制或写入失败（包括中止）时删除不完整的输出文件
+        if output_file != video_file and os.path.exists(output_file):
+            os.remove(output_file)
+        raise
+    _record_io('inplace', bytes_written=plan.bytes_written)
+    print(f"- 已原地转换 {len(plan.tracks)} 个字幕流（{plan.blocks} 个字幕块，写入 {plan.bytes_written} 字节）")
+    return True
+
+def extract_subtitle_tracks(video_file, tracks):
+    """一次ffmpeg调用提取多条字幕流（只读取一遍视频文件）
+    
+    Args:
+        video_file: 视频文件路径
+        tracks: [(字幕流序号, 输出文件路径), ...]
+    """
+    ffmpeg_cmd = "ffmpeg.exe" if sys.platform.startswith('win') else "ffmpeg"
+    cmd = [ffmpeg_cmd, "-i", video_file]
+    for subtitle_index, output_file in tracks:
+        ext = os.path.splitext(output_file)[1].lstrip('.')
+        cmd.extend(["-map", f"0:s:{subtitle_index}", "-c:s", SUBTITLE_ENCODERS[ext], "-y", output_file])
+    
+    with _stage('extraction'):
+        result = _run_ffmpeg(cmd, timeout=120)
+    if result.returncode != 0:
+        print(f"- 提取字幕失败: {result.stderr}")
+        print(f"- 命令: {' '.join(cmd)}")
+        return False
+    
+    written = 0
+    for _, output_file in tracks:
+        if not os.path.exists(output_file) or os.path.getsize(output_file) == 0:
+            print(f"- 提取的字幕文件为空或不存在: {output_file}")
+            return False
+        written += os.path.getsize(output_file)
+    _record_io('extraction', bytes_read=os.path.getsize(video_file), bytes_written=written)
+    return True
+
+def remux_with_simplified_tracks(video_file, new_tracks, output_file, existing_subtitle_count):
+    """一次ffmpeg调用重新封装：复制原有的全部流（含其他字幕和附件字体），追加简体字幕流
+    
+    Args:
+        video_file: 原视频文件
+        new_tracks: [(简体字幕文件, 标题), ...]
+        output_file: 输出文件
+        existing_subtitle_count: 原有字幕流数量，新字幕流的序号从这里开始
+    """
+    ffmpeg_cmd = "ffmpeg.exe" if sys.platform.startswith('win') else "ffmpeg"
+    cmd = [ffmpeg_cmd, "-i", video_file]
+    for subtitle_file, _ in new_tracks:
+        cmd.extend(["-i", subtitle_file])
+    
+    cmd.extend(["-map", "0"])
+    for input_index in range(1, len(new_tracks) + 1):
+        cmd.extend(["-map", f"{input_index}:0"])
+    cmd.extend(["-c", "copy"])
+    
+    is_mp4 = os.path.splitext(output_file)[1].lower() in MP4_EXTENSIONS
+    for offset, (_, title) in enumerate(new_tracks):
+        stream_index = existing_subtitle_count + offset
+        if is_mp4:
+            # MP4 只支持 mov_text 字幕
+            cmd.extend([f"-c:s:{stream_index}", "mov_text"])
+        cmd.extend([f"-metadata:s:s:{stream_index}", "language=chi"])
+        cmd.extend([f"-metadata:s:s:{stream_index}", f"title={title}"])
+    cmd.extend(["-y", output_file])
+    
+    with _stage('remux'):
+        result = _run_ffmpeg(cmd, timeout=300)
+    if result.returncode != 0:
+        print(f"- 视频封装失败: {result.stderr}")
+        print(f"- 命令: {' '.join(cmd)}")
+        return False
+    
+    subtitle_bytes = sum(os.path.getsize(subtitle_file) for subtitle_file, _ in new_tracks)
+    _record_io('remux', bytes_read=os.path.getsize(video_file) + subtitle_bytes,
+               bytes_written=os.path.getsize(output_file))
+    return True
+
+def sidecar_subtitle_path(base_name, ext, number=1):
+    """视频旁的简体外挂字幕路径：Episode.chs.srt，多个时为 Episode.chs.2.srt"""
+    if number == 1:
+        return f"{base_name}.{SIMPLIFIED_SIDECAR_TAG}.{ext}"
+    return f"{base_name}.{SIMPLIFIED_SIDECAR_TAG}.{number}.{ext}"
+
+def simplified_sidecar_path(subtitle_file):
+    """繁体外挂字幕对应的简体文件路径（如 .cht.srt → .chs.srt），不是繁体外挂字幕时返回 None"""
+    stem, ext = os.path.splitext(subtitle_file)
+    if ext.lower() not in SIDECAR_EXTENSIONS:
+        return None
+    stem_base, tag = os.path.splitext(stem)
+    simplified_tag = SIDECAR_LANGUAGE_TAGS.get(tag.lstrip('.').lower())
+    if not stem_base or simplified_tag is None:
+        return None
+    return f"{stem_base}.{simplified_tag}{ext}"
+
+def is_traditional_sidecar(filename):
+    """文件名是否为带繁体语言标记的外挂字幕"""
+    return simplified_sidecar_path(filename) is not None
+
+def write_sidecar_files(base_name, subtitle_files):
+    """把转换好的简体字幕复制到视频旁，返回写入的文件列表"""
+    import shutil
+    written = []
+    counters = {}
+    for subtitle_file in subtitle_files:
+        ext = os.path.splitext(subtitle_file)[1].lstrip('.')
+        counters[ext] = counters.get(ext, 0) + 1
+        sidecar_file = sidecar_subtitle_path(base_name, ext, counters[ext])
+        shutil.copyfile(subtitle_file, sidecar_file)
+        _record_io('sidecar', bytes_written=os.path.getsize(sidecar_file))
+        written.append(sidecar_file)
+    return written
+
+def process_sidecar_subtitle(subtitle_file, dry_run=False):
+    """转换已有的繁体外挂字幕（如 Episode.cht.srt → Episode.chs.srt），不读取视频文件
+    
+    dry_run 为 True 时只判断是否需要转换，不写入文件。
+    """
+    process_result = ProcessResult(subtitle_file, dry_run=dry_run)
+    if not os.path.isfile(subtitle_file):
+        print(f"文件不存在: {subtitle_file}")
+        return process_result.finish(OUTCOME_NOT_FOUND, f"文件不存在: {subtitle_file}")
+    
+    output_file = simplified_sidecar_path(subtitle_file)
+    if output_file is None:
+        return process_result.finish(OUTCOME_ERROR, f"不是繁体外挂字幕: {os.path.basename(subtitle_file)}")
+    
+    print(f"正在处理外挂字幕: {os.path.basename(subtitle_file)}")
+    process_result.output_file = output_file
+    if os.path.exists(output_file):
+        print(f"- 简体字幕已存在，跳过: {os.path.basename(output_file)}")
+        return process_result.finish(OUTCOME_OUTPUT_EXISTS, f"简体字幕已存在，跳过: {os.path.basename(output_file)}")
+    
+    _current.result = process_result
+    try:
+        # 只读取开头部分判断是否包含繁体字
+        with _stage('classification'):
+            with open(subtitle_file, 'r', encoding='utf-8', errors='ignore') as f:
+                sample_text = f.read(64 * 1024)
+            is_traditional = classify_sample_text(sample_text)['traditional']
+        if not is_traditional:
+            print("- 未发现繁体字，跳过处理")
+            return process_result.finish(OUTCOME_NO_TRADITIONAL, "外挂字幕未发现繁体字，跳过处理")
+        
+        process_result.subtitle_bytes = os.path.getsize(subtitle_file)
+        if dry_run:
+            process_result.estimated_rewrite_bytes = process_result.subtitle_bytes
+            return process_result.finish(OUTCOME_CONVERTED, f"将转换为 {os.path.basename(output_file)}")
+        _check_abort()
+        if not convert_subtitle_file(subtitle_file, output_file):
+            return process_result.finish(OUTCOME_ERROR, "字幕转换失败")
+        
+        process_result.sidecar_files = [output_file]
+        print(f"- 完成: {os.path.basename(output_file)}")
+        return process_result.finish(OUTCOME_CONVERTED, "视频处理完成")
+    except Exception as e:
+        print(f"- 处理外挂字幕时发生错误: {str(e)}")
+        return process_result.finish(OUTCOME_ERROR, f"处理外挂字幕时发生错误: {str(e)}")
+    finally:
+        _current.result = None
+
+def _estimated_subtitle_bytes(stream):
+    """字幕流的数据量（MKV 的统计标签 NUMBER_OF_BYTES），未知时返回 0"""
+    for key, value in stream.get("tags", {}).items():
+        if key.upper().startswith("NUMBER_OF_BYTES"):
+            try:
+                return int(value)
+            except (TypeError, ValueError):
+                return 0
+    return 0
+
+def uses_inplace(video_file, output_mode="remux", remux_engine="ffmpeg"):
+    """是否尝试原地转换：inplace 方式、只重新封装（不写外挂字幕）的 MKV 文件"""
+    return (remux_engine == 'inplace' and output_mode == 'remux' and
+            os.path.splitext(video_file)[1].lower() in INPLACE_EXTENSIONS)
+
+def estimate_remux_bytes(video_file, replace_original=False, backup_original=True, output_mode="remux"):
+    """估算重新封装需要在视频所在磁盘上写入的字节数（不含外挂字幕等小文件）
+    
+    重新封装写一份完整的视频；替换原文件且还没有备份时再复制一份备份。
+    原地转换也按同样的量预留：无法原地转换时会改用 ffmpeg 重新封装。
+    """
+    if output_mode == 'sidecar' or is_traditional_sidecar(video_file):
+        return 0
+    try:
+        file_size = os.path.getsize(video_file)
+    except OSError:
+        return 0
+    base_name, file_ext = os.path.splitext(video_file)
+    if replace_original and backup_original and not os.path.exists(f"{base_name}_backup{file_ext}"):
+        return file_size * 2
+    return file_size
+
+def throughput_kind(output_mode="remux", remux_engine="ffmpeg"):
+    """吞吐量历史中对应的处理方式：remux、sidecar 或 inplace"""
+    if output_mode == 'sidecar':
+        return 'sidecar'
+    return 'inplace' if remux_engine == 'inplace' and output_mode == 'remux' else 'remux'
+
+def process_single_video(video_file, replace_original=False, output_suffix="_simplified", backup_original=True,
+                         output_mode="remux", dry_run=False, remux_engine="ffmpeg"):
     """处理单个视频文件
     
+    为每个繁体字幕流生成对应的简体字幕流，并在一次重新封装中保留原有的全部流和附件。
+    sidecar 模式只在视频旁写入 Episode.chs.srt 等外挂字幕，不改写视频文件。
+    
     Args:
         video_file: 视频文件路径
         replace_original: 是否替换原文件
         output_suffix: 输出文件后缀
         backup_original: 是否备份原文件
+        output_mode: 输出方式 remux/sidecar/both
+        dry_run: 只分析字幕流并估算需要写入的字节数，不提取、不转换、不封装
+        remux_engine: ffmpeg 完整重新封装并追加简体字幕流；inplace 在 MKV 中原地把繁体字幕轨转换为简体
+            （只用于 remux 模式，无法原地转换时改用 ffmpeg）
+    
+    Returns:
+        ProcessResult: 处理结果（原因、各阶段耗时、字幕数据量、选择的字幕流）
     """
+    process_result = ProcessResult(video_file, dry_run=dry_run)
+    
     # 检查文件是否存在
     if not os.path.exists(video_file):
         print(f"文件不存在: {video_file}")
-        return False
+        return process_result.finish(OUTCOME_NOT_FOUND, f"文件不存在: {video_file}")
     
     # 检查是否为文件
     if not os.path.isfile(video_file):
         print(f"不是有效文件: {video_file}")
-        return False
+        return process_result.finish(OUTCOME_NOT_FOUND, f"不是有效文件: {video_file}")
+    
+    if output_mode not in OUTPUT_MODES:
+        print(f"不支持的输出方式: {output_mode}")
+        return process_result.finish(OUTCOME_ERROR, f"不支持的输出方式: {output_mode}")
+    if remux_engine not in REMUX_ENGINES:
+        print(f"不支持的封装方式: {remux_engine}")
+        return process_result.finish(OUTCOME_ERROR, f"不支持的封装方式: {remux_engine}")
+    write_remux = output_mode in ('remux', 'both')
+    write_sidecar = output_mode in ('sidecar', 'both')
     
     print(f"正在处理: {os.path.basename(video_file)}")
     
     # 清理可能遗留的临时文件
     cleanup_orphaned_temp_files()
     
-    # 临时文件名（使用时间戳和随机数避免冲突）
+    # 临时文件名前缀（使用时间戳和随机数避免冲突）
     timestamp = int(time.time() * 1000)  # 毫秒时间戳
     random_id = random.randint(1000, 9999)
-    temp_traditional_subtitle = f"temp_traditional_{timestamp}_{random_id}.srt"
-    temp_simplified_subtitle = f"temp_simplified_{timestamp}_{random_id}.srt"
+    temp_prefix = f"{timestamp}_{random_id}"
+    temp_files_to_clean = []
     
+    # 创建新的视频文件名
+    base_name = os.path.splitext(video_file)[0]
+    file_ext = os.path.splitext(video_file)[1]
+    if replace_original:
+        # 使用临时文件名，避免FFmpeg无法覆盖原文件的问题
+        temp_output_file = f"{base_name}_temp_output{file_ext}"
+        new_video_file = video_file  # 最终目标文件名
+    else:
+        # 创建带后缀的新文件名
+        new_video_file = f"{base_name}{output_suffix}{file_ext}"
+        temp_output_file = new_video_file
+    
+    _current.result = process_result
     try:
-        # 分析字幕流
-        subtitle_streams, has_simplified, traditional_indices = analyze_subtitle_streams(video_file)
+        # 检查输出文件是否已存在（在分析字幕之前检查，避免无用的提取和转换）
+        if write_remux and os.path.exists(new_video_file) and not replace_original:
+            print(f"- 输出文件已存在，跳过: {os.path.basename(new_video_file)}")
+            process_result.output_file = new_video_file
+            return process_result.finish(OUTCOME_OUTPUT_EXISTS, f"输出文件已存在，跳过: {os.path.basename(new_video_file)}")
+        if not write_remux:
+            existing_sidecars = glob.glob(f"{glob.escape(base_name)}.{SIMPLIFIED_SIDECAR_TAG}.*")
+            if existing_sidecars:
+                print(f"- 简体外挂字幕已存在，跳过: {os.path.basename(existing_sidecars[0])}")
+                process_result.output_file = existing_sidecars[0]
+                return process_result.finish(OUTCOME_OUTPUT_EXISTS,
+                                             f"简体外挂字幕已存在，跳过: {os.path.basename(existing_sidecars[0])}")
+        
+        # 分析字幕流（失败时按错误处理，不记录为跳过）
+        try:
+            subtitle_streams, has_simplified, traditional_indices = analyze_subtitle_streams(video_file)
+        except Exception as e:
+            print(f"- 分析字幕流失败: {str(e)}")
+            return process_result.finish(OUTCOME_ERROR, f"分析字幕流失败: {str(e)}")
+        
+        process_result.subtitle_stream_count = len(subtitle_streams)
+        process_result.traditional_indices = list(traditional_indices)
         
         if not subtitle_streams:
             print("- 未找到字幕流，无需处理")
-            return False
+            return process_result.finish(OUTCOME_NO_SUBTITLES, "未找到字幕流，无需处理")
         
         print(f"- 发现 {len(subtitle_streams)} 个字幕流")
         
         # 如果已有简体字幕，跳过处理
         if has_simplified:
             print("- 已包含简体中文字幕，跳过处理")
-            return False
+            return process_result.finish(OUTCOME_ALREADY_SIMPLIFIED, "已包含简体中文字幕，跳过处理")
         
         # 如果没有繁体字幕，也跳过处理
         if not traditional_indices:
             print("- 未发现包含繁体字的字幕流，跳过处理")
-            return False
+            return process_result.finish(OUTCOME_NO_TRADITIONAL, "未发现包含繁体字的字幕流，跳过处理")
         
         print(f"- 发现 {len(traditional_indices)} 个包含繁体字的字幕流")
         
-        # 选择第一个繁体字幕流进行处理
-        traditional_index = traditional_indices[0]
-        print(f"- 选择字幕流 {traditional_index} 进行转换")
+        # 选择所有可以提取为文本的繁体字幕流（图形字幕无法转换）
+        extract_tracks = []
+        for traditional_index in traditional_indices:
+            ext = subtitle_extension(subtitle_streams[traditional_index])
+            if ext is None:
+                print(f"- 字幕流 {traditional_index} 为图形字幕，无法转换")
+                continue
+            temp_file = f"temp_traditional_{temp_prefix}_{traditional_index}.{ext}"
+            temp_files_to_clean.append(temp_file)
+            extract_tracks.append((traditional_index, temp_file))
         
-        # 获取ffmpeg路径
-        ffmpeg_cmd = "ffmpeg.exe" if sys.platform.startswith('win') else "ffmpeg"
+        if not extract_tracks:
+            print("- 没有可转换的文本字幕流，跳过处理")
+            return process_result.finish(OUTCOME_NO_TRADITIONAL, "繁体字幕均为图形字幕，无法转换")
         
-        # 提取繁体字幕
-        cmd = [
-            ffmpeg_cmd,
-            "-i", video_file,
-            "-map", f"0:s:{traditional_index}",
-            "-y",  # 覆盖输出
-            temp_traditional_subtitle
-        ]
+        process_result.selected_indices = [index for index, _ in extract_tracks]
+        print(f"- 选择字幕流 {', '.join(str(index) for index, _ in extract_tracks)} 进行转换")
         
-        # 执行命令，指定编码为utf-8
-        result = subprocess.run(cmd, capture_output=True, timeout=120, text=True, encoding="utf-8")
-            
-        if result.returncode != 0:
-            print(f"- 提取字幕失败: {result.stderr}")
-            print(f"- 命令: {' '.join(cmd)}")
-            return False
-            
-        if not os.path.exists(temp_traditional_subtitle) or os.path.getsize(temp_traditional_subtitle) == 0:
-            print("- 提取的字幕文件为空或不存在")
-            return False
+        remux_bytes = estimate_remux_bytes(video_file, replace_original, backup_original, output_mode)
+        if dry_run:
+            # 估算实际处理需要写入的数据量：重新封装写一遍视频，替换原文件时备份再复制一遍
+            rewrite_bytes = remux_bytes
+            if uses_inplace(video_file, output_mode, remux_engine) and replace_original:
+                # 原地转换只覆盖字幕数据（和复制备份）
+                rewrite_bytes = remux_bytes - os.path.getsize(video_file) + sum(
+                    _estimated_subtitle_bytes(subtitle_streams[index]) for index in process_result.selected_indices)
+            if write_sidecar:
+                rewrite_bytes += sum(_estimated_subtitle_bytes(subtitle_streams[index])
+                                     for index in process_result.selected_indices)
+            process_result.estimated_rewrite_bytes = rewrite_bytes
+            process_result.output_file = new_video_file if write_remux else None
+            return process_result.finish(
+                OUTCOME_CONVERTED,
+                f"将转换字幕流 {', '.join(str(index) for index in process_result.selected_indices)}")
         
+        # 写入前检查磁盘空间，避免写到一半才失败
+        if remux_bytes:
+            import shutil
+            free_bytes = shutil.disk_usage(os.path.dirname(os.path.abspath(video_file))).free
+            if free_bytes < remux_bytes:
+                return process_result.finish(
+                    OUTCOME_ERROR,
+                    f"磁盘空间不足: 需要 {remux_bytes / (1024 * 1024 * 1024):.2f}GB，"
+                    f"剩余 {free_bytes / (1024 * 1024 * 1024):.2f}GB")
+        
+        # MKV 原地转换：只覆盖字幕块，不重新封装整个视频；无法原地转换时继续用 ffmpeg
+        if uses_inplace(video_file, output_mode, remux_engine):
+            backup_file = f"{base_name}_backup{file_ext}" if replace_original and backup_original else None
+            if convert_in_place(video_file, subtitle_streams, process_result.selected_indices, new_video_file,
+                                backup_file):
+                print(f"- 完成: {os.path.basename(new_video_file)}")
+                process_result.output_file = new_video_file
+                return process_result.finish(OUTCOME_CONVERTED, "视频处理完成（原地转换字幕）")
+            print("- 改用 ffmpeg 重新封装")
+        
+        # 提取繁体字幕
+        if not extract_subtitle_tracks(video_file, extract_tracks):
+            return process_result.finish(OUTCOME_ERROR, "提取字幕失败")
+        
+        process_result.subtitle_bytes += sum(os.path.getsize(temp_file) for _, temp_file in extract_tracks)
         print("- 繁体字幕提取完成")
         
         # 转换为简体
-        if not convert_traditional_to_simplified(temp_traditional_subtitle, temp_simplified_subtitle):
-            print("- 字幕转换失败")
-            return False
-        
-        # 验证转换后的文件是否存在且不为空
-        if not os.path.exists(temp_simplified_subtitle) or os.path.getsize(temp_simplified_subtitle) == 0:
-            print("- 转换后的字幕文件为空或不存在")
-            return False
+        new_tracks = []
+        for traditional_index, temp_traditional_subtitle in extract_tracks:
+            ext = os.path.splitext(temp_traditional_subtitle)[1]
+            temp_simplified_subtitle = f"temp_simplified_{temp_prefix}_{traditional_index}{ext}"
+            temp_files_to_clean.append(temp_simplified_subtitle)
+            
+            if not convert_subtitle_file(temp_traditional_subtitle, temp_simplified_subtitle):
+                print("- 字幕转换失败")
+                return process_result.finish(OUTCOME_ERROR, "字幕转换失败")
+            
+            # 验证转换后的文件是否存在且不为空
+            if not os.path.exists(temp_simplified_subtitle) or os.path.getsize(temp_simplified_subtitle) == 0:
+                print("- 转换后的字幕文件为空或不存在")
+                return process_result.finish(OUTCOME_ERROR, "转换后的字幕文件为空或不存在")
+            
+            title = simplified_track_title(subtitle_streams[traditional_index].get("tags", {}).get("title", ""))
+            new_tracks.append((temp_simplified_subtitle, title))
         
         print("- 简体字幕转换完成")
         
-        # 创建新的视频文件名
-        base_name = os.path.splitext(video_file)[0]
-        file_ext = os.path.splitext(video_file)[1]
+        # 写入外挂字幕（只需几KB的写入，不改写视频）
+        if write_sidecar:
+            _check_abort()
+            process_result.sidecar_files = write_sidecar_files(base_name, [subtitle_file for subtitle_file, _ in new_tracks])
+            print(f"- 已写入外挂字幕: {', '.join(os.path.basename(path) for path in process_result.sidecar_files)}")
+            if not write_remux:
+                process_result.output_file = process_result.sidecar_files[0]
+                return process_result.finish(OUTCOME_CONVERTED, "视频处理完成")
         
         if replace_original:
+            _check_abort()
             # 如果要替换原文件，先备份原文件
             if backup_original:
                 backup_file = f"{base_name}_backup{file_ext}"
                 if not os.path.exists(backup_file):
                     try:
-                        import shutil
-                        shutil.copy2(video_file, backup_file)
+                        with _stage('backup'):
+                            _copy_file(video_file, backup_file)
+                        backup_size = os.path.getsize(backup_file)
+                        _record_io('backup', bytes_read=backup_size, bytes_written=backup_size)
                         print(f"- 已备份原文件: {os.path.basename(backup_file)}")
                     except Exception as e:
                         print(f"- 备份原文件失败: {str(e)}")
-                        return False
+                        return process_result.finish(OUTCOME_ERROR, f"备份原文件失败: {str(e)}")
                 else:
                     print(f"- 备份文件已存在: {os.path.basename(backup_file)}")
-            
-            # 使用临时文件名，避免FFmpeg无法覆盖原文件的问题
-            temp_output_file = f"{base_name}_temp_output{file_ext}"
-            new_video_file = video_file  # 最终目标文件名
-        else:
-            # 创建带后缀的新文件名
-            new_video_file = f"{base_name}{output_suffix}{file_ext}"
-            temp_output_file = new_video_file
-        
-        # 检查输出文件是否已存在
-        if os.path.exists(new_video_file) and not replace_original:
-            print(f"- 输出文件已存在，跳过: {os.path.basename(new_video_file)}")
-            return False
-        
-        # 获取视频和音频流信息，用于保留这些流
-        video_audio_maps = []
-        try:
-            ffprobe_cmd = "ffprobe.exe" if sys.platform.startswith('win') else "ffprobe"
-            cmd = [
-                ffprobe_cmd, 
-                "-v", "quiet", 
-                "-print_format", "json", 
-                "-show_streams", 
-                video_file
-            ]
-            result = subprocess.run(cmd, capture_output=True, timeout=30, text=True, encoding="utf-8")
-            streams_info = json.loads(result.stdout)
-            
-            for i, stream in enumerate(streams_info.get("streams", [])):
-                if stream.get("codec_type") in ["video", "audio"]:
-                    video_audio_maps.extend(["-map", f"0:{i}"])
-        except Exception as e:
-            print(f"- 获取音视频流信息出错: {str(e)}")
-            return False
-        
-        # 添加新的简体中文字幕
-        video_audio_maps.extend(["-map", "1:s"])
-        
-        # 重新封装视频 - 删除所有原有字幕流，只保留音视频流和新的简体字幕
-        cmd = [
-            ffmpeg_cmd,
-            "-i", video_file,
-            "-i", temp_simplified_subtitle
-        ] + video_audio_maps + [
-            "-c", "copy",   # 复制所有流，不重新编码
-            "-metadata:s:s:0", "language=chi",  # 设置字幕语言为中文
-            "-y",  # 覆盖输出
-            temp_output_file
-        ]
+            temp_files_to_clean.append(temp_output_file)
         
-        print("- 正在封装视频（删除原有字幕，添加简体字幕）...")
-        # 执行命令，指定编码为utf-8
-        result = subprocess.run(cmd, capture_output=True, timeout=300, text=True, encoding="utf-8")
-            
-        if result.returncode != 0:
-            print(f"- 视频封装失败: {result.stderr}")
-            print(f"- 命令: {' '.join(cmd)}")
-            return False
+        # 重新封装视频 - 保留全部原有流和附件，追加简体字幕
+        print(f"- 正在封装视频（保留原有流，添加 {len(new_tracks)} 个简体字幕流）...")
+        if not remux_with_simplified_tracks(video_file, new_tracks, temp_output_file, len(subtitle_streams)):
+            return process_result.finish(OUTCOME_ERROR, "视频封装失败")
         
-        # 如果需要替换原文件，先删除原文件，然后重命名临时文件
+        # 如果需要替换原文件，先删除原文件，然后重命名临时文件；处理已中止（其他节点可能在处理同一文件）时不替换
+        _check_abort()
         if replace_original:
             try:
                 import shutil
@@ -439,26 +1539,18 @@ def process_single_video(video_file, replace_original=False, output_suffix="_sim
                 print(f"- 完成: 已替换原文件 {os.path.basename(new_video_file)}")
             except Exception as e:
                 print(f"- 替换原文件失败: {str(e)}")
-                # 清理临时文件
-                if os.path.exists(temp_output_file):
-                    try:
-                        os.remove(temp_output_file)
-                    except:
-                        pass
-                return False
+                return process_result.finish(OUTCOME_ERROR, f"替换原文件失败: {str(e)}")
         else:
             print(f"- 完成: {os.path.basename(new_video_file)}")
-        return True
+        process_result.output_file = new_video_file
+        return process_result.finish(OUTCOME_CONVERTED, "视频处理完成")
         
     except Exception as e:
         print(f"- 处理文件时发生错误: {str(e)}")
-        return False
+        return process_result.finish(OUTCOME_ERROR, f"处理文件时发生错误: {str(e)}")
     finally:
+        _current.result = None
         # 确保清理临时文件
-        temp_files_to_clean = [temp_traditional_subtitle, temp_simplified_subtitle]
-        if replace_original and 'temp_output_file' in locals():
-            temp_files_to_clean.append(temp_output_file)
-        
         for temp_file in temp_files_to_clean:
             if os.path.exists(temp_file):
                 try:
@@ -466,71 +1558,324 @@ def process_single_video(video_file, replace_original=False, output_suffix="_sim
                 except Exception as e:
                     print(f"清理临时文件失败 {temp_file}: {str(e)}")
 
-def batch_process_videos(folder_path):
-    """批量处理文件夹中的MKV文件"""
+def find_video_files(folder_path, recursive=False, extensions=('.mkv',), patterns=None,
+                     output_suffix="_simplified", include_sidecars=False):
+    """查找文件夹中待处理的视频文件，文件夹无效或没有文件时返回 None
+    
+    Args:
+        folder_path: 文件夹路径
+        recursive: 是否搜索子文件夹
+        extensions: 视频文件扩展名
+        patterns: glob 模式列表（如 "*S01E*"），匹配文件名或相对路径，为空时不过滤
+        output_suffix: 输出文件后缀，已生成的输出文件和备份文件不会再次处理
+        include_sidecars: 是否同时返回繁体外挂字幕（如 Episode.cht.srt）
+    """
     # 检查文件夹是否存在
     if not os.path.exists(folder_path):
         print(f"错误: 文件夹不存在: {folder_path}")
-        return
+        return None
     
     if not os.path.isdir(folder_path):
         print(f"错误: 路径不是文件夹: {folder_path}")
-        return
+        return None
     
-    # 获取所有MKV文件
-    mkv_files = []
-    for file in os.listdir(folder_path):
-        if file.lower().endswith('.mkv'):
-            mkv_files.append(os.path.join(folder_path, file))
+    extensions = tuple(ext.lower() if ext.startswith('.') else f".{ext.lower()}" for ext in extensions)
+    derived_suffixes = tuple(suffix for suffix in (output_suffix, "_backup") if suffix)
     
-    if not mkv_files:
-        print(f"在文件夹 {folder_path} 中未找到MKV文件")
-        return
+    video_files = []
+    for root, dirs, files in os.walk(folder_path):
+        dirs.sort()
+        for file in sorted(files):
+            full_path = os.path.join(root, file)
+            if patterns:
+                rel_path = os.path.relpath(full_path, folder_path)
+                if not any(fnmatch.fnmatch(file, pattern) or fnmatch.fnmatch(rel_path, pattern)
+                           for pattern in patterns):
+                    continue
+            if include_sidecars and is_traditional_sidecar(file):
+                video_files.append(full_path)
+                continue
+            stem, ext = os.path.splitext(file)
+            if ext.lower() not in extensions:
+                continue
+            # 跳过之前生成的 *_simplified.mkv 和 *_backup.mkv
+            if derived_suffixes and stem.endswith(derived_suffixes):
+                continue
+            video_files.append(full_path)
+        if not recursive:
+            break
     
-    print(f"找到 {len(mkv_files)} 个MKV文件")
+    if not video_files:
+        print(f"在文件夹 {folder_path} 中未找到视频文件")
+        return None
     
-    # 检查ffmpeg和ffprobe是否存在
+    print(f"找到 {len(video_files)} 个待处理文件")
+    return video_files
+
+def _check_ffmpeg():
+    """检查ffmpeg和ffprobe是否存在"""
     try:
         ffmpeg_cmd = "ffmpeg.exe" if sys.platform.startswith('win') else "ffmpeg"
         ffprobe_cmd = "ffprobe.exe" if sys.platform.startswith('win') else "ffprobe"
         
         subprocess.run([ffmpeg_cmd, "-version"], check=True, capture_output=True, timeout=10, encoding="utf-8")
         subprocess.run([ffprobe_cmd, "-version"], check=True, capture_output=True, timeout=10, encoding="utf-8")
+        return True
     except Exception as e:
         print(f"错误: 未找到 ffmpeg 或 ffprobe，请确保它们已安装并添加到系统PATH中: {str(e)}")
-        return
+        return False
+
+def process_file(file_path, replace_original=False, output_suffix="_simplified", backup_original=True,
+                 output_mode="remux", dry_run=False, remux_engine="ffmpeg"):
+    """处理一个文件：繁体外挂字幕直接转换，视频文件按 output_mode 输出（与 API 服务相同的流程）"""
+    if is_traditional_sidecar(file_path):
+        return process_sidecar_subtitle(file_path, dry_run=dry_run)
+    return process_single_video(file_path,
+                                replace_original=replace_original,
+                                output_suffix=output_suffix,
+                                backup_original=backup_original,
+                                output_mode=output_mode,
+                                dry_run=dry_run,
+                                remux_engine=remux_engine)
+
+def _run_parallel(files, jobs, func, on_result, disk_bytes=None):
+    """用 jobs 个线程处理 files，每个文件完成时在主线程中调用 on_result(文件, 结果)
+    
+    disk_bytes(文件) 返回处理该文件需要写入的字节数，磁盘放不下时调度器延后处理。
+    Ctrl+C 时取消还没开始的文件，等待正在处理的文件结束。
+    """
+    from job_scheduler import JobScheduler, PRIORITY_BATCH
     
-    # 处理每个文件
-    processed_count = 0
-    error_count = 0
+    scheduler = JobScheduler(max_workers=jobs, reserved_interactive_workers=0)
+    finished = queue.Queue()
     
-    for i, mkv_file in enumerate(mkv_files, 1):
-        print(f"\n[{i}/{len(mkv_files)}] ", end="")
+    def run(file_path):
         try:
-            if process_single_video(mkv_file):
-                processed_count += 1
+            return func(file_path)
+        finally:
+            finished.put(file_path)
+    
+    submitted = {}
+    for file_path in files:
+        submitted[file_path] = scheduler.submit(
+            run, file_path, priority=PRIORITY_BATCH, key=file_path,
+            disk_path=os.path.dirname(os.path.abspath(file_path)) if disk_bytes else None,
+            disk_bytes=disk_bytes(file_path) if disk_bytes else 0)
+    try:
+        for _ in range(len(files)):
+            # 带超时轮询，主线程才能及时响应 Ctrl+C
+            while True:
+                try:
+                    file_path = finished.get(timeout=0.5)
+                    break
+                except queue.Empty:
+                    continue
+            job = submitted[file_path]
+            job.wait()
+            on_result(file_path, job.result)
+    except KeyboardInterrupt:
+        cancelled = sum(1 for job in submitted.values() if scheduler.cancel(job.job_id))
+        print(f"\n用户中断操作，取消 {cancelled} 个未开始的文件，等待正在处理的文件结束")
+        raise
+    finally:
+        scheduler.shutdown()
+
+def plan_batch_videos(folder_path, workers=None, history_path=THROUGHPUT_HISTORY_PATH, recursive=False,
+                      extensions=('.mkv',), patterns=None, output_mode="remux", **options):
+    """试运行批量处理：并行分析文件夹中的视频文件，列出将转换和跳过的文件、预计写入量和耗时，不修改任何文件"""
+    from throughput_history import ThroughputHistory
+    
+    video_files = find_video_files(folder_path, recursive=recursive, extensions=extensions, patterns=patterns,
+                                   output_suffix=options.get('output_suffix', "_simplified"),
+                                   include_sidecars=output_mode != 'remux')
+    if not video_files or not _check_ffmpeg():
+        return None
+    
+    # 分析以等待 ffprobe/ffmpeg 为主，线程数可以多于CPU核数
+    workers = workers or min(8, (os.cpu_count() or 1) * 2)
+    results = {}
+    _run_parallel(video_files, workers,
+                  lambda file_path: process_file(file_path, output_mode=output_mode, dry_run=True, **options),
+                  results.__setitem__)
+    
+    print("\n分析结果:")
+    rewrite_bytes = 0
+    convert_count = 0
+    for video_file in video_files:
+        result = results.get(video_file)
+        name = os.path.relpath(video_file, folder_path)
+        if result is None:
+            print(f"- [错误] {name}: 分析失败")
+            continue
+        label = {OUTCOME_CONVERTED: '将转换', OUTCOME_ERROR: '错误', OUTCOME_NOT_FOUND: '错误'}.get(result.outcome, '跳过')
+        print(f"- [{label}] {name}: {result.message}")
+        if result:
+            convert_count += 1
+            rewrite_bytes += result.estimated_rewrite_bytes
+    
+    history = ThroughputHistory(history_path)
+    serial_seconds = history.estimate_seconds(throughput_kind(output_mode, options.get('remux_engine', 'ffmpeg')),
+                                              rewrite_bytes, convert_count)
+    print(f"\n将转换 {convert_count} 个文件，跳过或出错 {len(video_files) - convert_count} 个，"
+          f"预计写入 {rewrite_bytes / (1024 * 1024 * 1024):.2f}GB")
+    if serial_seconds is None:
+        print("没有历史吞吐量数据，无法估算耗时")
+    else:
+        print(f"按历史吞吐量预计耗时 {serial_seconds / 60:.1f} 分钟（{serial_seconds:.0f} 秒）")
+    return [results.get(video_file) for video_file in video_files]
+
+def batch_process_videos(folder_path, jobs=1, recursive=False, extensions=('.mkv',), patterns=None,
+                         output_mode="remux", json_output=False, history_path=THROUGHPUT_HISTORY_PATH,
+                         limits=None, **options):
+    """批量处理文件夹中的视频文件
+    
+    Args:
+        folder_path: 文件夹路径
+        jobs: 同时处理的文件数
+        recursive, extensions, patterns: 文件查找条件，见 find_video_files
+        output_mode: remux、sidecar 或 both，sidecar/both 时同时转换已有的繁体外挂字幕
+        json_output: 为 True 时每处理完一个文件向标准输出写一行 JSON，其他输出写到标准错误
+        limits: io_throttle.IOLimits，降低 ffmpeg 优先级并限速，为 None 时不限制
+        options: replace_original、output_suffix、backup_original、remux_engine，传给 process_single_video
+    """
+    from throughput_history import ThroughputHistory
+    
+    # JSON 模式下标准输出只留给进度事件，处理日志改写到标准错误
+    progress_stream = sys.stdout
+    log_redirect = redirect_stdout(sys.stderr) if json_output else nullcontext()
+    
+    def emit(event, **fields):
+        progress_stream.write(json.dumps(dict(event=event, **fields), ensure_ascii=False) + "\n")
+        progress_stream.flush()
+    
+    with log_redirect:
+        video_files = find_video_files(folder_path, recursive=recursive, extensions=extensions, patterns=patterns,
+                                       output_suffix=options.get('output_suffix', "_simplified"),
+                                       include_sidecars=output_mode != 'remux')
+        if not video_files or not _check_ffmpeg():
+            if json_output:
+                emit('error', message='没有可处理的文件或缺少 ffmpeg')
+            return None
+        
+        # 记录实际转换的吞吐量，供 --plan 估算耗时
+        history = ThroughputHistory(history_path)
+        jobs = max(1, min(int(jobs), len(video_files)))
+        counts = {'processed': 0, 'skipped': 0, 'errors': 0}
+        start_time = time.time()
+        if json_output:
+            emit('start', total=len(video_files), jobs=jobs)
+        
+        def process(file_path):
+            try:
+                with io_limits(limits):
+                    return process_file(file_path, output_mode=output_mode, **options)
+            except Exception as e:
+                print(f"处理文件时出错 ({file_path}): {str(e)}")
+                return None
+        
+        def on_result(file_path, result):
+            history.record(result)
+            if result:
+                counts['processed'] += 1
+            elif result is None or result.outcome in (OUTCOME_ERROR, OUTCOME_NOT_FOUND):
+                counts['errors'] += 1
+            else:
+                counts['skipped'] += 1
+            done = sum(counts.values())
+            if json_output:
+                emit('file', index=done, total=len(video_files), file=file_path,
+                     success=bool(result), outcome=result.outcome if result is not None else OUTCOME_ERROR,
+                     message=result.message if result is not None else '处理失败',
+                     result=result.to_dict() if result is not None else None)
+            elif jobs > 1:
+                outcome = result.outcome if result is not None else OUTCOME_ERROR
+                print(f"[{done}/{len(video_files)}] {os.path.relpath(file_path, folder_path)}: {outcome}")
+        
+        interrupted = False
+        try:
+            if jobs == 1:
+                for i, video_file in enumerate(video_files, 1):
+                    print(f"\n[{i}/{len(video_files)}] ", end="")
+                    on_result(video_file, process(video_file))
+            else:
+                print(f"使用 {jobs} 个线程并行处理")
+                _run_parallel(video_files, jobs, process, on_result,
+                              disk_bytes=lambda file_path: estimate_remux_bytes(
+                                  file_path, options.get('replace_original', False),
+                                  options.get('backup_original', True), output_mode))
         except KeyboardInterrupt:
             print("\n用户中断操作")
-            break
-        except Exception as e:
-            print(f"处理文件时出错 ({mkv_file}): {str(e)}")
-            error_count += 1
+            interrupted = True
+        
+        duration = round(time.time() - start_time, 2)
+        print(f"\n批量处理完成:")
+        print(f"- 成功处理: {counts['processed']} 个文件")
+        if counts['skipped'] > 0:
+            print(f"- 无需处理: {counts['skipped']} 个文件")
+        if counts['errors'] > 0:
+            print(f"- 处理失败: {counts['errors']} 个文件")
+        print(f"- 耗时: {duration} 秒")
     
-    print(f"\n批量处理完成:")
-    print(f"- 成功处理: {processed_count} 个文件")
-    if error_count > 0:
-        print(f"- 处理失败: {error_count} 个文件")
+    if json_output:
+        emit('done', total=len(video_files), duration=duration, interrupted=interrupted, **counts)
+    return counts
 
 def main():
-    if len(sys.argv) != 2:
-        script_name = os.path.basename(__file__)
-        print(f"使用方法: python {script_name} <文件夹路径>")
-        print(f"例如: python {script_name} /path/to/videos")
-        print(f"例如: python {script_name} C:\\Videos")
-        return
-    
-    folder_path = sys.argv[1]
-    batch_process_videos(folder_path)
+    parser = argparse.ArgumentParser(description="将视频文件中的繁体中文字幕转换为简体中文字幕")
+    parser.add_argument("folder", help="视频文件夹路径，例如 /path/to/videos 或 C:\\Videos")
+    parser.add_argument("-r", "--recursive", action="store_true", help="同时处理子文件夹中的文件")
+    parser.add_argument("--ext", action="append", dest="extensions", metavar="EXT",
+                        help="要处理的视频扩展名，可重复指定（默认 .mkv）")
+    parser.add_argument("--glob", action="append", dest="patterns", metavar="PATTERN",
+                        help="只处理文件名或相对路径匹配的文件，如 \"*S01E*\"，可重复指定")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="同时处理的文件数（默认 1）")
+    parser.add_argument("--json", action="store_true", dest="json_output",
+                        help="每处理完一个文件向标准输出写一行 JSON 进度，日志写到标准错误")
+    parser.add_argument("--replace", action="store_true", dest="replace_original", help="替换原文件")
+    parser.add_argument("--suffix", default="_simplified", dest="output_suffix",
+                        help="不替换原文件时输出文件的后缀（默认 _simplified）")
+    parser.add_argument("--no-backup", action="store_false", dest="backup_original",
+                        help="替换原文件时不保留 *_backup 备份")
+    parser.add_argument("--output-mode", choices=OUTPUT_MODES, default="remux",
+                        help="remux 重新封装视频，sidecar 只写外挂字幕，both 两者都做（默认 remux）")
+    parser.add_argument("--engine", choices=REMUX_ENGINES, default="ffmpeg", dest="remux_engine",
+                        help="remux 模式的封装方式：ffmpeg 完整重新封装（默认）；inplace 在 MKV 中原地转换字幕轨，"
+                             "只写入字幕数据，无法原地转换时改用 ffmpeg")
+    parser.add_argument("--nice", type=int, default=0, help="ffmpeg 的 nice 值（如 10），降低 CPU 优先级")
+    parser.add_argument("--ionice", default="none", choices=["none", "best-effort", "idle"],
+                        help="ffmpeg 的 ionice 类别，idle 只在磁盘空闲时读写")
+    parser.add_argument("--read-limit-mb", type=float, default=0, help="所有 ffmpeg 合计的读取速度上限（MB/s）")
+    parser.add_argument("--write-limit-mb", type=float, default=0, help="所有 ffmpeg 合计的写入速度上限（MB/s）")
+    parser.add_argument("--plan", action="store_true",
+                        help="只分析不转换：列出将转换和跳过的文件、预计写入量和耗时")
+    args = parser.parse_args()
+    
+    if args.jobs < 1:
+        parser.error("--jobs 必须大于 0")
+    options = {
+        'recursive': args.recursive,
+        'extensions': args.extensions or ('.mkv',),
+        'patterns': args.patterns,
+        'output_mode': args.output_mode,
+        'replace_original': args.replace_original,
+        'output_suffix': args.output_suffix,
+        'backup_original': args.backup_original,
+        'remux_engine': args.remux_engine,
+    }
+    
+    limits = None
+    if args.nice or args.ionice != "none" or args.read_limit_mb or args.write_limit_mb:
+        from io_throttle import IOLimits
+        limits = IOLimits(nice=args.nice, ionice_class=args.ionice,
+                          read_limit_mb=args.read_limit_mb, write_limit_mb=args.write_limit_mb)
+    
+    if args.plan:
+        plan_batch_videos(args.folder, workers=args.jobs if args.jobs > 1 else None, **options)
+    else:
+        counts = batch_process_videos(args.folder, jobs=args.jobs, json_output=args.json_output,
+                                      limits=limits, **options)
+        if counts is None or counts['errors']:
+            sys.exit(1)
 
 if __name__ == "__main__":
     main()